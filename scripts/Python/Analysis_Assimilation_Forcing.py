@@ -6,6 +6,13 @@ import sys
 import datetime
 import getopt
 import re
+import time
+import numpy as np
+import Layering
+import CoverageMask
+import QpeBlend
+import FileOps
+import FileNames
 
 """Analysis_Assimilation_Forcing
 Performs regridding and downscaling, then bias
@@ -20,6 +27,22 @@ from where this script is executed.
 
 """
 
+# Fields taken from the 0hr and 3hr forecast files when layering
+FIELDS_0HR = ['T2D', 'Q2D', 'U2D', 'V2D', 'PSFC']
+FIELDS_3HR = ['LWDOWN', 'SWDOWN', 'RAINRATE']
+
+LDASIN_TITLE = "Combined HRRR/RAP/MRMS forcing for Analysis and " + \
+               "Assimilation WRF-Hydro configuration"
+
+# Sources of each variable, highest priority first, for each process
+# (1: RAP, 2: RAP/HRRR, 3: RAP/HRRR/MRMS).  QPE is the bias-weighted
+# RAP/HRRR/MRMS precipitation blend.
+LAYERING_PLANS = {
+    1: dict((name, ['RAP']) for name in FIELDS_0HR + FIELDS_3HR),
+    2: dict((name, ['HRRR', 'RAP']) for name in FIELDS_0HR + FIELDS_3HR),
+    3: dict((name, ['HRRR', 'RAP']) for name in FIELDS_0HR + FIELDS_3HR)}
+LAYERING_PLANS[3]['RAINRATE'] = ['QPE']
+
 
 def forcing(action, prod, file):
     """Peforms the action on the given data
@@ -64,56 +87,105 @@ def forcing(action, prod, file):
     # from the short-range configuration, so only 0hr forecast files are regridded/downscaled
     # here. In addition, MRMS data will be regridded, when available. 
     if action == 'regrid': 
-        (date,modelrun,fcsthr) = whf.extract_file_info(file)
-        # Usually check for forecast range, but only 0, 3 hr forecast/analysis data used
-   
-        # Check for HRRR, RAP, MRMS products. 
-        logging.info("Regridding and Downscaling for %s", product_data_name)
-
-        if fcsthr == 0 and prod == "HRRR":
-            downscale_dir = parser.get('downscaling', 'HRRR_downscale_output_dir_0hr')
-            regridded_file = whf.regrid_data(product_data_name,file,parser,False, \
-                             zero_process=True)
-            whf.downscale_data(product_data_name,regridded_file, parser,False, False, \
-                               zero_process=True)
-
-            # Move downscaled file to staging area where triggering will monitor
-            match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',regridded_file)
-            if match:
-                full_dir = downscale_dir + "/" + match.group(1)
-                full_finished_file = full_dir + "/" + match.group(2)
-                # File should have been created in downscale_data step.
-                whf.file_exists(full_finished_file)
-                whf.move_to_finished_area(parser, prod, full_finished_file, zero_move=True)
-        elif fcsthr == 0 and prod == "RAP":
-            downscale_dir = parser.get('downscaling', 'RAP_downscale_output_dir_0hr')
-            regridded_file = whf.regrid_data(product_data_name,file,parser,False, \
-                             zero_process=True)
-            whf.downscale_data(product_data_name,regridded_file, parser,False, False, \
-                               zero_process=True)
-            # Move downscaled file to staging area where triggering will monitor
-            match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',regridded_file)
-            if match:
-                full_dir = downscale_dir + "/" + match.group(1)
-                full_finished_file = full_dir + "/" + match.group(2)
-                # File should have been created in downscale_data step.
-                whf.file_exists(full_finished_file)
-                whf.move_to_finished_area(parser, prod, full_finished_file, zero_move=True) 
-        elif prod == "MRMS":
-            regridded_file = whf.regrid_data(product_data_name,file,parser,False)
-
-            # Move regridded file to staging area where triggering will monitor
-            # First make sure file exists
-            whf.file_exists(regridded_file)
-            whf.move_to_finished_area(parser, prod, regridded_file, zero_move=False)
-        else:
-            logging.error("Either invalid forecast hour or invalid product chosen")
-            logging.error("Only 00hr forecast files, and RAP/HRRR/MRMS valid")
-            return(1)
+        return regrid_file(parser, prod, file)
     else: # Invalid action selected
         logging.error("ERROR [Anal_Assim_Forcing]- Invalid action selected")
         return(1)
 
+def regrid_file(parser, prod, file):
+    """Regrids one file, the 'regrid' action: 0hr HRRR and RAP files
+       are regridded and downscaled, MRMS files regridded, and the
+       result moved to the finished area.
+
+       Args:
+           parser (SafeConfigParser): parser for the config/param file.
+           prod (string):  The product, HRRR, RAP or MRMS.
+           file (string):  The file name, as for forcing().
+       Returns:
+           status (int): 0 if successful, 1 otherwise.
+    """
+    product_data_name = prod.upper()
+    (date,modelrun,fcsthr) = whf.extract_file_info(file)
+    # Usually check for forecast range, but only 0, 3 hr forecast/analysis data used
+
+    # Check for HRRR, RAP, MRMS products. 
+    logging.info("Regridding and Downscaling for %s", product_data_name)
+
+    if fcsthr == 0 and prod in ("HRRR", "RAP"):
+        downscale_dir = parser.get('downscaling', prod + '_downscale_output_dir_0hr')
+        regridded_file = whf.regrid_data(product_data_name,file,parser,False, \
+                         zero_process=True)
+        if not regridded_file:
+            return 1
+        if whf.downscale_data(product_data_name,regridded_file, parser,False, False, \
+                              zero_process=True):
+            return 1
+
+        # Move downscaled file to staging area where triggering will monitor
+        parts = FileNames.ldasinParts(regridded_file)
+        if not parts:
+            logging.error("FAIL- cannot move finished file: %s", regridded_file)
+            return 1
+        full_dir = downscale_dir + "/" + parts[0]
+        full_finished_file = full_dir + "/" + parts[1]
+        # File should have been created in downscale_data step.
+        if whf.file_exists(full_finished_file):
+            return 1
+        whf.move_to_finished_area(parser, prod, full_finished_file, zero_move=True)
+    elif prod == "MRMS":
+        regridded_file = whf.regrid_data(product_data_name,file,parser,False)
+
+        # Move regridded file to staging area where triggering will monitor
+        # First make sure file exists
+        if not regridded_file or whf.file_exists(regridded_file):
+            return 1
+        whf.move_to_finished_area(parser, prod, regridded_file, zero_move=False)
+    else:
+        logging.error("Either invalid forecast hour or invalid product chosen")
+        logging.error("Only 00hr forecast files, and RAP/HRRR/MRMS valid")
+        return(1)
+    return 0
+
+def layer_fields(process, paths, coverage, grids):
+    """ Layer RAP/HRRR fields and combine precipitation, in memory.
+        Non-precipitation fields come from the 0hr (T2D, Q2D, U2D,
+        V2D, PSFC) and 3hr (LWDOWN, SWDOWN) forecast files, with RAP
+        filling cells HRRR does not cover. Precipitation is RAP only,
+        HRRR layered over RAP, or the bias-weighted RAP/HRRR/MRMS
+        blend, depending on process. The sources of each variable
+        are given by LAYERING_PLANS.
+
+        Args:
+            process (int): 1 (RAP), 2 (RAP/HRRR) or 3 (RAP/HRRR/MRMS).
+            paths (dict): Full paths of the 'rap0', 'rap3', 'hrrr0',
+                          'hrrr3' and 'mrms' input files.
+            coverage (CoverageMask.Coverage): HRRR coverage mask.
+            grids (dict): Monthly bias and weight grids (see
+                          QpeBlend.cacheFor), process 3 only.
+        Returns:
+            fields (dict): variable name -> 2-D layered field.
+    """
+    sources = {'RAP': Layering.readFields(paths['rap0'], FIELDS_0HR)}
+    sources['RAP'].update(Layering.readFields(paths['rap3'], FIELDS_3HR))
+    missing = {}
+    if process >= 2:
+        sources['HRRR'] = Layering.readFields(paths['hrrr0'], FIELDS_0HR)
+        sources['HRRR'].update(Layering.readFields(paths['hrrr3'], FIELDS_3HR))
+        missing['HRRR'] = coverage.missing(sources['HRRR']['T2D'])
+    if process == 3:
+        mrms = Layering.readFields(paths['mrms'], ['precip_rate'])
+        rain = QpeBlend.blend(_nan_missing(sources['RAP']['RAINRATE']),
+                              _nan_missing(sources['HRRR']['RAINRATE']),
+                              _nan_missing(mrms['precip_rate']), grids)
+        sources['QPE'] = {'RAINRATE': np.where(np.isnan(rain),
+                                               Layering.FILL_VALUE, rain)}
+    return Layering.mosaic(LAYERING_PLANS[process], sources, missing)
+
+def _nan_missing(field):
+    """ Return a copy of a field with missing values set to NaN.
+    """
+    return np.where(Layering.missingMask(field), np.nan, field)
+
 def anal_assim_layer(cycleYYYYMMDDHH,fhr,action):
     """ Analysis and Assimilation layering
         Performs layering/combination of RAP/HRRR/MRMS
@@ -157,26 +229,22 @@ def anal_assim_layer(cycleYYYYMMDDHH,fhr,action):
     parser = SafeConfigParser()
     parser.read('/d4/karsten/DFE/wrf_hydro_forcing/parm/wrf_hydro_forcing.parm')
     out_dir = parser.get('layering','analysis_assimilation_output')
-    tmp_dir = parser.get('layering','analysis_assimilation_tmp')
     qpe_parm_dir = parser.get('layering','qpe_combine_parm_dir')
     hrrr_ds_dir_3hr = parser.get('downscaling','HRRR_finished_output_dir')
     hrrr_ds_dir_0hr = parser.get('downscaling','HRRR_finished_output_dir_0hr')
     rap_ds_dir_3hr = parser.get('downscaling','RAP_finished_output_dir')
     rap_ds_dir_0hr = parser.get('downscaling','RAP_finished_output_dir_0hr')
     mrms_ds_dir = parser.get('regridding','MRMS_finished_output_dir')
-    layer_exe = parser.get('exe','Analysis_Assimilation_layering')
-    ncl_exec = parser.get('exe', 'ncl_exe')
+    qpe_cache_dir = parser.get('layering','qpe_combine_cache_dir')
 
     # Sanity checking
     whf.dir_exists(out_dir)
-    whf.dir_exists(tmp_dir)
     whf.dir_exists(qpe_parm_dir)
     whf.dir_exists(hrrr_ds_dir_3hr)
     whf.dir_exists(hrrr_ds_dir_0hr)
     whf.dir_exists(rap_ds_dir_3hr)
     whf.dir_exists(rap_ds_dir_0hr)
     whf.dir_exists(mrms_ds_dir)
-    whf.file_exists(layer_exe)
 
     # Establish final output directories to hold 'LDASIN' files used for
     # WRF-Hydro long-range forecasting. If the directory does not exist,
@@ -219,29 +287,13 @@ def anal_assim_layer(cycleYYYYMMDDHH,fhr,action):
                 "/" + validDate.strftime("%Y%m%d%H") + "00.LDASIN_DOMAIN1.nc"
     mrmsPath = mrms_ds_dir + "/" + validDate.strftime("%Y%m%d%H") + \
                 "/" + validDate.strftime("%Y%m%d%H") + "00.LDASIN_DOMAIN1.nc"
-    hrrrBiasPath = qpe_parm_dir + "/HRRR_CMC-CPC_bias-corr_m" + \
-                   validDate.strftime("%m") + "_v8_wrf1km.grb2"
-    hrrrWgtPath = qpe_parm_dir + "/HRRR_wgt_m" + \
-                  validDate.strftime("%m") + "_v7_wrf1km.grb2"
-    mrmsBiasPath = qpe_parm_dir + "/MRMS_radonly_CMC-CPC_bias-corr_m" + \
-                   validDate.strftime("%m") + "_v8_wrf1km.grb2"
-    mrmsWgtPath = qpe_parm_dir + "/MRMS_radonly_wgt_m" + \
-                  validDate.strftime("%m") + "_v7_wrf1km.grb2"
-    rapBiasPath = qpe_parm_dir + "/RAPD_CMC-CPC_bias-corr_m" + \
-                  validDate.strftime("%m") + "_v8_wrf1km.grb2"
-    rapWgtPath = qpe_parm_dir + "/RAPD_wgt_m" + \
-                 validDate.strftime("%m") + "_v7_wrf1km.grb2"
+    param_files = QpeBlend.parameterFiles(qpe_parm_dir, validDate.month)
 
     # Sanity checking on parameter data
-    whf.file_exists(hrrrBiasPath)
-    whf.file_exists(hrrrWgtPath)
-    whf.file_exists(mrmsBiasPath)
-    whf.file_exists(mrmsWgtPath)
-    whf.file_exists(rapBiasPath)
-    whf.file_exists(rapWgtPath) 
-
-    # Compose output file paths
-    LDASIN_path_tmp = tmp_dir + "/" + validDate.strftime('%Y%m%d%H') + "00.LDASIN_DOMAIN1_TMP.nc"
+    for param_file in param_files.values():
+        whf.file_exists(param_file)
+
+    # Compose output file path, no .nc extension for WRF-Hydro
     LDASIN_path_final = out_path + "/" + validDate.strftime('%Y%m%d%H') + "00.LDASIN_DOMAIN1"
     # Perform layering/combining depending on processing path.
     if process == 1:    # RAP only
@@ -274,43 +326,22 @@ def anal_assim_layer(cycleYYYYMMDDHH,fhr,action):
         logging.error("Invalid input action selected")
         return(1)
 
-    hrrrB_param = "'hrrrBFile=" + '"' + hrrrBiasPath + '"' + "' "
-    mrmsB_param = "'mrmsBFile=" + '"' + mrmsBiasPath + '"' + "' "
-    rapB_param = "'rapBFile=" + '"' + rapBiasPath + '"' + "' "
-    hrrrW_param = "'hrrrWFile=" + '"' + hrrrWgtPath + '"' + "' "
-    mrmsW_param = "'mrmsWFile=" + '"' + mrmsWgtPath + '"' + "' "
-    rapW_param = "'rapWFile=" + '"' + rapWgtPath + '"' + "' "
-    hrrr0_param = "'hrrr0File=" + '"' + hrrr0Path + '"' + "' "
-    hrrr3_param = "'hrrr3File=" + '"' + hrrr3Path + '"' + "' "
-    rap0_param = "'rap0File=" + '"' + rap0Path + '"' + "' "
-    rap3_param = "'rap3File=" + '"' + rap3Path + '"' + "' "
-    mrms_param = "'mrmsFile=" + '"' + mrmsPath + '"' + "' "
-    process_param = "'process=" + '"' + str(process) + '"' + "' "
-    out_param = "'outPath=" + '"' + LDASIN_path_tmp + '"' + "' "
-     
-    cmd_params = hrrrB_param + mrmsB_param + rapB_param + \
-                 hrrrW_param + mrmsW_param + rapW_param + \
-                 hrrr0_param + hrrr3_param + rap0_param + rap3_param + \
-                 mrms_param + process_param + out_param
-    cmd = ncl_exec + " -Q " + cmd_params + " " + layer_exe
-    status = os.system(cmd)
-
-    if status != 0:
-        logging.error("Error in combinining NCL program")
-        return(1)
-   
-    # Double check to make sure file was created, delete temporary regridded file
-    whf.file_exists(LDASIN_path_tmp)
-    # Rename file to conform to WRF-Hydro expectations
-    cmd = "mv " + LDASIN_path_tmp + " " + LDASIN_path_final
-    status = os.system(cmd)
-    if status != 0:
-        logging.error("Failure to rename " + LDASIN_path_tmp)
-    whf.file_exists(LDASIN_path_final)
-    cmd = "rm -rf " + LDASIN_path_tmp 
-    status = os.system(cmd)
-    if status != 0:
-        logging.error("Failure to remove " + LDASIN_path_tmp)
+    paths = {'hrrr0': hrrr0Path, 'hrrr3': hrrr3Path, 'rap0': rap0Path,
+             'rap3': rap3Path, 'mrms': mrmsPath}
+    start = time.time()
+    coverage = CoverageMask.coverageFor(parser, 'HRRR')
+    grids = None
+    if process == 3:
+        grids = QpeBlend.cacheFor(qpe_cache_dir).grids(qpe_parm_dir,
+                                                       validDate.month)
+    fields = layer_fields(process, paths, coverage, grids)
+    # Written under a temporary name in out_path, then renamed in place
+    status = FileOps.writeAtomic(LDASIN_path_final,
+                                 lambda tmp: Layering.writeLdasin(tmp, fields,
+                                                                  LDASIN_TITLE))
+    logging.info("Time(sec) to layer and combine: %s", time.time() - start)
+    if not status:
+        logging.error("Failure to write " + LDASIN_path_final)
         return(1)
     # Exit gracefully with an exit status of 0
     return(0)
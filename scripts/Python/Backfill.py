@@ -0,0 +1,258 @@
+"""Backfill
+Reprocesses all inputs with issue time in a date range, for example to
+rebuild retrospective forcing after a parm file change.  Every input of
+the chosen types in the range becomes tasks in one graph (see
+ForcingScheduler.Pipelines): regrid -> downscale -> finish and Short
+Range layering for HRRR/RAP, single tasks for 0 hour, MRMS, GFS and CFS
+(bias correction through downscaling) files, all run on one worker pool.
+
+Each task that makes an output is appended to a checkpoint file when
+done.  A run that is interrupted and started again with the same
+checkpoint file skips those tasks.  Remove the checkpoint file to redo
+everything.
+
+Unlike the real time drivers, layering waits for HRRR as long as it
+takes; RAP is passed through only where HRRR is missing or fails.
+Regrid state files are not used or changed.
+
+If job_queue_file is set, the tasks are put in that job queue instead
+(see JobQueue.py) and run by QueueWorker.py on any number of hosts;
+this then only waits for them.  The queue keeps done tasks, so there is
+no checkpoint file, and starting again queues failed tasks again.
+
+Usage:  python Backfill.py <parm file> <first yyyymmddhh> <last yyyymmddhh>
+                           [type ...]
+   type: HRRR, RAP, MRMS, GFS, CFS (all if none given)
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import datetime
+import threading
+from ConfigParser import SafeConfigParser
+import DataFiles as df
+import Regrid_Driver as rd
+import LongRangeRegridDriver as lrd
+import ForcingScheduler as fs
+import QueueWorker as qw
+import JobQueue
+import Scheduler
+import Staging
+import WRF_Hydro_forcing as whf
+
+#----------------------------------------------------------------------------
+# Input types that can be backfilled
+BACKFILL_TYPES = fs.FILE_TYPES + ['CFS']
+
+# Checkpoint file, if not in the parm file
+DEFAULT_CHECKPOINT_FILE = "./Backfill.checkpoint"
+
+# Seconds between progress messages
+PROGRESS_SECONDS = 300
+
+#----------------------------------------------------------------------------
+class Checkpoint:
+   """Append-only record of the tasks done, one JSON [name, result] line
+   per task, flushed to disk as each is added
+
+   Attributes
+   ----------
+   _path: str
+      File name
+   _done: dict
+      task name -> result
+   _lock: threading.Lock
+      Serializes appends from the worker threads
+   """
+
+   def __init__(self, path):
+      """Read what earlier runs recorded
+
+      Parameters
+      ----------
+      path: str
+         File name, created if it does not exist
+      """
+      self._path = path
+      self._done = {}
+      self._lock = threading.Lock()
+      if (not os.path.exists(path)):
+         return
+      with open(path) as f:
+         for line in f:
+            try:
+               name, result = json.loads(line)
+            except ValueError:
+               # last line of an interrupted append
+               logging.warning("Ignoring partial line in %s", path)
+               continue
+            self._done[name] = result
+
+   def size(self):
+      """Return the number of tasks recorded
+
+      Returns
+      -------
+      int
+      """
+      return len(self._done)
+
+   def done(self, name):
+      """Check if a task was recorded as done
+
+      Parameters
+      ----------
+      name: str
+         Task name
+
+      Returns
+      -------
+      bool
+      """
+      return name in self._done
+
+   def result(self, name):
+      """Return the recorded result of a task
+
+      Parameters
+      ----------
+      name: str
+         Task name
+
+      Returns
+      -------
+         The result, None if not recorded
+      """
+      return self._done.get(name)
+
+   def record(self, name, result):
+      """Record a task as done
+
+      Parameters
+      ----------
+      name: str
+         Task name
+      result:
+         Its result, kept only if it is a string (a file name)
+      """
+      if (not isinstance(result, basestring)):
+         result = None
+      line = json.dumps([name, result]) + "\n"
+      with self._lock:
+         with open(self._path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+         self._done[name] = result
+
+#----------------------------------------------------------------------------
+def inputFiles(configFile, fileType, firstIssue, lastIssue):
+   """Return the input files of a type with issue time in a range
+
+   Parameters
+   ----------
+   configFile: str
+      Name of param file
+   fileType: str
+      'HRRR', ..., 'CFS'
+   firstIssue: datetime.datetime
+   lastIssue: datetime.datetime
+
+   Returns
+   -------
+   list[str]
+      file names with yyyymmdd parent dir, oldest first
+   """
+   if (fileType == 'CFS'):
+      parms = lrd.parmRead(configFile)
+      data = df.DataFiles(parms._cfsDir, parms._maxFcstHourCfs, fileType)
+   else:
+      parms = rd.parmRead(configFile, fileType)
+      data = df.DataFiles(parms._dataDir, parms._maxFcstHour, fileType)
+   data.setFilesInRange(firstIssue, lastIssue)
+   return data.getFnames()
+
+#----------------------------------------------------------------------------
+def main(argv):
+
+   if (len(argv) < 3):
+      print 'Usage: Backfill.py <parm file> <first yyyymmddhh> <last yyyymmddhh> [type ...]'
+      return 1
+   configFile = argv[0]
+   if not os.path.exists(configFile):
+      print 'ERROR forcing engine config file not found.'
+      return 1
+   try:
+      firstIssue = datetime.datetime.strptime(argv[1], "%Y%m%d%H")
+      lastIssue = datetime.datetime.strptime(argv[2], "%Y%m%d%H")
+   except ValueError:
+      print 'ERROR times must be yyyymmddhh'
+      return 1
+   fileTypes = argv[3:] or BACKFILL_TYPES
+   for fileType in fileTypes:
+      if (fileType not in BACKFILL_TYPES):
+         print 'ERROR unknown type ' + fileType
+         return 1
+
+   parser = SafeConfigParser()
+   parser.read(configFile)
+   fs.setupLogging(parser, "Backfill.log")
+   # the NCL environment for the tasks (see ForcingScheduler.main)
+   whf.initial_setup(parser, "Backfill")
+   if (parser.has_option('triggering', 'scheduler_num_workers')):
+      numWorkers = int(parser.get('triggering', 'scheduler_num_workers'))
+   else:
+      numWorkers = fs.DEFAULT_NUM_WORKERS
+   if (parser.has_option('triggering', 'backfill_checkpoint_file')):
+      checkpointFile = parser.get('triggering', 'backfill_checkpoint_file')
+   else:
+      checkpointFile = DEFAULT_CHECKPOINT_FILE
+
+   queueFile, leaseSeconds, maxAttempts = qw.queueParms(parser)
+
+   if (queueFile):
+      logging.info("Backfill %s to %s, %s, into %s", firstIssue, lastIssue,
+                   " ".join(fileTypes), queueFile)
+      scheduler = JobQueue.QueueScheduler(JobQueue.JobQueue(queueFile,
+                                                            leaseSeconds,
+                                                            maxAttempts))
+      pipelines = fs.Pipelines(parser, scheduler, deadlines=0)
+   else:
+      checkpoint = Checkpoint(checkpointFile)
+      logging.info("Backfill %s to %s, %s, %d tasks already done",
+                   firstIssue, lastIssue, " ".join(fileTypes),
+                   checkpoint.size())
+      # nothing urgent runs, so batch work is never throttled
+      scheduler = Scheduler.Scheduler(numWorkers, numWorkers,
+                                      Staging.lookahead(parser))
+      pipelines = fs.Pipelines(parser, scheduler, checkpoint, deadlines=0)
+   for fileType in fileTypes:
+      files = inputFiles(configFile, fileType, firstIssue, lastIssue)
+      logging.info("%d %s files", len(files), fileType)
+      for f in files:
+         pipelines.addFile(fileType, f)
+
+   # HRRR inputs that are not there will not come, layer with RAP only
+   n = scheduler.failMissing("no input in the backfill range")
+   logging.info("%d inputs missing", n)
+
+   lastProgress = time.time()
+   while (not scheduler.wait(PROGRESS_SECONDS)):
+      if (time.time() - lastProgress >= PROGRESS_SECONDS):
+         logging.info("Progress: %s", scheduler.counts())
+         lastProgress = time.time()
+   counts = scheduler.counts()
+   logging.info("Backfill done: %s", counts)
+   if (counts.get(Scheduler.WAITING, 0) > 0):
+      logging.error("%d tasks never became ready", counts[Scheduler.WAITING])
+   if (counts.get(Scheduler.FAILED, 0) > n):
+      return 1
+   return 0
+
+#----------------------------------------------
+
+if __name__ == "__main__":
+   sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,278 @@
+"""Catalog
+Catalog of input and intermediate files in an SQLite database, shared by
+the drivers (see DataFiles.useCatalog).
+
+Each input file is recorded once, with its parsed product, issue time,
+forecast hour and ensemble member, and a processing status.  A
+yyyymmdd directory is listed again only when its mtime changed, so after
+the first scan the drivers read file lists and status from indexed
+queries instead of the file system.  Size and mtime are recorded when a
+file is found to be complete.
+
+Intermediate files (downscaled or regridded files moved to a finished
+area, which ShortRangeLayeringDriver looks up) are recorded with an empty
+top directory and their full path as name.
+"""
+
+import os
+import time
+import logging
+import threading
+import SqliteDb
+
+#----------------------------------------------------------------------------
+# File states, in processing order
+NEW = 'new'
+COMPLETE = 'complete'
+REGRIDDED = 'regridded'
+FINISHED = 'finished'
+
+_SCHEMA = """
+create table if not exists files (
+   top text not null,
+   name text not null,
+   product text not null,
+   issue integer,
+   lead integer,
+   member integer,
+   size integer,
+   mtime real,
+   status text not null,
+   updated real,
+   primary key (top, name)
+);
+create index if not exists files_time on files (top, product, issue, lead);
+create index if not exists files_status on files (status);
+create table if not exists dirs (
+   path text primary key,
+   mtime real,
+   listed real
+);
+"""
+
+#----------------------------------------------------------------------------
+class Catalog:
+   """The file catalog
+
+   Attributes
+   ----------
+   _path: str
+      Database file
+   _db: sqlite3.Connection
+      In autocommit mode, writes are in IMMEDIATE transactions
+   _lock: threading.Lock
+      Serializes use of the connection
+   """
+
+   def __init__(self, path):
+      """Open, creating the tables if needed
+
+      Parameters
+      ----------
+      path: str
+         Database file
+      """
+      self._path = path
+      dirName = os.path.dirname(path)
+      if (dirName and not os.path.isdir(dirName)):
+         os.makedirs(dirName)
+      self._db = SqliteDb.connect(path, _SCHEMA)
+      self._lock = threading.Lock()
+
+   def close(self):
+      """Close the connection
+      """
+      self._db.close()
+
+   def dirState(self, path):
+      """Return what was recorded when a directory was last listed
+
+      Parameters
+      ----------
+      path: str
+         Full path directory name
+
+      Returns
+      -------
+      tuple
+         (mtime, time listed), None if never listed
+      """
+      with self._lock:
+         return self._db.execute("select mtime, listed from dirs "
+                                 "where path = ?", (path,)).fetchone()
+
+   def replaceDir(self, top, ymdDir, product, mtime, listedAt, entries):
+      """Record the listing of a yyyymmdd directory: add the new files,
+      remove the ones that are gone, keep status of the others
+
+      Parameters
+      ----------
+      top: str
+         Top directory
+      ymdDir: str
+         yyyymmdd subdirectory of top
+      product: str
+         'HRRR', ..., 'CFS'
+      mtime: float
+         Directory mtime when listed
+      listedAt: float
+         Time listed
+      entries: list[tuple]
+         (name with yyyymmdd parent dir, issue hours since 1970 or -1,
+         forecast hour, ensemble member or -1) of each file
+      """
+      now = time.time()
+      with self._lock:
+         with SqliteDb.Transaction(self._db):
+            old = set(r[0] for r in self._db.execute(
+               "select name from files where top = ? and name like ?",
+               (top, ymdDir + "/%")))
+            new = set(e[0] for e in entries)
+            self._db.executemany(
+               "delete from files where top = ? and name = ?",
+               [(top, name) for name in old - new])
+            self._db.executemany(
+               "insert into files (top, name, product, issue, lead, "
+               "member, status, updated) values (?, ?, ?, ?, ?, ?, ?, ?)",
+               [(top, e[0], product, e[1], e[2], e[3], NEW, now)
+                for e in entries if e[0] not in old])
+            self._db.execute("insert or replace into dirs (path, mtime, "
+                             "listed) values (?, ?, ?)",
+                             (os.path.join(top, ymdDir), mtime, listedAt))
+
+   def forgetDir(self, top, ymdDir):
+      """Remove a directory that no longer exists and its files
+
+      Parameters
+      ----------
+      top: str
+         Top directory
+      ymdDir: str
+         yyyymmdd subdirectory of top
+      """
+      with self._lock:
+         with SqliteDb.Transaction(self._db):
+            self._db.execute("delete from files where top = ? and name like ?",
+                             (top, ymdDir + "/%"))
+            self._db.execute("delete from dirs where path = ?",
+                             (os.path.join(top, ymdDir),))
+
+   def dirFiles(self, top, ymdDir, maxLead):
+      """Return the parsed files of a directory, by name
+
+      Parameters
+      ----------
+      top: str
+         Top directory
+      ymdDir: str
+         yyyymmdd subdirectory of top
+      maxLead: int
+         Maximum forecast hour
+
+      Returns
+      -------
+      list[tuple]
+         (name with yyyymmdd parent dir, issue, forecast hour)
+      """
+      with self._lock:
+         return self._db.execute(
+            "select name, issue, lead from files where top = ? and "
+            "name like ? and issue >= 0 and lead <= ? order by name",
+            (top, ymdDir + "/%", maxLead)).fetchall()
+
+   def files(self, top, product, oldest, newest, maxLead):
+      """Return the parsed files of a product in a time range
+
+      Parameters
+      ----------
+      top: str
+         Top directory
+      product: str
+         'HRRR', ..., 'CFS'
+      oldest: tuple
+         (issue, forecast hour) of the earliest allowed time
+      newest: tuple
+         (issue, forecast hour) of the latest allowed time
+      maxLead: int
+         Maximum forecast hour
+
+      Returns
+      -------
+      list[tuple]
+         (name with yyyymmdd parent dir, issue, forecast hour), in time
+         order
+      """
+      with self._lock:
+         return self._db.execute(
+            "select name, issue, lead from files where top = ? and "
+            "product = ? and issue between ? and ? and lead <= ? and "
+            "(issue > ? or lead >= ?) and (issue < ? or lead <= ?) "
+            "order by issue, lead, name",
+            (top, product, oldest[0], newest[0], maxLead,
+             oldest[0], oldest[1], newest[0], newest[1])).fetchall()
+
+   def status(self, top, name):
+      """Return the status of a file
+
+      Parameters
+      ----------
+      top: str
+         Top directory, empty for intermediate files
+      name: str
+         Name in top
+
+      Returns
+      -------
+      str
+         The status, None if not in the catalog
+      """
+      with self._lock:
+         row = self._db.execute("select status from files where top = ? "
+                                "and name = ?", (top, name)).fetchone()
+      if (row is None):
+         return None
+      return row[0]
+
+   def setStatus(self, top, name, product, status, size=None, mtime=None):
+      """Set the status of a file, adding it if not in the catalog
+
+      Parameters
+      ----------
+      top: str
+         Top directory, empty for intermediate files
+      name: str
+         Name in top
+      product: str
+         'HRRR', ..., 'CFS', used if the file is added
+      status: str
+         NEW, ...
+      size: int
+         Size, if known
+      mtime: float
+         Modification time, if known
+      """
+      now = time.time()
+      with self._lock:
+         with SqliteDb.Transaction(self._db):
+            n = self._db.execute(
+               "update files set status = ?, size = coalesce(?, size), "
+               "mtime = coalesce(?, mtime), updated = ? where top = ? and "
+               "name = ?", (status, size, mtime, now, top, name)).rowcount
+            if (n == 0):
+               self._db.execute(
+                  "insert into files (top, name, product, issue, lead, "
+                  "member, size, mtime, status, updated) values "
+                  "(?, ?, ?, -1, -1, -1, ?, ?, ?, ?)",
+                  (top, name, product, size, mtime, status, now))
+
+   def counts(self):
+      """Return the number of files in each status
+
+      Returns
+      -------
+      dict
+         status -> number
+      """
+      with self._lock:
+         return dict(self._db.execute("select status, count(*) from files "
+                                      "group by status").fetchall())
@@ -0,0 +1,279 @@
+"""CoverageMask
+Persistent cache of where a source product has no data on a destination
+grid (e.g. the HRRR domain edges on the 1 km WRF-Hydro grid).  Each mask
+is built once from a field of incoming data, stored as a packed bit
+array in a known cache directory, and re-validated against a sample of
+each new field before use, so the Short Range and Analysis/Assimilation
+layering share it with no per-job recomputation.  Replaces the
+index.nc two-pass workflow of combine.ncl.
+"""
+
+import os
+import logging
+import hashlib
+import tempfile
+import threading
+import numpy as np
+import Layering
+
+#----------------------------------------------------------------------------
+# Number of grid cells checked against each incoming field
+DEFAULT_SAMPLE_SIZE = 4096
+
+# File name extension for stored masks
+MASK_EXTENSION = ".mask.npz"
+
+# cache directory -> CoverageMaskCache, shared by all callers in a process
+_caches = {}
+_cachesLock = threading.Lock()
+
+#----------------------------------------------------------------------------
+def coverageFor(parser, product, cache=None):
+    """Return the Coverage of a product on its destination grid
+
+    Parameters
+    ----------
+    parser : SafeConfigParser
+       parser for the wrf_hydro_forcing.parm config/param file
+    product : str
+       'HRRR', 'RAP', 'MRMS', ...
+    cache : CoverageMaskCache
+       cache to use, or None for the one of the config/param file's
+       cache directory
+
+    Returns
+    -------
+    Coverage
+    """
+    if (cache is None):
+        cache = cacheFor(parser.get('layering', 'coverage_mask_dir'))
+    dstGrid = parser.get('regridding', product.upper() + '_dst_grid_name')
+    return cache.coverage(product, dstGrid)
+
+#----------------------------------------------------------------------------
+def cacheFor(cacheDir):
+    """Return the cache of a directory, created on first use and then
+    shared by all callers in this process, so masks are read once
+
+    Parameters
+    ----------
+    cacheDir : str
+       Directory in which the packed masks are stored
+
+    Returns
+    -------
+    CoverageMaskCache
+    """
+    with _cachesLock:
+        cache = _caches.get(cacheDir)
+        if (cache is None):
+            cache = CoverageMaskCache(cacheDir)
+            _caches[cacheDir] = cache
+        return cache
+
+#----------------------------------------------------------------------------
+class CoverageMaskCache:
+    """Missing-data masks keyed by source product and destination grid
+
+    Attributes
+    ----------
+    _cacheDir : str
+       Directory in which the packed masks are stored
+    _sampleSize : int
+       Number of cells compared when validating a mask against new data
+    _masks : dict
+       key -> numpy bool array, masks already loaded by this process
+    """
+
+    def __init__(self, cacheDir, sampleSize=DEFAULT_SAMPLE_SIZE):
+        """Initialization using input args
+
+        Parameters
+        ----------
+        cacheDir : str
+           Directory in which the packed masks are stored
+        sampleSize : int
+           Number of cells compared when validating a mask
+        """
+        self._cacheDir = cacheDir
+        self._sampleSize = sampleSize
+        self._masks = {}
+
+    def coverage(self, product, dstGrid):
+        """Return the Coverage of a product on a destination grid
+
+        Parameters
+        ----------
+        product : str
+           Source product, 'HRRR', 'RAP', ...
+        dstGrid : str
+           Full path to the destination grid file
+
+        Returns
+        -------
+        Coverage
+        """
+        return Coverage(self, self._key(product, dstGrid))
+
+    def missing(self, key, field):
+        """Return the missing-data mask for a key, checked against a field
+
+        The stored mask is used when its shape matches the field and it
+        agrees with the field on a sample of cells, otherwise it is
+        rebuilt from the field and stored.
+
+        Parameters
+        ----------
+        key : str
+           Cache key, as built by _key()
+        field : numpy.ndarray
+           2-D field of incoming data for the product
+
+        Returns
+        -------
+        numpy.ndarray
+           bool array, True where the product has no data
+        """
+        mask = self._masks.get(key)
+        if (mask is None):
+            mask = self._read(key)
+        if (mask is not None and not self._validates(mask, field)):
+            logging.warning("Coverage mask %s does not match incoming data, "
+                            "rebuilding", key)
+            mask = None
+        if (mask is None):
+            mask = Layering.missingMask(field)
+            self._write(key, mask)
+        self._masks[key] = mask
+        return mask
+
+    def _key(self, product, dstGrid):
+        """Build the cache key for a product and destination grid
+
+        The grid part of the key changes whenever the grid file does.
+
+        Parameters
+        ----------
+        product : str
+        dstGrid : str
+
+        Returns
+        -------
+        str
+        """
+        gridId = dstGrid
+        if (os.path.exists(dstGrid)):
+            st = os.stat(dstGrid)
+            gridId += ":%d:%d" %(st.st_size, int(st.st_mtime))
+        digest = hashlib.md5(gridId.encode('utf-8')).hexdigest()[0:12]
+        name = os.path.splitext(os.path.basename(dstGrid))[0]
+        return product.upper() + "_" + name + "_" + digest
+
+    def _path(self, key):
+        """Full path of the stored mask for a key
+        """
+        return os.path.join(self._cacheDir, key + MASK_EXTENSION)
+
+    def _validates(self, mask, field):
+        """Check a mask against a sample of cells in a field
+
+        Parameters
+        ----------
+        mask : numpy.ndarray
+        field : numpy.ndarray
+
+        Returns
+        -------
+        bool
+           True if the shapes agree and the sampled cells all match
+        """
+        if (mask.shape != field.shape):
+            return 0
+        n = min(self._sampleSize, mask.size)
+        sample = np.linspace(0, mask.size - 1, n).astype(np.intp)
+        flat = field.reshape(-1)[sample]
+        return np.array_equal(mask.reshape(-1)[sample],
+                              Layering.missingMask(flat))
+
+    def _read(self, key):
+        """Read a stored mask, or return None if there isn't one
+
+        Parameters
+        ----------
+        key : str
+
+        Returns
+        -------
+        numpy.ndarray or None
+        """
+        path = self._path(key)
+        if (not os.path.exists(path)):
+            return None
+        try:
+            stored = np.load(path)
+            shape = tuple(stored['shape'])
+            size = int(np.prod(shape))
+            bits = np.unpackbits(stored['bits'])[0:size]
+            return bits.astype(bool).reshape(shape)
+        except Exception as e:
+            logging.warning("Unreadable coverage mask %s: %s", path, e)
+            return None
+
+    def _write(self, key, mask):
+        """Store a mask as a packed bit array
+
+        The mask is written to a temporary file in the cache directory
+        and renamed into place, so concurrent jobs never see a partial
+        file.
+
+        Parameters
+        ----------
+        key : str
+        mask : numpy.ndarray
+        """
+        if (not os.path.isdir(self._cacheDir)):
+            os.makedirs(self._cacheDir)
+        fd, tmpPath = tempfile.mkstemp(prefix="." + key, dir=self._cacheDir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, shape=np.array(mask.shape),
+                         bits=np.packbits(mask.reshape(-1)))
+            os.rename(tmpPath, self._path(key))
+            logging.info("Stored coverage mask %s", self._path(key))
+        except (IOError, OSError) as e:
+            logging.error("Failed to store coverage mask %s: %s", key, e)
+            if (os.path.exists(tmpPath)):
+                os.remove(tmpPath)
+
+#----------------------------------------------------------------------------
+class Coverage:
+    """Coverage of one product on one destination grid
+
+    Attributes
+    ----------
+    _cache : CoverageMaskCache
+       The cache that holds the mask
+    _key : str
+       Cache key of the product and destination grid
+    """
+
+    def __init__(self, cache, key):
+        """Initialization using input args
+        """
+        self._cache = cache
+        self._key = key
+
+    def missing(self, field):
+        """Return the missing-data mask, checked against a field
+
+        Parameters
+        ----------
+        field : numpy.ndarray
+           2-D field of incoming data for the product
+
+        Returns
+        -------
+        numpy.ndarray
+           bool array, True where the product has no data
+        """
+        return self._cache.missing(self._key, field)
@@ -4,14 +4,398 @@ Handles individual and grouped data files.
 
 import os
 #import sys
+import json
+import time
 import logging
+import bisect
 import datetime
+import threading
+import FileOps
+import DirScan
+import Catalog
 #import time
 #from ConfigParser import SafeConfigParser
 #import Short_Range_Forcing as srf
 #import Analysis_Assimilation_Forcing as aaf
 #import Medium_Range_Forcing as mrf
 
+#----------------------------------------------------------------------------
+# Extensions of GRIB files, which end with a '7777' marker when complete
+GRIB_EXTENSIONS = ('.grb', '.grb2', '.grib', '.grib2')
+GRIB_END = b'7777'
+
+#----------------------------------------------------------------------------
+def isComplete(path, settleSeconds):
+   """Check if a data file is completely written
+
+   A GRIB file must end with the end marker of its last message, and any
+   file must not have been modified for settleSeconds (a multi-message
+   GRIB file ends with a marker after every message).
+
+   Parameters
+   ----------
+   path: str
+      Full path file name
+   settleSeconds: float
+      Seconds the file must be unmodified
+
+   Returns
+   -------
+   bool
+      True if complete
+   """
+   try:
+      st = os.stat(path)
+      if (time.time() - st.st_mtime < settleSeconds):
+         return 0
+      if (os.path.splitext(path)[1].lower() not in GRIB_EXTENSIONS):
+         return 1
+      if (st.st_size < len(GRIB_END)):
+         return 0
+      with open(path, 'rb') as f:
+         f.seek(-len(GRIB_END), os.SEEK_END)
+         return f.read() == GRIB_END
+   except (IOError, OSError):
+      return 0
+
+#----------------------------------------------------------------------------
+# A directory listed less than this many seconds after its mtime may have
+# changed again within the same mtime tick, so it is listed again next time
+DIR_MTIME_SLACK_SECONDS = 2
+
+#----------------------------------------------------------------------------
+class DirCache:
+   """Directory listings keyed by directory mtime.  Adding or removing an
+   entry changes the mtime of a directory, so a directory is listed again
+   only when its mtime changed, and a scan costs one stat per directory
+   instead of a listing (see DirScan).
+
+   Attributes
+   ----------
+   _path: str
+      File the listings are kept in between runs, empty for none
+   _dirs: dict
+      full path directory -> [mtime, time listed, [files], [subdirs]]
+   _changed: bool
+      True if _dirs changed since read or saved
+   _visited: set
+      Directories looked at since the last save; the others are dropped
+      then, as they are no longer scanned (out of the hours back window,
+      or removed)
+   _lock: threading.Lock
+      Protects _dirs and _visited
+   """
+
+   def __init__(self, path=""):
+      """Read the listings saved by an earlier run
+
+      Parameters
+      ----------
+      path: str
+         File the listings are kept in, empty to keep them in memory only
+      """
+      self._path = path
+      self._dirs = {}
+      self._changed = 0
+      self._visited = set()
+      self._lock = threading.Lock()
+      if (not path or not os.path.exists(path)):
+         return
+      try:
+         with open(path) as f:
+            dirs = json.load(f)
+         # json gives unicode, keep names str like os.listdir does
+         for aDir, (mtime, listedAt, files, subdirs) in dirs.items():
+            self._dirs[str(aDir)] = [mtime, listedAt,
+                                     [str(n) for n in files],
+                                     [str(n) for n in subdirs]]
+      except (IOError, ValueError, TypeError) as e:
+         logging.warning("Ignoring directory cache %s: %s", path, e)
+         self._dirs = {}
+
+   def listing(self, aDir):
+      """Return the files and subdirectories of a directory
+
+      Parameters
+      ----------
+      aDir: str
+         Full path directory name
+
+      Returns
+      -------
+      tuple
+         (list[str] files, list[str] subdirectories), both empty if the
+         directory does not exist
+      """
+      try:
+         mtime = os.stat(aDir).st_mtime
+      except OSError:
+         with self._lock:
+            if (self._dirs.pop(aDir, None) is not None):
+               self._changed = 1
+         return ([], [])
+      with self._lock:
+         entry = self._dirs.get(aDir)
+         self._visited.add(aDir)
+      if (entry is not None and entry[0] == mtime and
+          entry[1] - mtime >= DIR_MTIME_SLACK_SECONDS):
+         return (entry[2], entry[3])
+      listedAt = time.time()
+      files, subdirs = DirScan.listing(aDir)
+      with self._lock:
+         # forget subdirectories that are gone
+         if (entry is not None):
+            for name in set(entry[3]) - set(subdirs):
+               self._dirs.pop(os.path.join(aDir, name), None)
+         self._dirs[aDir] = [mtime, listedAt, files, subdirs]
+         self._changed = 1
+      return (files, subdirs)
+
+   def save(self):
+      """Drop the listings of directories not looked at since the last
+      save, and write the others to the cache file, if changed
+      """
+      with self._lock:
+         if (not self._visited):
+            # nothing scanned since the last save
+            return
+         for aDir in [d for d in self._dirs if d not in self._visited]:
+            del self._dirs[aDir]
+            self._changed = 1
+         self._visited = set()
+         if (not self._path or not self._changed):
+            return
+         text = json.dumps(self._dirs)
+         self._changed = 0
+      def write(tmp):
+         with open(tmp, 'w') as f:
+            f.write(text)
+         return 1
+      try:
+         FileOps.writeAtomic(self._path, write, ".tmp")
+      except (IOError, OSError) as e:
+         logging.warning("Cannot save directory cache to %s: %s",
+                         self._path, e)
+
+# Listings used by the scanning functions below, see useDirCache()
+_dirCache = DirCache()
+
+#----------------------------------------------------------------------------
+def useDirCache(path, label=""):
+   """Keep directory listings in a file between runs
+
+   Parameters
+   ----------
+   path: str
+      Cache file name, empty to keep listings in memory only
+   label: str
+      If given, inserted before the extension of path, so that drivers
+      running at the same time each have their own file
+   """
+   global _dirCache
+   if (path and label):
+      base, ext = os.path.splitext(path)
+      path = base + "." + label + ext
+   _dirCache = DirCache(path)
+
+#----------------------------------------------------------------------------
+def saveDirCache():
+   """Write the directory listings to the file given to useDirCache()
+   """
+   _dirCache.save()
+
+# File catalog used instead of listing directories, see useCatalog()
+_catalog = None
+
+#----------------------------------------------------------------------------
+def useCatalog(path):
+   """Read file lists and status from a file catalog (see Catalog.py),
+   which lists a yyyymmdd directory only when it changed
+
+   Parameters
+   ----------
+   path: str
+      Catalog database file, empty to list directories directly
+   """
+   global _catalog
+   if (_catalog is not None):
+      _catalog.close()
+   _catalog = None
+   if (path):
+      _catalog = Catalog.Catalog(path)
+
+#----------------------------------------------------------------------------
+def setStatus(topDir, fname, fileType, status):
+   """Record the processing status of an input file in the catalog, if
+   there is one
+
+   Parameters
+   ----------
+   topDir: str
+      Top directory of the input type
+   fname: str
+      File name with yyyymmdd parent dir
+   fileType: str
+      'HRRR', ..., 'CFS'
+   status: str
+      Catalog.REGRIDDED, ...
+   """
+   if (_catalog is not None):
+      _catalog.setStatus(topDir, fname, fileType, status)
+
+#----------------------------------------------------------------------------
+def recordOutput(path, fileType, status):
+   """Record an intermediate file in the catalog, if there is one
+
+   Parameters
+   ----------
+   path: str
+      Full path file name
+   fileType: str
+      'HRRR', ..., 'CFS', or the kind of output
+   status: str
+      Catalog.FINISHED, ...
+   """
+   if (_catalog is not None):
+      _catalog.setStatus("", path, fileType, status)
+
+#----------------------------------------------------------------------------
+def hasCatalog():
+   """Check if a file catalog is in use, see useCatalog()
+
+   Returns
+   -------
+   bool
+   """
+   return _catalog is not None
+
+#----------------------------------------------------------------------------
+def outputStatus(path):
+   """Return the status of an intermediate file, see recordOutput()
+
+   Parameters
+   ----------
+   path: str
+      Full path file name
+
+   Returns
+   -------
+   str
+      Catalog.FINISHED, ..., None if not recorded or there is no catalog
+   """
+   if (_catalog is None):
+      return None
+   return _catalog.status("", path)
+
+#----------------------------------------------------------------------------
+# Start of the hour counts in ForecastTime
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Days in each month of a non leap year
+_MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+#----------------------------------------------------------------------------
+def parseDigits(s, i, j):
+   """Return the integer in s[i:j], without the cost of int() on a slice
+
+   Parameters
+   ----------
+   s: str
+      String to parse
+   i: int
+      First index
+   j: int
+      Index after the last
+
+   Returns
+   -------
+   int
+      The value, -1 if s[i:j] is not all digits (or is empty)
+   """
+   if (i >= j or j > len(s)):
+      return -1
+   v = 0
+   for k in xrange(i, j):
+      c = ord(s[k]) - 48
+      if (c < 0 or c > 9):
+         return -1
+      v = v*10 + c
+   return v
+
+#----------------------------------------------------------------------------
+def parseYyyymmdd(s, i=0):
+   """Parse a yyyymmdd date in a string
+
+   Parameters
+   ----------
+   s: str
+      String to parse
+   i: int
+      Index of the date in s
+
+   Returns
+   -------
+   tuple
+      (year, month, day), None if s[i:i+8] is not a valid date
+   """
+   y = parseDigits(s, i, i+4)
+   m = parseDigits(s, i+4, i+6)
+   d = parseDigits(s, i+6, i+8)
+   if (y < 1 or m < 1 or m > 12 or d < 1):
+      return None
+   n = _MONTH_DAYS[m-1]
+   if (m == 2 and y % 4 == 0 and (y % 100 != 0 or y % 400 == 0)):
+      n = 29
+   if (d > n):
+      return None
+   return (y, m, d)
+
+#----------------------------------------------------------------------------
+def epochHours(y, m, d, h):
+   """Return hours since 1970-01-01 00Z of a date and hour
+
+   Parameters
+   ----------
+   y: int
+      year
+   m: int
+      month 1, ..., 12
+   d: int
+      day of month
+   h: int
+      hour
+
+   Returns
+   -------
+   int
+   """
+   # days from civil date (proleptic Gregorian), with March as first month
+   if (m <= 2):
+      y -= 1
+   era = y // 400
+   yoe = y - era*400
+   doy = (153*(m + (-3 if m > 2 else 9)) + 2)//5 + d - 1
+   doe = yoe*365 + yoe//4 - yoe//100 + doy
+   return (era*146097 + doe - 719468)*24 + h
+
+#----------------------------------------------------------------------------
+def ensembleMember(fileName):
+   """Return the ensemble member of a yyyymmdd_ihh_fhhh_eNN... file name
+
+   Parameters
+   ----------
+   fileName: str
+      File name, without directory
+
+   Returns
+   -------
+   int
+      The member, -1 if none
+   """
+   if (fileName[17:19] == "_e"):
+      return parseDigits(fileName, 19, 21)
+   return -1
+
 #----------------------------------------------------------------------------
 def isYyyymmdd(name):
    """Check if input string is of format yyyymmdd
@@ -27,10 +411,7 @@ def isYyyymmdd(name):
        True if successful, False otherwise.
 
    """
-   if (len(name) == 8):
-      if (datetime.datetime.strptime(name, '%Y%m%d')):
-         return 1
-   return 0
+   return len(name) == 8 and parseYyyymmdd(name) is not None
 
 #----------------------------------------------------------------------------
 def dates(names):
@@ -64,8 +445,7 @@ def getFileNames(aDir):
    List[str]
       the data files in the directory
    """
-   return [name for name in os.listdir(aDir)
-           if not os.path.isdir(os.path.join(aDir, name))]
+   return list(_dirCache.listing(aDir)[0])
 
 #----------------------------------------------------------------------------
 def getImmediateSubdirectories(aDir):
@@ -83,11 +463,7 @@ def getImmediateSubdirectories(aDir):
 
    """
 
-   if (not os.path.exists(aDir)):
-      return []
-   
-   return [name for name in os.listdir(aDir)
-           if os.path.isdir(os.path.join(aDir, name))]
+   return list(_dirCache.listing(aDir)[1])
 
 #---------------------------------------------------------------------------
 def getYyyymmddSubdirectories(aDir):
@@ -125,26 +501,140 @@ def filterWithinNHours(files, type, ftime, N):
    Returns
    -------
    list[str]
-      subset of input files with issue time is in the range [ftime-N,ftime]
-
+      subset of input files with issue time is in the range [ftime-N,ftime],
+      in time order
    """
 
-   ret = []
-   for f in files:
-      df = DataFile(f[0:8], f[9:], type)
-      if (df._ok):
-         ithFtime = df._time
-         if (ithFtime.withinNHours(ftime, N)):
-            ret.append(f)
-         else:
-            logging.error("Creating data file object")
-
+   ret = FileIndex(type, files).window(ftime._issue - N, ftime._issue)
    logging.debug("filtering within %d hours, input length %d output %d",
                  N, len(files), len(ret))
    return ret
-        
+
+#----------------------------------------------------------------------------
+class FileIndex:
+   """Data file names sorted by (issue time, forecast hour, name), with a
+   set for membership, so that adds, purges and time window queries are
+   bisections instead of scans of the whole list
+
+   Attributes
+   ----------
+   _fileType: str
+      string for type 'HRRR', 'MRMS', 'RAP', 'GFS', 'CFS'
+   _keys: list[tuple]
+      (issue hours since 1970, forecast hour, name), sorted; names that
+      do not parse have issue time -1
+   _names: set
+      The names
+   """
+
+   def __init__(self, fileType, names=()):
+      """Initialize with some names
+
+      Parameters
+      ----------
+      fileType: str
+         string for type 'HRRR', 'MRMS', 'RAP', 'GFS', 'CFS'
+      names: list[str]
+         file names with yyyymmdd parent directory
+      """
+      self._fileType = fileType
+      self._names = set(names)
+      self._keys = sorted([self._key(name) for name in self._names])
+
+   def __len__(self):
+      return len(self._keys)
+
+   def __contains__(self, name):
+      return name in self._names
+
+   def names(self):
+      """Return the names, oldest to newest
+
+      Returns
+      -------
+      list[str]
+      """
+      return [k[2] for k in self._keys]
+
+   def newest(self):
+      """Return the newest name
+
+      Returns
+      -------
+      str
+         The name, empty if none
+      """
+      if (not self._keys):
+         return ""
+      return self._keys[-1][2]
+
+   def add(self, name):
+      """Add a name if it is new
+
+      Parameters
+      ----------
+      name: str
+         file name with yyyymmdd parent directory
+
+      Returns
+      -------
+      bool
+         True if added, false if already there
+      """
+      if (name in self._names):
+         return 0
+      self._names.add(name)
+      bisect.insort(self._keys, self._key(name))
+      return 1
+
+   def purgeOlderThan(self, issue):
+      """Remove the names with issue time older than a time
+
+      Parameters
+      ----------
+      issue: int
+         Oldest issue time kept, hours since 1970
+
+      Returns
+      -------
+      int
+         Number of names removed
+      """
+      i = bisect.bisect_left(self._keys, (issue,))
+      for k in self._keys[:i]:
+         self._names.discard(k[2])
+      del self._keys[:i]
+      return i
+
+   def window(self, oldestIssue, newestIssue):
+      """Return the names with issue time in a range
+
+      Parameters
+      ----------
+      oldestIssue: int
+         Oldest issue time, hours since 1970
+      newestIssue: int
+         Newest issue time
+
+      Returns
+      -------
+      list[str]
+         The names, oldest to newest
+      """
+      i = bisect.bisect_left(self._keys, (oldestIssue,))
+      j = bisect.bisect_left(self._keys, (newestIssue + 1,))
+      return [k[2] for k in self._keys[i:j]]
+
+   def _key(self, name):
+      """Return the sort key of a name
+      """
+      f = DataFile(name[0:8], name[9:], self._fileType)
+      if (not f._ok):
+         return (-1, -1, name)
+      return (f._time._issue, f._time._forecastHour, name)
+
 #---------------------------------------------------------------------------
-class DataFile:
+class DataFile(object):
    """DataFile is One data file
 
    Attributes
@@ -160,6 +650,7 @@ class DataFile:
    _time: ForecastTime
       forecast time information, can be parsed from name
    """
+   __slots__ = ('_ok', '_yyyymmddDir', '_name', '_fileType', '_time')
 
    def __init__(self, yyyymmdd="", fileName="", fileType=""):
       """Initialization using input args
@@ -183,7 +674,7 @@ class DataFile:
       self._fileType = fileType
 
       # empty time
-      self._time = ForecastTime(datetime.datetime, -1, -1)
+      self._time = ForecastTime()
 
       # if not a valid input, return now with ok=0
       if ((not yyyymmdd) or (not fileName)):
@@ -280,13 +771,13 @@ class DataFile:
 
       """
       if (len(fileName) >= 17):
-         ymd = fileName[0:8]
-         if (isYyyymmdd(ymd)):
-            itime = int(fileName[10:12])
-            ftime = int(fileName[14:17])
-            self._time = ForecastTime(datetime.datetime.strptime(ymd,
-                                                                 '%Y%m%d'),
-                                      itime, ftime)
+         ymd = parseYyyymmdd(fileName, 0)
+         itime = parseDigits(fileName, 10, 12)
+         ftime = parseDigits(fileName, 14, 17)
+         if (ymd is not None and itime >= 0 and ftime >= 0):
+            self._time = ForecastTime(forecastHour=ftime,
+                                      issue=epochHours(ymd[0], ymd[1],
+                                                       ymd[2], itime))
             self._ok = 1
         
    def _parseMrmsFile(self, fileName):
@@ -304,13 +795,13 @@ class DataFile:
 
       """
       if (len(fileName) >= 35):
-         ymd = fileName[20:28]
-         if (isYyyymmdd(ymd)):
-            itime = int(fileName[29:31])
+         ymd = parseYyyymmdd(fileName, 20)
+         itime = parseDigits(fileName, 29, 31)
+         if (ymd is not None and itime >= 0):
             # Note forecast hour is 0 here
-            self._time = ForecastTime(datetime.datetime.strptime(ymd,
-                                                                 '%Y%m%d'),
-                                      itime, 0)
+            self._time = ForecastTime(forecastHour=0,
+                                      issue=epochHours(ymd[0], ymd[1],
+                                                       ymd[2], itime))
             self._ok = 1
 
     
@@ -379,15 +870,95 @@ class DataFiles:
       oldestTime.copyFields(newestF._time)
       oldestTime.olderIssueHour(hoursBack)
 
-      # build up all the files on disk
-      dataFiles = self._allDataFiles()
-
-      # filter to those in range and put those as _content
-      for d in dataFiles:
-         if (d.inRange(oldestTime, newestF._time)):
-            self._content.append(d)
+      # only the yyyymmdd directories of the window are looked at
+      self._content = list(self.dataFilesInRange(oldestTime, newestF._time))
       return 1
 
+   def setFilesInRange(self, firstIssue, lastIssue):
+      """Set _content to the files with issue time in a range, no matter
+      how old
+
+      Parameters
+      ----------
+      firstIssue: datetime.datetime
+         Earliest issue time (year/month/day/hour)
+      lastIssue: datetime.datetime
+         Latest issue time
+
+      Returns
+      -------
+      true if there is at least one file in _content
+
+      """
+      oldestTime = ForecastTime(datetime.datetime(firstIssue.year,
+                                                  firstIssue.month,
+                                                  firstIssue.day),
+                                firstIssue.hour, 0)
+      newestTime = ForecastTime(datetime.datetime(lastIssue.year,
+                                                  lastIssue.month,
+                                                  lastIssue.day),
+                                lastIssue.hour, self._maxFcstHour)
+      self._content = list(self.dataFilesInRange(oldestTime, newestTime))
+      return len(self._content) > 0
+
+   def dataFilesInRange(self, oldestT, newestT):
+      """Generate the data files with time in a range, in order.
+
+      Files are in the yyyymmdd directory of their issue day, so only the
+      directories of the days from oldestT to newestT are listed (one or
+      two for the hours back of the real time drivers).
+
+      Parameters
+      ----------
+      oldestT:  ForecastTime
+         earliest allowed time
+      newestT:  ForecastTime
+         latest allowed time
+
+      Returns
+      -------
+      generator of DataFile
+         The files, oldest to newest
+      """
+      days = [(EPOCH + datetime.timedelta(days=day)).strftime("%Y%m%d")
+              for day in xrange(oldestT._issue // 24,
+                                newestT._issue // 24 + 1)]
+      if (_catalog is not None):
+         # one query over the window
+         for d in days:
+            self._syncDir(d)
+         for row in _catalog.files(self._topDir, self._fileType,
+                                   (oldestT._issue, oldestT._forecastHour),
+                                   (newestT._issue, newestT._forecastHour),
+                                   self._maxFcstHour):
+            yield self._dataFile(row)
+         return
+      for ymd in days:
+         for f in self._allDataFilesInDir(ymd):
+            if (f.inRange(oldestT, newestT)):
+               yield f
+
+   def dropIncomplete(self, settleSeconds):
+      """Remove files still being written from _content, see isComplete()
+
+      Parameters
+      ----------
+      settleSeconds: float
+         Seconds a file must be unmodified
+
+      Returns
+      -------
+      int
+         Number of files removed
+      """
+      n = len(self._content)
+      self._content = [f for f in self._content
+                       if self._isComplete(f, settleSeconds)]
+      if (len(self._content) < n):
+         logging.debug("%d %s files not complete yet", n - len(self._content),
+                       self._fileType)
+      return n - len(self._content)
+
    def getFnames(self):
       """Return the full path file names for everything in _content
 
@@ -430,37 +1001,6 @@ class DataFiles:
          # The last directory will be newest, look there for our newest
          return self._newestDataFileInDir(dirs[-1])
    
-   def _allDataFiles(self):
-      """Return all data files on disk, in order
-
-      Parameters
-      ----------
-      none
-
-      Returns
-      -------
-      list[DataFile]
-         The DataFile specs, in order oldest to newest
-
-      """
-
-      # get the yyyymmdd subdirs
-      dirs = getYyyymmddSubdirectories(self._topDir)
-
-      # sort them into ascending order
-      dirs = sorted(dirs)
-
-      if not dirs:
-         # nothing there
-         logging.debug("_allDataFiles: No data in %s", self._topDir)
-         return []
-      else:
-         # make one big array
-         ret = []
-         for d in dirs:
-            ret.extend(self._allDataFilesInDir(d))
-         return ret
-
    def _allDataFilesInDir(self, ymdDir):
       """Return all data files in a directory with forecast hour in range
 
@@ -476,6 +1016,12 @@ class DataFiles:
 
       """
 
+      if (_catalog is not None):
+         self._syncDir(ymdDir)
+         return [self._dataFile(row)
+                 for row in _catalog.dirFiles(self._topDir, ymdDir,
+                                              self._maxFcstHour)]
+
       # get all files
       fileNames = getFileNames(self._topDir + "/" + ymdDir)
       
@@ -487,6 +1033,88 @@ class DataFiles:
       # names
       return self._filterFileNamesToInRangeDataFiles(ymdDir, fileNames)
 
+   def _isComplete(self, f, settleSeconds):
+      """Check if a file is completely written, see isComplete().  With a
+      catalog, a file is checked only until it is recorded as complete.
+
+      Parameters
+      ----------
+      f: DataFile
+      settleSeconds: float
+         Seconds a file must be unmodified
+
+      Returns
+      -------
+      bool
+      """
+      name = f.fullPathFileName()
+      path = self._topDir + "/" + name
+      if (_catalog is None):
+         return isComplete(path, settleSeconds)
+      if (_catalog.status(self._topDir, name) not in (None, Catalog.NEW)):
+         return 1
+      if (not isComplete(path, settleSeconds)):
+         return 0
+      try:
+         st = os.stat(path)
+         _catalog.setStatus(self._topDir, name, self._fileType,
+                            Catalog.COMPLETE, st.st_size, st.st_mtime)
+      except OSError:
+         return 0
+      return 1
+
+   def _syncDir(self, ymdDir):
+      """Record the files of a yyyymmdd directory in the catalog, if the
+      directory changed since last recorded
+
+      Parameters
+      ----------
+      ymdDir: str
+         subdirectory of _topDir
+      """
+      path = os.path.join(self._topDir, ymdDir)
+      try:
+         mtime = os.stat(path).st_mtime
+      except OSError:
+         if (_catalog.dirState(path) is not None):
+            _catalog.forgetDir(self._topDir, ymdDir)
+         return
+      state = _catalog.dirState(path)
+      if (state is not None and state[0] == mtime and
+          state[1] - mtime >= DIR_MTIME_SLACK_SECONDS):
+         return
+      listedAt = time.time()
+      entries = []
+      for name in DirScan.listing(path)[0]:
+         f = DataFile(ymdDir, name, self._fileType)
+         if (f._ok):
+            entries.append((f.fullPathFileName(), f._time._issue,
+                            f._time._forecastHour, ensembleMember(name)))
+         else:
+            entries.append((f.fullPathFileName(), -1, -1, -1))
+      _catalog.replaceDir(self._topDir, ymdDir, self._fileType, mtime,
+                          listedAt, entries)
+
+   def _dataFile(self, row):
+      """Return the DataFile of a catalog row, without parsing the name
+
+      Parameters
+      ----------
+      row: tuple
+         (name with yyyymmdd parent dir, issue, forecast hour)
+
+      Returns
+      -------
+      DataFile
+      """
+      f = DataFile()
+      f._ok = 1
+      f._yyyymmddDir = str(row[0][0:8])
+      f._name = str(row[0][9:])
+      f._fileType = self._fileType
+      f._time = ForecastTime(forecastHour=row[2], issue=row[1])
+      return f
+
    def _newestDataFileInDir(self, ymdDir):
       """Return newest data file in a directory
 
@@ -538,33 +1166,44 @@ class DataFiles:
       return datafiles
 
 #----------------------------------------------------------------------------
-class ForecastTime:
-   """ Forecast time (model ymd, model issue hour, model forecast hour)
+class ForecastTime(object):
+   """ Forecast time (model issue time, model forecast hour)
+
+   The issue time is kept as integer hours since 1970-01-01 00Z, so that
+   ordering and window checks are integer comparisons.
 
    Attributes
    ----------
-   _fcstTime: datetime.datetime
-      year/month/day 
-   _issueHour: int
-      issue hour 0, 1, ..., 23
+   _issue: int
+      issue time, hours since 1970-01-01 00Z
    _forecastHour: int
       forecast hour 0, 1, ...
 
-   An empty object of this type has issue hour < 0
+   An empty object of this type has issue time < 0
    
    """
-   def __init__(self, fcstTime=datetime.datetime,
-                 issueHour=-1, forecastHour=-1):
+   __slots__ = ('_issue', '_forecastHour')
+
+   def __init__(self, fcstTime=None, issueHour=-1, forecastHour=-1,
+                issue=-1):
       """ Initialize using input args
       Parameters
       ----------
-      fstTime: datetime.datetime
+      fcstTime: datetime.datetime
+         year/month/day
       issueHour: int
+         issue hour 0, 1, ..., 23
       forecastHour:int
+      issue: int
+         issue time as hours since 1970, used instead of fcstTime and
+         issueHour if >= 0
       """
 
-      self._fcstTime = fcstTime
-      self._issueHour = issueHour
+      if (issue < 0 and issueHour >= 0 and
+          isinstance(fcstTime, datetime.datetime)):
+         issue = epochHours(fcstTime.year, fcstTime.month, fcstTime.day,
+                            issueHour)
+      self._issue = issue
       self._forecastHour = forecastHour
 
    def isEmpty(self):
@@ -574,7 +1213,7 @@ class ForecastTime:
       -------
       True if object has NOT been set
       """
-      return (self._issueHour == -1)
+      return (self._issue < 0)
 
    def ymdh(self):
       """ return the datetime for the model run(year/month/day/issue hour)
@@ -583,8 +1222,17 @@ class ForecastTime:
       datetime
          Model run time
       """
-      return self._fcstTime + datetime.timedelta(hours=self._issueHour)
-    
+      return EPOCH + datetime.timedelta(hours=self._issue)
+
+   def ymd(self):
+      """ return the model run day as a string
+      Returns
+      -------
+      str
+         'yyyymmdd'
+      """
+      return self.ymdh().strftime("%Y%m%d")
+
    def copyFields(self, f):
       """ c++ like Copy constructor
       Parameters
@@ -592,15 +1240,13 @@ class ForecastTime:
       f : ForecastTime
          Object to copy contents into local state
       """
-      self._fcstTime = f._fcstTime
-      self._issueHour = f._issueHour
+      self._issue = f._issue
       self._forecastHour = f._forecastHour
 
    def debugPrint(self):
       """ logging debug of content
       """
-      logging.debug("%s,i[%s],f[%s]", self._fcstTime, self._issueHour,
-                     self._forecastHour)
+      logging.debug("%s", self.debugString())
 
    def debugString(self):
       """ debug contents, as a string
@@ -609,8 +1255,11 @@ class ForecastTime:
       str
          A description
       """
-      s = '%s,i[%s],f[%s]' %(self._fcstTime, self._issueHour,self._forecastHour)
-      return s
+      if (self.isEmpty()):
+         return 'empty,f[%s]' %(self._forecastHour)
+      t = self.ymdh()
+      return '%s,i[%s],f[%s]' %(t.strftime("%Y-%m-%d"), t.hour,
+                                self._forecastHour)
 
    def forecastHourInRange(self, maxFcstHour):
       """ Check if forecast hour is not too large
@@ -625,35 +1274,23 @@ class ForecastTime:
       true if forecast hour is in range (not too big)
 
       """
-      if (self.isEmpty()):
+      if (self._issue < 0):
          return 0
       else:
          return self._forecastHour <= maxFcstHour
          
-   #
-   # Return ForecastTime that is the earliest lead in the previous
-   # issue hour relative to local values
-   #
    def olderIssueHour(self, hoursBack):
-      """ Return the ForecastTime that has hoursBack hours earlier issue time
+      """ Move to the issue time hoursBack hours earlier, forecast hour 0
 
       Parameters
       ----------
       hoursBack: int
          Number of hours back to look
-
-      Returns
-      -------
-      ForecastTime
-         Forecast with issue time hoursBack earlier than local, forecastHour=0
       """          
-      if (self.isEmpty()):
+      if (self._issue < 0):
          logging.debug("ERROR empty input to olderIssueHour")
       else:
-         timeBack = self.ymdh() - datetime.timedelta(hours=hoursBack)
-         self._fcstTime = datetime.datetime(timeBack.year, timeBack.month,
-                                            timeBack.day, 0, 0, 0)
-         self._issueHour = timeBack.hour
+         self._issue -= hoursBack
          self._forecastHour = 0
 
    def inputIsNewerThanOrEqual(self, ftime):
@@ -667,15 +1304,9 @@ class ForecastTime:
       -------
       True if ftime >= self
       """
-      if (self._fcstTime < ftime._fcstTime):
-         return 1
-      elif (self._fcstTime == ftime._fcstTime):
-         if (self._issueHour < ftime._issueHour):
-            return 1
-         elif (self._issueHour == ftime._issueHour):
-            if (self._forecastHour <= ftime._forecastHour):
-               return 1
-      return 0
+      return (self._issue < ftime._issue or
+              (self._issue == ftime._issue and
+               self._forecastHour <= ftime._forecastHour))
 
    def inputIsNewerIssueHour(self, ftime):
       """ Check if input forecast time has issue hour newer than self
@@ -687,12 +1318,7 @@ class ForecastTime:
       -------
       True if ftime has issue hour newer than self
       """
-      if (self._fcstTime < ftime._fcstTime):
-         return 1
-      elif (self._fcstTime == ftime._fcstTime):
-         if (self._issueHour < ftime._issueHour):
-            return 1
-      return 0
+      return self._issue < ftime._issue
 
    def withinNHours(self, ftime, N):
       """ Check if input time is within some number of issue hours of self
@@ -706,26 +1332,14 @@ class ForecastTime:
       -------
       True if input time - local time <= N hours
       """
-      # same day, issue hour match
-      # same day, issue hour input - issue hour <= N
-      if (self._fcstTime == ftime._fcstTime):
-         if (self._issueHour == ftime._issueHour):
-            return 1
-         elif (ftime._issueHour-self._issueHour <= N):
+      diff = ftime._issue - self._issue
+      if (diff < 0):
+         # (an older input on the same day always passed)
+         if (ftime._issue // 24 == self._issue // 24):
             return 1
-         else:
-            return 0
-      else:
-         # create a full time from local and input states
-         timeIn = ftime.ymdh()
-         timeLoc = self.ymdh()
-         diff = (timeIn - timeLoc).total_seconds()
-         maxSeconds = N*3600
-         if (diff < 0):
-            logging.error("Unexpected data newer than newest")
-            return 0
-         else:
-            return (diff <= maxSeconds)
+         logging.error("Unexpected data newer than newest")
+         return 0
+      return diff <= N
 
 
 #----------------------------------------------------------------------------
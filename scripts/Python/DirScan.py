@@ -0,0 +1,108 @@
+"""DirScan
+Directory listing and walking for all the scanners.
+
+Uses scandir, which gets the type of each entry from the directory
+itself (d_type) on most file systems, so telling files from
+subdirectories costs no stat per entry.  On NFS and autofs, where each
+stat is a round trip, a scan then costs one call per directory instead
+of one per file.  scandir is os.scandir in Python 3.5 and later and the
+scandir package before that; without either, os.listdir and a stat per
+entry are used (and walkFiles() stats subdirectories once more to skip
+symbolic links).
+"""
+
+import os
+import errno
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+#----------------------------------------------------------------------------
+def entries(aDir):
+    """Return the entries of a directory
+
+    Parameters
+    ----------
+    aDir : str
+       Full path directory name
+
+    Returns
+    -------
+    list[tuple]
+       (name, isDir, isLink) of each entry; isDir follows symbolic links,
+       isLink is None without scandir, where it costs another stat.
+       Empty list if the directory does not exist
+    """
+    try:
+        if (scandir is not None):
+            return [(e.name, e.is_dir(), e.is_symlink())
+                    for e in scandir(aDir)]
+        names = os.listdir(aDir)
+    except OSError as e:
+        if (e.errno in (errno.ENOENT, errno.ENOTDIR)):
+            return []
+        raise
+    ret = []
+    for name in names:
+        path = os.path.join(aDir, name)
+        ret.append((name, os.path.isdir(path), None))
+    return ret
+
+#----------------------------------------------------------------------------
+def listing(aDir):
+    """Return the files and the subdirectories of a directory
+
+    Parameters
+    ----------
+    aDir : str
+       Full path directory name
+
+    Returns
+    -------
+    tuple
+       (list[str] files, list[str] subdirectories), both empty if the
+       directory does not exist
+    """
+    files = []
+    subdirs = []
+    for name, isDir, isLink in entries(aDir):
+        if (isDir):
+            subdirs.append(name)
+        else:
+            files.append(name)
+    return (files, subdirs)
+
+#----------------------------------------------------------------------------
+def walkFiles(top, pattern=None):
+    """Generate the files in a directory tree, top down, like os.walk
+    (symbolic links to directories are not followed)
+
+    Parameters
+    ----------
+    top : str
+       Directory to start at
+    pattern : compiled regular expression
+       If given, only file names it matches are returned
+
+    Returns
+    -------
+    generator of str
+       Full path file names
+    """
+    subdirs = []
+    for name, isDir, isLink in entries(top):
+        if (isDir):
+            if (isLink is None):
+                isLink = os.path.islink(os.path.join(top, name))
+            if (not isLink):
+                subdirs.append(name)
+        elif (pattern is None or pattern.match(name)):
+            yield os.path.join(top, name)
+    for name in subdirs:
+        for path in walkFiles(os.path.join(top, name), pattern):
+            yield path
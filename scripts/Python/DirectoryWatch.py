@@ -0,0 +1,235 @@
+"""DirectoryWatch
+Waits for files to land in data directories using Linux inotify (through
+ctypes, no extra packages).  inotify does not see changes made by other
+hosts on network filesystems, so isNetworkFilesystem() tells callers
+when they must fall back to rescanning.
+"""
+
+import os
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+#----------------------------------------------------------------------------
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# Events that mean a file (or a yyyymmdd directory) is ready
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# Filesystem types on which inotify misses changes made elsewhere
+NETWORK_FILESYSTEMS = ['nfs', 'nfs4', 'autofs', 'cifs', 'smbfs', 'lustre',
+                       'gpfs', 'fuse.sshfs']
+
+# struct inotify_event header: wd, mask, cookie, len
+_EVENT_HEADER = struct.Struct('iIII')
+
+#----------------------------------------------------------------------------
+def isNetworkFilesystem(path):
+   """Check if a path is on a network (or automounted) filesystem
+
+   Parameters
+   ----------
+   path: str
+      Existing path
+
+   Returns
+   -------
+   bool
+      True if the mount holding path is one of NETWORK_FILESYSTEMS
+   """
+   path = os.path.realpath(path)
+   best = ""
+   fsType = ""
+   try:
+      with open('/proc/mounts') as f:
+         for line in f:
+            fields = line.split()
+            if (len(fields) < 3):
+               continue
+            mountPoint = fields[1].replace('\\040', ' ')
+            if (path == mountPoint or
+                path.startswith(mountPoint.rstrip('/') + '/')):
+               if (len(mountPoint) >= len(best)):
+                  best = mountPoint
+                  fsType = fields[2]
+   except IOError as e:
+      logging.warning("Cannot read /proc/mounts: %s", e)
+      return 1
+   return fsType in NETWORK_FILESYSTEMS
+
+#----------------------------------------------------------------------------
+class DirectoryWatch:
+   """inotify watches on a set of directories
+
+   Attributes
+   ----------
+   _fd: int
+      inotify file descriptor, -1 if inotify is unavailable
+   _dirs: dict
+      watch descriptor -> directory path
+   _wds: dict
+      directory path -> watch descriptor
+   """
+
+   def __init__(self):
+      """Initialize inotify, if the platform has it
+      """
+      self._fd = -1
+      self._dirs = {}
+      self._wds = {}
+      try:
+         self._libc = ctypes.CDLL(ctypes.util.find_library('c') or
+                                  'libc.so.6', use_errno=True)
+         fd = self._libc.inotify_init1(os.O_NONBLOCK |
+                                       getattr(os, 'O_CLOEXEC', 0o2000000))
+      except (OSError, AttributeError) as e:
+         logging.warning("inotify unavailable: %s", e)
+         return
+      if (fd < 0):
+         logging.warning("inotify_init1 failed: %s",
+                         os.strerror(ctypes.get_errno()))
+         return
+      self._fd = fd
+
+   def available(self):
+      """Check if inotify is usable
+
+      Returns
+      -------
+      bool
+      """
+      return self._fd >= 0
+
+   def watched(self):
+      """Return the watched directories
+
+      Returns
+      -------
+      list[str]
+      """
+      return self._wds.keys()
+
+   def watch(self, path):
+      """Start watching a directory, if not already
+
+      Parameters
+      ----------
+      path: str
+         Directory to watch
+
+      Returns
+      -------
+      bool
+         True if the directory is watched
+      """
+      if (path in self._wds):
+         return 1
+      if (not self.available()):
+         return 0
+      wd = self._libc.inotify_add_watch(self._fd, path.encode('utf-8'),
+                                        WATCH_MASK)
+      if (wd < 0):
+         logging.error("Cannot watch %s: %s", path,
+                       os.strerror(ctypes.get_errno()))
+         return 0
+      logging.debug("Watching %s", path)
+      self._wds[path] = wd
+      self._dirs[wd] = path
+      return 1
+
+   def unwatch(self, path):
+      """Stop watching a directory
+
+      Parameters
+      ----------
+      path: str
+      """
+      wd = self._wds.pop(path, None)
+      if (wd is None):
+         return
+      self._dirs.pop(wd, None)
+      self._libc.inotify_rm_watch(self._fd, wd)
+      logging.debug("No longer watching %s", path)
+
+   def wait(self, timeout):
+      """Wait for events in the watched directories
+
+      Parameters
+      ----------
+      timeout: float
+         Maximum seconds to wait, 0 to only collect pending events
+
+      Returns
+      -------
+      list
+         (directory, name, isDir) of each event, empty on timeout.  A
+         queue overflow gives (None, None, False): some events were lost
+      """
+      if (not self.available()):
+         return []
+      try:
+         ready = select.select([self._fd], [], [], timeout)[0]
+      except select.error as e:
+         if (e.args[0] == errno.EINTR):
+            return []
+         raise
+      if (not ready):
+         return []
+      try:
+         buf = os.read(self._fd, 65536)
+      except OSError as e:
+         if (e.errno == errno.EAGAIN):
+            return []
+         raise
+      return self._parse(buf)
+
+   def close(self):
+      """Release the inotify file descriptor
+      """
+      if (self.available()):
+         os.close(self._fd)
+         self._fd = -1
+      self._dirs = {}
+      self._wds = {}
+
+   def _parse(self, buf):
+      """Decode a buffer of struct inotify_event records
+
+      Parameters
+      ----------
+      buf: str
+         Bytes read from the inotify descriptor
+
+      Returns
+      -------
+      list
+         See wait()
+      """
+      events = []
+      offset = 0
+      while (offset + _EVENT_HEADER.size <= len(buf)):
+         wd, mask, cookie, nameLen = _EVENT_HEADER.unpack_from(buf, offset)
+         offset += _EVENT_HEADER.size
+         name = buf[offset:offset + nameLen].rstrip(b'\0')
+         offset += nameLen
+         if (mask & IN_Q_OVERFLOW):
+            logging.warning("inotify queue overflow")
+            events.append((None, None, False))
+         elif (mask & IN_IGNORED):
+            # directory was removed
+            path = self._dirs.pop(wd, None)
+            if (path is not None):
+               self._wds.pop(path, None)
+         elif (wd in self._dirs):
+            events.append((self._dirs[wd], name.decode('utf-8'),
+                           bool(mask & IN_ISDIR)))
+      return events
@@ -0,0 +1,192 @@
+"""FileNames
+Parsing of the input and LDASIN file names, with the patterns compiled
+once and one record per name, cached, that also has the valid time.
+"""
+
+import datetime
+import collections
+import re
+
+#----------------------------------------------------------------------------
+# Model data: .../yyyymmdd_ihh_fhhh[h]...
+_MODEL = re.compile(r'.*([0-9]{8})_i([0-9]{2})_f([0-9]{3,4})')
+
+# CFS: .../yyyymmdd/yyyymmdd_ihh_fhhh[h]_enn...
+_CFS = re.compile(r'.*([0-9]{8})/([0-9]{8})_i([0-9]{2})_f([0-9]{3,4})'
+                  r'_e([0-9]{2})')
+
+# MRMS: ...GaugeCorr_QPE_00.00_yyyymmdd_hhmmss...
+_MRMS = re.compile(r'.*(GaugeCorr_QPE_00.00)_([0-9]{8})_([0-9]{6})')
+
+# Regridded, downscaled and layered files:
+# [<dir>/]yyyymmddhh/yyyymmddhh00.LDASIN_DOMAIN1[.nc]
+_LDASIN = re.compile(r'(?:(.*)/)?([0-9]{10})/(([0-9]{10})00\.LDASIN_DOMAIN1)'
+                     r'(.*)$')
+
+# Products parsed with each input pattern
+_PATTERNS = {'MRMS': _MRMS, 'CFS': _CFS, 'CFSV2': _CFS}
+
+# Names kept in each cache before it is emptied
+MAX_CACHED = 20000
+
+_inputCache = {}
+_ldasinCache = {}
+
+#----------------------------------------------------------------------------
+# Parsed input file name
+#   product: str, as given to parseInput
+#   ymd: str, yyyymmdd of the issue time
+#   issueHour: int
+#   fcstHour: int, 0 for MRMS
+#   member: int, ensemble member, -1 if none
+#   runTime: str, hh, or hhmmss for MRMS, as in the name
+#   issueTime: datetime.datetime
+#   validTime: datetime.datetime
+InputName = collections.namedtuple('InputName',
+                                   ['product', 'ymd', 'issueHour',
+                                    'fcstHour', 'member', 'runTime',
+                                    'issueTime', 'validTime'])
+
+# Parsed LDASIN file name
+#   baseDir: str, directory above the issue time directory, None if none
+#   issueDir: str, yyyymmddhh
+#   stem: str, yyyymmddhh00.LDASIN_DOMAIN1
+#   ext: str, what follows the stem, normally '.nc' or ''
+#   issueTime: datetime.datetime
+#   validTime: datetime.datetime
+LdasinName = collections.namedtuple('LdasinName',
+                                    ['baseDir', 'issueDir', 'stem', 'ext',
+                                     'issueTime', 'validTime'])
+
+#----------------------------------------------------------------------------
+def _ymdh(ymd, hour):
+    """Return the datetime of yyyymmdd digits and an hour
+    """
+    return datetime.datetime(int(ymd[0:4]), int(ymd[4:6]), int(ymd[6:8]),
+                             hour)
+
+#----------------------------------------------------------------------------
+def _cached(cache, key, value):
+    """Store a parse result, emptying the cache when it is full
+    """
+    if (len(cache) >= MAX_CACHED):
+        cache.clear()
+    cache[key] = value
+    return value
+
+#----------------------------------------------------------------------------
+def parseInput(product, name):
+    """Parse an input data file name
+
+    Parameters
+    ----------
+    product : str
+       'HRRR', 'RAP', 'GFS', 'NAM', 'MRMS', 'CFS' or 'CFSv2', or None to
+       accept model and MRMS names
+    name : str
+       File name, with or without directories
+
+    Returns
+    -------
+    InputName
+       The record, None if the name does not have the format of the product
+    """
+    key = (product, name)
+    if (key in _inputCache):
+        return _inputCache[key]
+    ret = None
+    try:
+        pattern = _PATTERNS.get(product.upper() if product else None, _MODEL)
+        m = pattern.match(name)
+        if (m is None and product is None):
+            pattern = _MRMS
+            m = pattern.match(name)
+        if (m is None):
+            ret = None
+        elif (pattern is _MRMS):
+            issue = _ymdh(m.group(2), int(m.group(3)[0:2]))
+            ret = InputName(product, m.group(2), issue.hour, 0, -1,
+                            m.group(3), issue, issue)
+        elif (pattern is _CFS):
+            issue = _ymdh(m.group(2), int(m.group(3)))
+            fcstHour = int(m.group(4))
+            ret = InputName(product, m.group(1), issue.hour, fcstHour,
+                            int(m.group(5)), m.group(3), issue,
+                            issue + datetime.timedelta(hours=fcstHour))
+        else:
+            issue = _ymdh(m.group(1), int(m.group(2)))
+            fcstHour = int(m.group(3))
+            ret = InputName(product, m.group(1), issue.hour, fcstHour, -1,
+                            m.group(2), issue,
+                            issue + datetime.timedelta(hours=fcstHour))
+    except ValueError:
+        # digits that are not a date
+        ret = None
+    return _cached(_inputCache, key, ret)
+
+#----------------------------------------------------------------------------
+def parseLdasin(name):
+    """Parse a regridded, downscaled or layered file name
+
+    Parameters
+    ----------
+    name : str
+       [<dir>/]yyyymmddhh/yyyymmddhh00.LDASIN_DOMAIN1[.nc]
+
+    Returns
+    -------
+    LdasinName
+       The record, None if the name does not have that format
+    """
+    if (name in _ldasinCache):
+        return _ldasinCache[name]
+    ret = None
+    m = _LDASIN.match(name)
+    if (m is not None):
+        issueDir = m.group(2)
+        valid = m.group(4)
+        try:
+            ret = LdasinName(m.group(1), issueDir, m.group(3), m.group(5),
+                             _ymdh(issueDir, int(issueDir[8:10])),
+                             _ymdh(valid, int(valid[8:10])))
+        except ValueError:
+            ret = None
+    return _cached(_ldasinCache, name, ret)
+
+#----------------------------------------------------------------------------
+def ldasinParts(path):
+    """Split a full path LDASIN .nc file name below its issue time directory
+
+    Parameters
+    ----------
+    path : str
+       <dir>/yyyymmddhh/yyyymmddhh00.LDASIN_DOMAIN1.nc
+
+    Returns
+    -------
+    tuple
+       ('yyyymmddhh', 'yyyymmddhh00.LDASIN_DOMAIN1.nc'), None if the name
+       does not have that format
+    """
+    name = parseLdasin(path)
+    if (name is None or name.baseDir is None or
+        not name.ext.startswith('.nc')):
+        return None
+    return (name.issueDir, name.stem + ".nc")
+
+#----------------------------------------------------------------------------
+def ldasinName(issueTime, validTime):
+    """Return the name of the LDASIN file of an issue and valid time
+
+    Parameters
+    ----------
+    issueTime : datetime.datetime
+    validTime : datetime.datetime
+
+    Returns
+    -------
+    str
+       yyyymmddhh/yyyymmddhh00.LDASIN_DOMAIN1.nc
+    """
+    return issueTime.strftime("%Y%m%d%H") + "/" + \
+        validTime.strftime("%Y%m%d%H") + "00.LDASIN_DOMAIN1.nc"
@@ -0,0 +1,261 @@
+"""FileOps
+File materialisation without shell commands.  A file is made to appear at
+its destination by the cheapest method that works: a hardlink when source
+and destination are on the same filesystem, else a reflink (copy on write
+clone) or in-kernel copy_file_range, else a streamed copy.  Whatever the
+method, the content goes to a temporary name in the destination directory
+first and is renamed into place, so readers never see a partial file.
+
+Output files are written the same way: writeAtomic() hands a temporary
+name in the destination directory to the code producing the file, then
+publish() flushes it to disk and renames it to its final name (for
+LDASIN files, the name without the .nc extension).
+"""
+
+import os
+import errno
+import fcntl
+import logging
+import shutil
+import threading
+
+#----------------------------------------------------------------------------
+# ioctl request number to clone a file (Linux FICLONE)
+FICLONE = 0x40049409
+
+# Buffer size for streamed copies
+COPY_BUFFER_BYTES = 4*1024*1024
+
+#----------------------------------------------------------------------------
+def materialize(src, dst):
+    """Make dst a copy of src, atomically, without spawning a process
+
+    Parameters
+    ----------
+    src : str
+       Full path of the existing file
+    dst : str
+       Full path of the file to create (replaced if it exists)
+
+    Returns
+    -------
+    str
+       Method used: 'hardlink', 'reflink', 'copy_file_range' or 'copy',
+       or empty string if it failed
+    """
+    dstDir = os.path.dirname(dst)
+    if (dstDir and not os.path.isdir(dstDir)):
+        os.makedirs(dstDir)
+    tmp = tempName(dst)
+    method = ""
+    try:
+        if (sameFilesystem(src, dstDir)):
+            try:
+                os.link(src, tmp)
+                method = "hardlink"
+            except OSError as e:
+                logging.debug("hardlink %s failed: %s", src, e)
+        if (not method):
+            method = _copy(src, tmp)
+        if (os.path.getsize(tmp) != os.path.getsize(src)):
+            raise IOError("size mismatch copying %s" %(src))
+        os.rename(tmp, dst)
+    except (IOError, OSError) as e:
+        logging.error("ERROR[materialize]: %s -> %s failed: %s", src, dst, e)
+        remove(tmp)
+        return ""
+
+    logging.debug("materialized %s -> %s (%s)", src, dst, method)
+    return method
+
+#----------------------------------------------------------------------------
+def sameFilesystem(path1, path2):
+    """Check if two existing paths are on the same filesystem
+
+    Parameters
+    ----------
+    path1 : str
+    path2 : str
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        return os.stat(path1).st_dev == os.stat(path2 or ".").st_dev
+    except OSError:
+        return 0
+
+#----------------------------------------------------------------------------
+def tempName(path, suffix=".tmp"):
+    """Return a temporary name next to path, unique to this thread
+
+    The name includes the process and thread ids, so threads of one
+    process writing the same file do not collide.  The file is not
+    created: writers like NCL and os.link need a name that does not
+    exist yet.
+
+    Parameters
+    ----------
+    path : str
+       Final full path name
+    suffix : str
+       Extension of the temporary name, e.g. '.nc' for writers that
+       choose the file format from the extension (NCL)
+
+    Returns
+    -------
+    str
+       Hidden file name in the same directory as path
+    """
+    dirName, baseName = os.path.split(path)
+    return os.path.join(dirName, ".%s.%d.%d%s" %(baseName, os.getpid(),
+                                                 _threadId(), suffix))
+
+#----------------------------------------------------------------------------
+def writeAtomic(path, write, suffix=".nc"):
+    """Create a file through a temporary name in its directory
+
+    Parameters
+    ----------
+    path : str
+       Final full path name
+    write : callable
+       write(tmpPath) creates the file at tmpPath and returns a true
+       value if successful
+    suffix : str
+       Extension of the temporary name
+
+    Returns
+    -------
+    bool
+       True if the file was written and renamed to path
+    """
+    dirName = os.path.dirname(path)
+    if (dirName and not os.path.isdir(dirName)):
+        os.makedirs(dirName)
+    tmp = tempName(path, suffix)
+    try:
+        status = write(tmp)
+    except Exception:
+        remove(tmp)
+        raise
+    if (not status):
+        logging.error("ERROR[writeAtomic]: failed to write %s", path)
+        remove(tmp)
+        return 0
+    return publish(tmp, path)
+
+#----------------------------------------------------------------------------
+def publish(tmp, path):
+    """Flush a finished file to disk and rename it to its final name
+
+    tmp must be in the same directory (filesystem) as path, so the rename
+    is atomic.
+
+    Parameters
+    ----------
+    tmp : str
+       Full path of the finished file
+    path : str
+       Final full path name (replaced if it exists)
+
+    Returns
+    -------
+    bool
+       True if successful
+    """
+    try:
+        fd = os.open(tmp, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp, path)
+        _syncDir(os.path.dirname(path))
+    except (IOError, OSError) as e:
+        logging.error("ERROR[publish]: %s -> %s failed: %s", tmp, path, e)
+        remove(tmp)
+        return 0
+    return 1
+
+#----------------------------------------------------------------------------
+def remove(path):
+    """Remove a file if it exists, without spawning a shell
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    bool
+       True if the file is gone
+    """
+    try:
+        os.remove(path)
+    except OSError as e:
+        if (e.errno != errno.ENOENT):
+            logging.warning("could not remove %s: %s", path, e)
+            return 0
+    return 1
+
+#----------------------------------------------------------------------------
+def _threadId():
+    """Return the id of the calling thread
+    """
+    return threading.current_thread().ident or 0
+
+#----------------------------------------------------------------------------
+def _copy(src, dst):
+    """Copy src to a new file dst: reflink, copy_file_range or streamed
+
+    Returns
+    -------
+    str
+       Method used
+    """
+    with open(src, 'rb') as fin:
+        with open(dst, 'wb') as fout:
+            method = ""
+            try:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+                method = "reflink"
+            except (IOError, OSError):
+                pass
+            copyFileRange = getattr(os, 'copy_file_range', None)
+            if (not method and copyFileRange is not None):
+                try:
+                    size = os.fstat(fin.fileno()).st_size
+                    while (size > 0):
+                        n = copyFileRange(fin.fileno(), fout.fileno(), size)
+                        if (n == 0):
+                            break
+                        size -= n
+                    method = "copy_file_range"
+                except OSError:
+                    fout.seek(0)
+                    fout.truncate()
+            if (not method):
+                fin.seek(0)
+                shutil.copyfileobj(fin, fout, COPY_BUFFER_BYTES)
+                method = "copy"
+            fout.flush()
+            os.fsync(fout.fileno())
+    shutil.copystat(src, dst)
+    return method
+
+#----------------------------------------------------------------------------
+def _syncDir(dirName):
+    """Flush a directory entry change (rename) to disk, where supported
+    """
+    try:
+        fd = os.open(dirName or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,514 @@
+"""ForcingScheduler
+Single long-running driver for the regridding, downscaling and Short
+Range layering that Regrid_Driver and ShortRangeLayeringDriver do from
+cron.  Each new input file becomes a chain of tasks in an in-memory
+graph (see Scheduler.py):
+
+   HRRR f_n:  regrid -> downscale -> finish --+
+                                              +--> layer f_n
+   RAP f_n:   regrid -> downscale -> finish --+
+
+and ready tasks run on one shared worker pool, so a layered LDASIN file
+is made as soon as both of its inputs are finished.  Each input file is
+picked up as soon as it is complete on disk (see DataFiles.isComplete),
+so the cycle streams through lead hours: f001 is layered while later
+lead hours are still arriving.  If HRRR is not
+finished short_range_fcst_max_wait_minutes after the first input of a
+lead time was seen (or fails), RAP is passed through instead, as in
+ShortRangeLayeringDriver.  0 hour HRRR/RAP files (which also feed
+Analysis and Assimilation), MRMS and GFS files are single tasks that do
+what Regrid_Driver.regrid() does with this parm file and fail when any
+step fails, and CFS files single LongRangeRegridDriver tasks.
+
+Tasks run by priority class (Analysis and Assimilation, Short, Medium,
+Long Range) and lead hour; Long Range work is throttled to
+scheduler_busy_batch_workers while more urgent work is pending.
+
+New files are found with the same DataFiles scan and regrid state files
+as Regrid_Driver, rescanned when inotify reports a change (or every
+regrid_rescan_seconds on network filesystems).  An input file is written
+to the state file only once its last task has finished, so the inputs
+being processed when it stops are picked up again when it restarts.  Do
+not run it together with Regrid_Driver, ShortRangeLayeringDriver or
+LongRangeRegridDriver.
+With staging_dir set, inputs are copied to local scratch just ahead of
+their tasks: those of the next staging_lookahead tasks to run, in
+priority order (see Staging.py).  Each task releases its copy when it
+ends, also when it fails.
+
+Usage:  python ForcingScheduler.py <parm file>
+"""
+
+import os
+import sys
+import time
+import logging
+import datetime
+from ConfigParser import SafeConfigParser
+import DataFiles as df
+import FileNames
+import DirectoryWatch as dw
+import Regrid_Driver as rd
+import LongRangeRegridDriver as lrd
+import Short_Range_Forcing as srf
+import WRF_Hydro_forcing as whf
+import CoverageMask
+import FileOps
+import Scheduler
+import Staging
+
+#----------------------------------------------------------------------------
+# Input data types scanned
+FILE_TYPES = ['HRRR', 'RAP', 'MRMS', 'GFS']
+
+# Worker threads, if not in the parm file
+DEFAULT_NUM_WORKERS = 4
+
+# Long Range tasks run at once while there is more urgent work, if not in
+# the parm file
+DEFAULT_BUSY_BATCH_WORKERS = 1
+
+# Priority class of the tasks for each input type
+PRIORITIES = {'HRRR': Scheduler.SHORT_RANGE, 'RAP': Scheduler.SHORT_RANGE,
+              'MRMS': Scheduler.ANALYSIS, 'GFS': Scheduler.MEDIUM_RANGE,
+              'CFS': Scheduler.LONG_RANGE}
+
+# Hours a finished task is remembered, so late partners can depend on it
+PURGE_HOURS = 24
+
+#----------------------------------------------------------------------------
+def layerPath(ftime):
+   """Return the file name that layering uses for a forecast time
+
+   Parameters
+   ----------
+   ftime: ForecastTime
+
+   Returns
+   -------
+   str
+      'yyyymmddhh/yyyymmddhhmm.LDASIN_DOMAIN1.nc', issue time directory
+   """
+   issue = ftime.ymdh()
+   valid = issue + datetime.timedelta(hours=ftime._forecastHour)
+   return FileNames.ldasinName(issue, valid)
+
+#----------------------------------------------------------------------------
+def taskName(step, fileType, name):
+   """Return the task name for a step on a file
+
+   Parameters
+   ----------
+   step: str
+      'regrid', 'downscale', 'finish', 'layer'
+   fileType: str
+      'HRRR', ..., or empty for layering
+   name: str
+      Input or layering file name
+
+   Returns
+   -------
+   str
+   """
+   if (fileType):
+      return step + " " + fileType + " " + name
+   return step + " " + name
+
+#----------------------------------------------------------------------------
+class Pipelines:
+   """Turns new input files into tasks
+
+   Attributes
+   ----------
+   _parser: SafeConfigParser
+      parser for the config/param file
+   _scheduler: Scheduler.Scheduler
+      The task graph
+   _hrrrMaxFcstHour: int
+      Forecast hours below this are layered
+   _maxWaitSeconds: int
+      Seconds layering waits for HRRR before passing RAP through
+   _coverage: CoverageMask.Coverage
+      HRRR coverage mask, shared by all layering tasks
+   _checkpoint
+      Record of tasks done in earlier runs, with done(name), result(name)
+      and record(name, result) (see Backfill.py), or None
+   _added: dict
+      task name -> time added
+   _pending: dict
+      input type -> (input file name -> list[str] names of its last
+      tasks), for the files whose processing is not finished
+   """
+
+   def __init__(self, parser, scheduler, checkpoint=None, deadlines=1):
+      """Initialization using input args
+
+      Parameters
+      ----------
+      parser: SafeConfigParser
+      scheduler: Scheduler.Scheduler
+      checkpoint:
+         If set, tasks it has as done are not run again, and the ones
+         that make outputs are recorded in it when done
+      deadlines: bool
+         False to have layering wait for HRRR as long as it takes
+      """
+      self._parser = parser
+      self._scheduler = scheduler
+      self._hrrrMaxFcstHour = int(parser.get('fcsthr_max', 'HRRR_fcsthr_max'))
+      self._maxWaitSeconds = None
+      if (deadlines):
+         self._maxWaitSeconds = 60*int(parser.get('triggering',
+                                                  'short_range_fcst_max_wait_minutes'))
+      self._coverage = CoverageMask.coverageFor(parser, 'HRRR')
+      self._checkpoint = checkpoint
+      self._added = {}
+      self._pending = {}
+
+   def addFile(self, fileType, fname):
+      """Add the tasks for a new input file
+
+      Parameters
+      ----------
+      fileType: str
+         'HRRR', ..., 'CFS'
+      fname: str
+         File name with yyyymmdd parent dir
+      """
+      priority = PRIORITIES[fileType]
+      f = df.DataFile(fname[0:8], fname[9:], fileType)
+      lead = 0
+      if (f._ok):
+         lead = f._time._forecastHour
+      if (fileType == 'CFS'):
+         regrid = taskName('regrid', fileType, fname)
+         self._add(regrid, self._regridCFS, (fname,), priority=priority,
+                   lead=lead)
+         self._track(fileType, fname, [regrid])
+         return
+      # the tasks reading the input file stage it (see Scheduler.add)
+      dataDir = self._parser.get('data_dir', fileType + '_data')
+      staging = {'stage': (rd.prefetch, (dataDir, fname, fileType)),
+                 'unstage': (rd.release, (dataDir, fname))}
+      if (fileType != 'HRRR' and fileType != 'RAP'):
+         regrid = taskName('regrid', fileType, fname)
+         self._add(regrid, self._regridInput, (fname, fileType),
+                   priority=priority, lead=lead, **staging)
+         self._track(fileType, fname, [regrid])
+         return
+      if (not f._ok):
+         logging.error("Cannot schedule %s", fname)
+         return
+      path = layerPath(f._time)
+      finish = taskName('finish', fileType, path)
+      if (lead == 0):
+         # 0 hour special cases are handled as one step, and they also
+         # feed Analysis and Assimilation
+         self._add(finish, self._regridInput, (fname, fileType),
+                   priority=Scheduler.ANALYSIS, **staging)
+      else:
+         regrid = taskName('regrid', fileType, fname)
+         downscale = taskName('downscale', fileType, fname)
+         if (not self._doneBefore(finish)):
+            # intermediate files do not outlive a run, so these two are
+            # not checkpointed
+            self._add(regrid, self._regrid, (fileType, fname),
+                      priority=priority, lead=lead, checkpoint=0,
+                      **staging)
+            self._add(downscale, self._downscale, (fileType, regrid),
+                      [regrid], priority=priority, lead=lead, checkpoint=0)
+         self._add(finish, self._finish, (fileType, regrid), [downscale],
+                   priority=priority, lead=lead)
+      last = [finish]
+      if (lead < self._hrrrMaxFcstHour):
+         # the clock starts with the first input of this lead time
+         hrrr = taskName('finish', 'HRRR', path)
+         deadline = None
+         if (self._maxWaitSeconds is not None):
+            deadline = time.time() + self._maxWaitSeconds
+         layer = taskName('layer', '', path)
+         self._add(layer, self._layer, (path,),
+                   [hrrr, taskName('finish', 'RAP', path)],
+                   priority=priority, lead=lead, optional=[hrrr],
+                   fallback=(self._passthrough, (path,)), deadline=deadline)
+         last.append(layer)
+      self._track(fileType, fname, last)
+
+   def settle(self, fileType):
+      """Return the input files of a type whose last tasks have all
+      finished (done or failed) since the previous call
+
+      Parameters
+      ----------
+      fileType: str
+         'HRRR', ..., 'CFS'
+
+      Returns
+      -------
+      list[str]
+         File names with yyyymmdd parent dir
+      """
+      pending = self._pending.get(fileType, {})
+      ret = []
+      for fname, names in pending.items():
+         # a task no longer known was purged, so it finished
+         if (all(self._scheduler.state(n) in (Scheduler.DONE,
+                                               Scheduler.FAILED, None)
+                 for n in names)):
+            ret.append(fname)
+      for fname in ret:
+         del pending[fname]
+      return ret
+
+   def pending(self, fileType):
+      """Return the input files of a type still being processed
+
+      Parameters
+      ----------
+      fileType: str
+         'HRRR', ..., 'CFS'
+
+      Returns
+      -------
+      set
+         File names with yyyymmdd parent dir
+      """
+      return set(self._pending.get(fileType, {}).keys())
+
+   def purge(self):
+      """Forget tasks added more than PURGE_HOURS ago that are not running
+      """
+      cutoff = time.time() - PURGE_HOURS*3600
+      n = self._scheduler.purge(lambda name: self._added.get(name, 0) > cutoff)
+      if (n > 0):
+         self._added = dict((k, t) for k, t in self._added.items()
+                            if self._scheduler.state(k) is not None)
+         logging.debug("Purged %d tasks", n)
+
+   def _add(self, name, func, args, deps=(), checkpoint=1, **kwargs):
+      """Add one task to the graph, see Scheduler.add(), or add it as
+      done if the checkpoint has it.  checkpoint=0 for tasks that are
+      never recorded as done
+      """
+      if (checkpoint and self._doneBefore(name)):
+         added = self._scheduler.addDone(name, self._checkpoint.result(name))
+      else:
+         if (checkpoint and self._checkpoint is not None):
+            args = (name, func) + tuple(args)
+            func = self._recorded
+            fallback = kwargs.get('fallback')
+            if (fallback is not None):
+               kwargs['fallback'] = (self._recorded,
+                                     (name, fallback[0]) + tuple(fallback[1]))
+         added = self._scheduler.add(name, func, args, deps, **kwargs)
+      if (added):
+         self._added[name] = time.time()
+
+   def _track(self, fileType, fname, names):
+      """Remember the last tasks of an input file, see settle()
+      """
+      self._pending.setdefault(fileType, {})[fname] = names
+
+   def _doneBefore(self, name):
+      """Check if the checkpoint has a task as done
+      """
+      return self._checkpoint is not None and self._checkpoint.done(name)
+
+   def _recorded(self, name, func, *args):
+      """Task wrapper: run func and record it in the checkpoint when done
+      """
+      result = func(*args)
+      self._checkpoint.record(name, result)
+      return result
+
+   def _regridInput(self, fname, fileType):
+      """Task: all of Regrid_Driver's processing of one input file: a 0
+      hour HRRR or RAP forecast for Short Range and for Analysis and
+      Assimilation, MRMS for Analysis and Assimilation, GFS for Medium
+      Range
+      """
+      if (rd.regrid(self._parser, fname, fileType)):
+         raise Scheduler.TaskError("regridding " + fname)
+
+   def _regridCFS(self, fname):
+      """Task: long range processing of one CFS file
+      """
+      if (lrd.regridCFS(fname, self._parser)):
+         raise Scheduler.TaskError("long range processing " + fname)
+
+   def _regrid(self, fileType, fname):
+      """Task: regrid, returning the regridded file
+      """
+      try:
+         regridded = srf.regrid_file(self._parser, fileType, fname[9:])
+      finally:
+         rd.release(self._parser.get('data_dir', fileType + '_data'), fname)
+      if (not regridded):
+         raise Scheduler.TaskError("regridding " + fname)
+      return regridded
+
+   def _downscale(self, fileType, regridTask):
+      """Task: downscale the output of a regrid task
+      """
+      regridded = self._scheduler.result(regridTask)
+      if (srf.downscale_file(self._parser, fileType, regridded)):
+         raise Scheduler.TaskError("downscaling " + regridded)
+      return regridded
+
+   def _finish(self, fileType, regridTask):
+      """Task: move the downscaled file to the finished area
+      """
+      regridded = self._scheduler.result(regridTask)
+      path = srf.finish_file(self._parser, fileType, regridded)
+      if (path is None):
+         raise Scheduler.TaskError("finishing " + regridded)
+      return path
+
+   def _layer(self, path):
+      """Task: layer HRRR over RAP
+      """
+      logging.info("LAYERING %s", path)
+      if (not whf.layer_data(self._parser, path, path, 'HRRR', 'RAP',
+                             'Short_Range', self._coverage)):
+         raise Scheduler.TaskError("layering " + path)
+      logging.info("DONE LAYERING file=%s", path)
+
+   def _passthrough(self, path):
+      """Task: pass RAP through as if it were layered
+      """
+      logging.info("LAYERING (Passthrough) %s ", path)
+      src = self._parser.get('downscaling', 'RAP_finished_output_dir') + \
+            "/" + path
+      dst = self._parser.get('layering', 'short_range_output') + "/" + \
+            os.path.splitext(path)[0]
+      if (not FileOps.materialize(src, dst)):
+         raise Scheduler.TaskError("passing through " + src)
+      logging.info("LAYERING (Passthrough) %s complete", path)
+
+#----------------------------------------------------------------------------
+def setupLogging(parser, logName="ForcingScheduler.log"):
+   """Log to a file at the configured level
+
+   Parameters
+   ----------
+   parser: SafeConfigParser
+   logName: str
+      Log file name
+   """
+   logging_level = parser.get('log_level', 'forcing_engine_log_level')
+   if logging_level == 'DEBUG':
+      set_level = logging.DEBUG
+   elif logging_level == 'INFO':
+      set_level = logging.INFO
+   elif logging_level == 'WARNING':
+      set_level = logging.WARNING
+   elif logging_level == 'ERROR':
+      set_level = logging.ERROR
+   else:
+      set_level = logging.CRITICAL
+   logging.basicConfig(format='%(asctime)s %(threadName)s %(message)s',
+                       filename=logName, level=set_level)
+
+#----------------------------------------------------------------------------
+def main(argv):
+
+   # User must pass the config file into the main driver.
+   configFile = argv[0]
+   if not os.path.exists(configFile):
+      print 'ERROR forcing engine config file not found.'
+      return 1
+   parser = SafeConfigParser()
+   parser.read(configFile)
+   setupLogging(parser)
+   # NCARG_ROOT and NCL_DEF_LIB_DIR for the NCL runs of all tasks; the
+   # per step functions the tasks call do not set them
+   whf.initial_setup(parser, "ForcingScheduler")
+   if (parser.has_option('triggering', 'scheduler_num_workers')):
+      numWorkers = int(parser.get('triggering', 'scheduler_num_workers'))
+   else:
+      numWorkers = DEFAULT_NUM_WORKERS
+   if (parser.has_option('triggering', 'scheduler_busy_batch_workers')):
+      busyBatchWorkers = int(parser.get('triggering',
+                                        'scheduler_busy_batch_workers'))
+   else:
+      busyBatchWorkers = DEFAULT_BUSY_BATCH_WORKERS
+
+   # regrid parameters and state of each input type
+   parms = {}
+   states = {}
+   for fileType in FILE_TYPES:
+      parms[fileType] = rd.parmRead(configFile, fileType)
+      if (not os.path.exists(parms[fileType]._stateFile)):
+         rd.createStateFile(parms[fileType], fileType)
+      states[fileType] = rd.State(parms[fileType]._stateFile, fileType)
+   cfsParms = lrd.parmRead(configFile)
+   if (not os.path.exists(cfsParms._stateFile)):
+      lrd.createStateFile(cfsParms)
+   cfsState = lrd.State(cfsParms._stateFile)
+   # (the parmRead calls above each chose a per type file)
+   if (parser.has_option('triggering', 'dir_cache_file')):
+      df.useDirCache(parser.get('triggering', 'dir_cache_file').strip(),
+                     "scheduler")
+
+   scheduler = Scheduler.Scheduler(numWorkers, busyBatchWorkers,
+                                   Staging.lookahead(parser))
+   pipelines = Pipelines(parser, scheduler)
+
+   dataDirs = [parms[fileType]._dataDir for fileType in FILE_TYPES]
+   dataDirs.append(cfsParms._cfsDir)
+   watch = dw.DirectoryWatch()
+   useInotify = watch.available()
+   for dataDir in dataDirs:
+      if (useInotify and dw.isNetworkFilesystem(dataDir)):
+         logging.info("%s is on a network filesystem, rescanning only",
+                      dataDir)
+         watch.close()
+         useInotify = 0
+   rescanSeconds = parms[FILE_TYPES[0]]._rescanSeconds
+   settleSeconds = parms[FILE_TYPES[0]]._settleSeconds
+   logging.info("Scheduler started with %d workers", numWorkers)
+
+   while (1):
+      if (useInotify):
+         for dataDir in dataDirs:
+            rd.watchActiveDirs(watch, dataDir)
+      incomplete = 0
+      for fileType in FILE_TYPES:
+         p = parms[fileType]
+         data = df.DataFiles(p._dataDir, p._maxFcstHour, fileType)
+         data.setNewestFiles(p._hoursBack)
+         incomplete += data.dropIncomplete(settleSeconds)
+         new = states[fileType].updateWithNew(data, p._hoursBack, fileType)
+         for f in new:
+            pipelines.addFile(fileType, f)
+         # files still being processed are left out of the state file,
+         # so they are found again after a restart
+         if (pipelines.settle(fileType) or new):
+            states[fileType].write(p._stateFile, fileType,
+                                   pipelines.pending(fileType))
+      cfs = df.DataFiles(cfsParms._cfsDir, cfsParms._maxFcstHourCfs, "CFS")
+      cfs.setNewestFiles(cfsParms._hoursBackCfs)
+      incomplete += cfs.dropIncomplete(settleSeconds)
+      new = cfsState.updateWithNew(cfs, cfsParms._hoursBackCfs)
+      for f in new:
+         pipelines.addFile('CFS', f)
+      if (pipelines.settle('CFS') or new):
+         cfsState.write(cfsParms._stateFile, pipelines.pending('CFS'))
+      pipelines.purge()
+      df.saveDirCache()
+
+      wait = rescanSeconds
+      if (incomplete > 0):
+         # look again once they may have settled
+         wait = min(wait, max(1, settleSeconds))
+      if (not useInotify):
+         time.sleep(wait)
+         continue
+      events = watch.wait(wait)
+      while (events):
+         events = watch.wait(0)
+
+#----------------------------------------------
+
+if __name__ == "__main__":
+   main(sys.argv[1:])
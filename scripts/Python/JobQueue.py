@@ -0,0 +1,523 @@
+"""JobQueue
+Task graph kept in an SQLite database on shared storage, so workers on
+several hosts can run it (see QueueWorker.py) with no broker process.
+
+A worker claims a ready job with a lease, renews the lease with
+heartbeats while the job runs, and reports it done or failed.  A job
+whose lease expires (its worker died or hung) goes back to the queue, up
+to a maximum number of attempts.  Jobs have the same dependency,
+priority, optional dependency, fallback and deadline semantics as
+Scheduler.py, and QueueScheduler puts the Scheduler interface on a queue
+so ForcingScheduler.Pipelines can plan into it.
+
+Every claim is one IMMEDIATE transaction, so two workers never get the
+same job.  This relies on working POSIX locks on the shared filesystem
+(true of local disks, Lustre/GPFS and NFS with lockd); without them
+SQLite databases get corrupted.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import SqliteDb
+
+#----------------------------------------------------------------------------
+# Job states (the Scheduler ones, with QUEUED for WAITING/READY)
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Defaults
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Job names per query, below SQLite's limit on query parameters
+NAMES_PER_QUERY = 500
+
+_SCHEMA = """
+create table if not exists jobs (
+   seq integer primary key autoincrement,
+   name text unique not null,
+   kind text,
+   args text,
+   fallback_kind text,
+   fallback_args text,
+   priority integer default 0,
+   lead integer default 0,
+   deadline real,
+   state text not null,
+   owner text,
+   lease_until real,
+   attempts integer default 0,
+   result text,
+   updated real
+);
+create index if not exists jobs_state on jobs (state, priority, lead, seq);
+create table if not exists deps (
+   name text not null,
+   dep text not null,
+   optional integer default 0,
+   primary key (name, dep)
+);
+create index if not exists deps_dep on deps (dep);
+"""
+
+#----------------------------------------------------------------------------
+def workerId(suffix=""):
+   """Return a name for a worker, unique in the cluster
+
+   Parameters
+   ----------
+   suffix: str
+      Distinguishes workers of one process
+
+   Returns
+   -------
+   str
+      host:pid[:suffix]
+   """
+   ret = "%s:%d" %(socket.gethostname(), os.getpid())
+   if (suffix):
+      ret += ":" + suffix
+   return ret
+
+#----------------------------------------------------------------------------
+class JobQueue:
+   """Connection to a job queue database, used by one thread at a time
+
+   Attributes
+   ----------
+   _path: str
+      Database file
+   _leaseSeconds: float
+      Seconds a claim or heartbeat keeps a job
+   _maxAttempts: int
+      Claims of a job before it fails for good
+   _db: sqlite3.Connection
+   """
+
+   def __init__(self, path, leaseSeconds=DEFAULT_LEASE_SECONDS,
+                maxAttempts=DEFAULT_MAX_ATTEMPTS):
+      """Open, creating the tables if needed
+
+      Parameters
+      ----------
+      path: str
+         Database file
+      leaseSeconds: float
+         Seconds a claim or heartbeat keeps a job
+      maxAttempts: int
+         Claims of a job before it fails for good
+      """
+      self._path = path
+      self._leaseSeconds = leaseSeconds
+      self._maxAttempts = maxAttempts
+      self._db = SqliteDb.connect(path, _SCHEMA)
+
+   def close(self):
+      """Close the connection
+      """
+      self._db.close()
+
+   def put(self, name, kind, args=(), deps=(), priority=0, lead=0,
+           optional=(), fallback=None, deadline=None):
+      """Add a job, or queue a failed one with this name again
+
+      Parameters
+      ----------
+      name: str
+         Unique job name
+      kind: str
+         What to run, interpreted by the worker
+      args: tuple
+         JSON serializable arguments
+      deps: list[str]
+         Names of jobs that must be done first
+      priority: int
+         Lower runs first
+      lead: int
+         Lower runs first within a priority
+      optional: list[str]
+         Those deps that may be given up on
+      fallback: tuple
+         (kind, args) run instead when optional deps are given up on
+      deadline: float
+         Epoch seconds after which optional deps are given up on
+
+      Returns
+      -------
+      bool
+         True if added or queued again
+      """
+      fallbackKind = None
+      fallbackArgs = None
+      if (fallback is not None):
+         fallbackKind = fallback[0]
+         fallbackArgs = json.dumps(list(fallback[1]))
+      now = time.time()
+      with SqliteDb.Transaction(self._db):
+         row = self._db.execute("select state, kind from jobs where name=?",
+                                (name,)).fetchone()
+         if (row is not None and row[0] != FAILED):
+            return 0
+         if (row is None):
+            self._db.execute(
+               "insert into jobs (name, kind, args, fallback_kind,"
+               " fallback_args, priority, lead, deadline, state, updated)"
+               " values (?,?,?,?,?,?,?,?,?,?)",
+               (name, kind, json.dumps(list(args)), fallbackKind,
+                fallbackArgs, priority, lead, deadline, QUEUED, now))
+         else:
+            # failed in an earlier run, or a placeholder for a missing
+            # input that has now turned up
+            self._db.execute(
+               "update jobs set kind=?, args=?, fallback_kind=?,"
+               " fallback_args=?, priority=?, lead=?, deadline=?, state=?,"
+               " owner=null, lease_until=null, attempts=0, result=null,"
+               " updated=? where name=?",
+               (kind, json.dumps(list(args)), fallbackKind, fallbackArgs,
+                priority, lead, deadline, QUEUED, now, name))
+         optional = set(optional)
+         for d in deps:
+            self._db.execute("insert or ignore into deps (name, dep, optional)"
+                             " values (?,?,?)", (name, d, int(d in optional)))
+      return 1
+
+   def putDone(self, name, result=None):
+      """Add a job that is already done, unless one with this name exists
+
+      Parameters
+      ----------
+      name: str
+      result: str
+         Its result
+      """
+      with SqliteDb.Transaction(self._db):
+         self._db.execute("insert or ignore into jobs (name, state, result,"
+                          " updated) values (?,?,?,?)",
+                          (name, DONE, json.dumps(result), time.time()))
+
+   def failMissing(self, why):
+      """Add dependencies that no job was put for as failed
+
+      Parameters
+      ----------
+      why: str
+         Reason logged
+
+      Returns
+      -------
+      list[str]
+         Names of the dependencies failed
+      """
+      with SqliteDb.Transaction(self._db):
+         missing = [r[0] for r in self._db.execute(
+            "select distinct dep from deps where dep not in"
+            " (select name from jobs)")]
+         for d in missing:
+            logging.info("Job %s failed: %s", d, why)
+            self._db.execute("insert into jobs (name, state, updated)"
+                             " values (?,?,?)", (d, FAILED, time.time()))
+      return missing
+
+   def claim(self, owner):
+      """Claim the most urgent ready job
+
+      Parameters
+      ----------
+      owner: str
+         Worker name, see workerId()
+
+      Returns
+      -------
+      tuple
+         (name, kind, args), None if no job is ready
+      """
+      now = time.time()
+      with SqliteDb.Transaction(self._db):
+         self._expireLeases(now)
+         rows = self._db.execute(
+            "select name, kind, args, fallback_kind, fallback_args, deadline"
+            " from jobs j where state=? and not exists"
+            " (select 1 from deps d left join jobs x on x.name=d.dep"
+            "  where d.name=j.name and (x.state is null or x.state not in"
+            "  (?,?)) and not (d.optional=1 and j.fallback_kind is not null"
+            "  and j.deadline is not null and j.deadline<?))"
+            " order by priority, lead, seq limit 16",
+            (QUEUED, DONE, FAILED, now)).fetchall()
+         for name, kind, args, fallbackKind, fallbackArgs, deadline in rows:
+            deps = self._db.execute(
+               "select d.dep, d.optional, x.state from deps d left join jobs x"
+               " on x.name=d.dep where d.name=?", (name,)).fetchall()
+            failedRequired = [d for d, opt, state in deps
+                              if state == FAILED and not opt]
+            if (failedRequired):
+               self._fail(name, "dependency %s failed" %(failedRequired[0]))
+               continue
+            if ([d for d, opt, state in deps if opt and state != DONE]):
+               if (fallbackKind is None):
+                  self._fail(name, "optional dependency not done, no fallback")
+                  continue
+               logging.info("Job %s falls back", name)
+               kind, args = fallbackKind, fallbackArgs
+            self._db.execute(
+               "update jobs set state=?, owner=?, lease_until=?,"
+               " attempts=attempts+1, updated=? where name=?",
+               (RUNNING, owner, now + self._leaseSeconds, now, name))
+            return (name, kind, json.loads(args))
+      return None
+
+   def heartbeat(self, name, owner):
+      """Renew the lease of a running job
+
+      Parameters
+      ----------
+      name: str
+      owner: str
+
+      Returns
+      -------
+      bool
+         False if the job is no longer this worker's
+      """
+      now = time.time()
+      with SqliteDb.Transaction(self._db):
+         n = self._db.execute(
+            "update jobs set lease_until=?, updated=? where name=? and"
+            " owner=? and state=?",
+            (now + self._leaseSeconds, now, name, owner, RUNNING)).rowcount
+      return n > 0
+
+   def complete(self, name, owner, result=None):
+      """Report a job done
+
+      Parameters
+      ----------
+      name: str
+      owner: str
+      result:
+         JSON serializable result, see result()
+
+      Returns
+      -------
+      bool
+         False if the job was no longer this worker's
+      """
+      with SqliteDb.Transaction(self._db):
+         n = self._db.execute(
+            "update jobs set state=?, owner=null, lease_until=null, result=?,"
+            " updated=? where name=? and owner=? and state=?",
+            (DONE, json.dumps(result), time.time(), name, owner,
+             RUNNING)).rowcount
+      return n > 0
+
+   def fail(self, name, owner, why):
+      """Report a job failed; it is queued again if it has attempts left
+
+      Parameters
+      ----------
+      name: str
+      owner: str
+      why: str
+         Reason logged
+
+      Returns
+      -------
+      bool
+         False if the job was no longer this worker's
+      """
+      with SqliteDb.Transaction(self._db):
+         row = self._db.execute(
+            "select attempts from jobs where name=? and owner=? and state=?",
+            (name, owner, RUNNING)).fetchone()
+         if (row is None):
+            return 0
+         if (row[0] < self._maxAttempts):
+            logging.warning("Job %s failed (%s), queued again", name, why)
+            self._db.execute(
+               "update jobs set state=?, owner=null, lease_until=null,"
+               " updated=? where name=?", (QUEUED, time.time(), name))
+         else:
+            self._fail(name, why)
+      return 1
+
+   def state(self, name):
+      """Return the state of a job
+
+      Returns
+      -------
+      str
+         QUEUED, RUNNING, DONE or FAILED, None if not known
+      """
+      row = self._db.execute("select state from jobs where name=?",
+                             (name,)).fetchone()
+      if (row is None):
+         return None
+      return row[0]
+
+   def result(self, name):
+      """Return the result of a job that is done
+
+      Returns
+      -------
+         As given to complete(), None if not done
+      """
+      row = self._db.execute("select result from jobs where name=? and"
+                             " state=?", (name, DONE)).fetchone()
+      if (row is None or row[0] is None):
+         return None
+      return json.loads(row[0])
+
+   def counts(self, names=None):
+      """Return the number of jobs in each state
+
+      Parameters
+      ----------
+      names: list[str]
+         Count only these jobs, if given
+
+      Returns
+      -------
+      dict
+         state -> number of jobs
+      """
+      if (names is None):
+         return dict(self._db.execute("select state, count(*) from jobs"
+                                      " group by state").fetchall())
+      ret = {}
+      names = list(names)
+      for i in range(0, len(names), NAMES_PER_QUERY):
+         part = names[i:i + NAMES_PER_QUERY]
+         rows = self._db.execute("select state, count(*) from jobs where"
+                                 " name in (%s) group by state"
+                                 %(",".join("?"*len(part))), part)
+         for state, n in rows:
+            ret[state] = ret.get(state, 0) + n
+      return ret
+
+   def _expireLeases(self, now):
+      """Queue again (or fail) running jobs whose lease expired, in a
+      transaction
+      """
+      rows = self._db.execute(
+         "select name, owner, attempts from jobs where state=? and"
+         " lease_until<?", (RUNNING, now)).fetchall()
+      for name, owner, attempts in rows:
+         if (attempts < self._maxAttempts):
+            logging.warning("Lease of %s by %s expired, queued again",
+                            name, owner)
+            self._db.execute(
+               "update jobs set state=?, owner=null, lease_until=null,"
+               " updated=? where name=?", (QUEUED, now, name))
+         else:
+            self._fail(name, "lease of %s expired" %(owner))
+
+   def _fail(self, name, why):
+      """Mark a job failed, and the jobs that depend on it, in a
+      transaction.  Jobs for which it is optional are left to claim(),
+      which runs their fallback
+      """
+      logging.error("Job %s failed: %s", name, why)
+      self._db.execute(
+         "update jobs set state=?, owner=null, lease_until=null, updated=?"
+         " where name=?", (FAILED, time.time(), name))
+      dependents = [r[0] for r in self._db.execute(
+         "select d.name from deps d join jobs j on j.name=d.name where"
+         " d.dep=? and d.optional=0 and j.state=?", (name, QUEUED))]
+      for d in dependents:
+         self._fail(d, "dependency %s failed" %(name))
+
+#----------------------------------------------------------------------------
+class QueueScheduler:
+   """The Scheduler interface used by ForcingScheduler.Pipelines and
+   Backfill, on a job queue.  Task functions must be methods of
+   ForcingScheduler.Pipelines with JSON serializable arguments; the
+   method name is the job kind.
+
+   Attributes
+   ----------
+   _queue: JobQueue
+   _names: set[str]
+      Jobs added through this scheduler, the ones counts() and wait()
+      look at; the queue may hold jobs of other runs
+   _lock: threading.Lock
+      Serializes use of the connection
+   """
+
+   def __init__(self, queue):
+      """Initialization using input args
+      """
+      self._queue = queue
+      self._names = set()
+      self._lock = threading.Lock()
+
+   def add(self, name, func, args=(), deps=(), priority=0, lead=0,
+           optional=(), fallback=None, deadline=None, stage=None,
+           unstage=None):
+      """See Scheduler.add(); stage and unstage are not used, the jobs
+      run on other hosts
+      """
+      if (fallback is not None):
+         fallback = (fallback[0].__name__, fallback[1])
+      with self._lock:
+         self._names.add(name)
+         return self._queue.put(name, func.__name__, args, deps, priority,
+                                lead, optional, fallback, deadline)
+
+   def addDone(self, name, result=None):
+      """See Scheduler.addDone()
+      """
+      with self._lock:
+         self._names.add(name)
+         self._queue.putDone(name, result)
+      return 1
+
+   def failMissing(self, why):
+      """See Scheduler.failMissing()
+      """
+      with self._lock:
+         missing = self._queue.failMissing(why)
+         self._names.update(missing)
+         return len(missing)
+
+   def state(self, name):
+      """See Scheduler.state()
+      """
+      with self._lock:
+         return self._queue.state(name)
+
+   def result(self, name):
+      """See Scheduler.result()
+      """
+      with self._lock:
+         return self._queue.result(name)
+
+   def counts(self):
+      """See Scheduler.counts(), for the jobs added through this scheduler
+      """
+      with self._lock:
+         return self._queue.counts(self._names)
+
+   def wait(self, timeout=None):
+      """Wait until no job added through this scheduler is queued or
+      running, see Scheduler.wait()
+      """
+      end = None
+      if (timeout is not None):
+         end = time.time() + timeout
+      while (1):
+         counts = self.counts()
+         if (not counts.get(QUEUED, 0) and not counts.get(RUNNING, 0)):
+            return 1
+         if (end is not None and time.time() >= end):
+            return 0
+         time.sleep(10)
+
+   def purge(self, keep):
+      """Finished jobs stay in the database
+      """
+      return 0
@@ -0,0 +1,436 @@
+"""Layering
+Layers (combines) downscaled forcing files into a single LDASIN file, in
+memory, using NumPy.  mosaic() is the general engine: each variable has
+an ordered list of sources, and every source is copied over the lower
+priority ones where its boolean missing-mask allows, on the 2-D fields.
+For the Short Range forcing configuration cells where the primary
+product (HRRR) is missing are filled from the secondary product (RAP),
+and every variable is written to the output file in a single pass.
+Replaces combine.ncl and the layering in layer_anal_assim.ncl.
+"""
+
+import os
+import time
+import logging
+import numpy as np
+from netCDF4 import Dataset
+
+#----------------------------------------------------------------------------
+# Forcing variables that make up a layered LDASIN file
+FORCING_VARIABLES = ['T2D', 'Q2D', 'U2D', 'V2D', 'PSFC', 'RAINRATE',
+                     'SWDOWN', 'LWDOWN']
+
+# Variables taken from the secondary product everywhere (no layering)
+SECONDARY_ONLY_VARIABLES = ['LWDOWN']
+
+# Variable whose missing cells define where the primary product has no data
+MASK_VARIABLE = 'T2D'
+
+# Missing value used in all forcing files
+FILL_VALUE = 1.e+20
+
+# Output units and long name of each forcing variable
+VARIABLE_ATTRIBUTES = {
+    'T2D': ('K', '2-m Air Temperature'),
+    'Q2D': ('kg/kg', '2-m specific humidity'),
+    'U2D': ('m/s', '10-m U-wind component'),
+    'V2D': ('m/s', '10-m V-wind component'),
+    'PSFC': ('Pa', 'Surface Pressure'),
+    'RAINRATE': ('mm s^-1', 'RAINRATE'),
+    'SWDOWN': ('W/m^2', 'Surface downward shortwave radiation'),
+    'LWDOWN': ('W/m^2', 'Surface downward longwave radiation')}
+
+# Description attribute of the variables that have one
+VARIABLE_DESCRIPTIONS = {'RAINRATE': 'RAINRATE'}
+
+#----------------------------------------------------------------------------
+def readFields(fname, names):
+    """Read forcing fields from a netCDF file as 2-D float arrays
+
+    Missing values (_FillValue/missing_value or NaN) are left in place,
+    use missingMask() to locate them.
+
+    Parameters
+    ----------
+    fname : str
+       Full path to the netCDF file
+    names : list[str]
+       Variables to read
+
+    Returns
+    -------
+    dict
+       variable name -> numpy.ndarray of shape (south_north, west_east)
+    """
+    fields = {}
+    nc = Dataset(fname, 'r')
+    try:
+        nc.set_auto_mask(False)
+        for name in names:
+            var = nc.variables[name]
+            data = np.asarray(var[:], dtype=np.float64)
+            data = data.reshape(data.shape[-2:])
+            fill = _fillValue(var)
+            if (fill != FILL_VALUE):
+                # normalize to the common missing value
+                data[data == fill] = FILL_VALUE
+            fields[name] = data
+    finally:
+        nc.close()
+    return fields
+
+#----------------------------------------------------------------------------
+def missingMask(field):
+    """Return the boolean mask of missing cells in a field
+
+    Parameters
+    ----------
+    field : numpy.ndarray
+       Field as returned by readFields()
+
+    Returns
+    -------
+    numpy.ndarray
+       bool array, True where the field is missing
+    """
+    return (field >= FILL_VALUE) | np.isnan(field)
+
+#----------------------------------------------------------------------------
+def mosaic(plan, sources, missing=None):
+    """Build each output field from an ordered list of sources
+
+    For every variable the lowest priority source is the starting field,
+    and each higher priority source is copied over it where that source
+    has data, so the highest priority valid value wins in each cell.
+
+    Parameters
+    ----------
+    plan : dict
+       variable name -> list[str] of source names, highest priority first,
+       e.g. {'T2D': ['HRRR', 'RAP'], 'RAINRATE': ['MRMS', 'HRRR', 'RAP']}
+    sources : dict
+       source name -> (variable name -> 2-D array)
+    missing : dict
+       source name -> bool array, True where that source has no data
+       (e.g. a CoverageMask).  Sources not listed are masked per variable
+       with missingMask()
+
+    Returns
+    -------
+    dict
+       variable name -> 2-D array.  The lowest priority source array of
+       each variable is filled in place and returned when it is a
+       writable float64 array (as from readFields()), else a copy is;
+       the other sources are unchanged
+    """
+    # where each source has data, inverted once per source
+    valid = {}
+    if (missing is not None):
+        for source, mask in missing.items():
+            valid[source] = ~mask
+    layered = {}
+    for name, order in plan.items():
+        field = sources[order[-1]][name]
+        if (field.dtype != np.float64 or not field.flags.writeable):
+            field = np.array(field, dtype=np.float64)
+        for source in reversed(order[0:-1]):
+            data = sources[source][name]
+            where = valid.get(source)
+            if (where is None):
+                # not missingMask(): NaN compares false, so this is its
+                # inverse in one pass
+                with np.errstate(invalid='ignore'):
+                    where = data < FILL_VALUE
+            np.copyto(field, data, where=where)
+        layered[name] = field
+    return layered
+
+#----------------------------------------------------------------------------
+def layerFields(primary, secondary, mask, names=FORCING_VARIABLES,
+                secondaryOnly=SECONDARY_ONLY_VARIABLES):
+    """Fill the primary fields from the secondary ones where mask is set
+
+    Two source case of mosaic().
+
+    Parameters
+    ----------
+    primary : dict
+       variable name -> 2-D array, the preferred product (HRRR)
+    secondary : dict
+       variable name -> 2-D array, the fill product (RAP)
+    mask : numpy.ndarray
+       bool array, True where the primary product is missing
+    names : list[str]
+       Variables to layer
+    secondaryOnly : list[str]
+       Variables taken from the secondary product everywhere
+
+    Returns
+    -------
+    dict
+       variable name -> 2-D array, the layered fields
+    """
+    plan = {}
+    for name in names:
+        if (name in secondaryOnly):
+            plan[name] = ['secondary']
+        else:
+            plan[name] = ['primary', 'secondary']
+    return mosaic(plan, {'primary': primary, 'secondary': secondary},
+                  {'primary': mask})
+
+#----------------------------------------------------------------------------
+def writeFields(fname, fields, templateFile):
+    """Write all fields to a new netCDF file in one pass
+
+    Dimensions and variable attributes are copied from templateFile, so
+    the output looks like the downscaled inputs.
+
+    Parameters
+    ----------
+    fname : str
+       Full path of the file to create (clobbered if it exists)
+    fields : dict
+       variable name -> 2-D array
+    templateFile : str
+       Downscaled input file whose layout is copied
+    """
+    Layout(templateFile).write(fname, fields)
+
+#----------------------------------------------------------------------------
+class Layout:
+    """Dimensions and forcing variable definitions of a downscaled file,
+    read once and used to write any number of files like it
+
+    Attributes
+    ----------
+    shape : tuple
+       (south_north, west_east) of the forcing variables
+    _format : str
+       netCDF file format
+    _dims : list
+       (dimension name, length or None if unlimited)
+    _vars : list
+       (variable name, dtype, dimensions, [(attribute, value)]) of each
+       forcing variable, _FillValue left out
+    """
+
+    def __init__(self, templateFile):
+        """Read the layout of a downscaled file
+
+        Parameters
+        ----------
+        templateFile : str
+           Downscaled input file whose layout is copied
+        """
+        src = Dataset(templateFile, 'r')
+        try:
+            self._format = src.file_format
+            self._dims = []
+            for dimName, dim in src.dimensions.items():
+                if (dim.isunlimited()):
+                    self._dims.append((dimName, None))
+                else:
+                    self._dims.append((dimName, len(dim)))
+            self._vars = []
+            for name in FORCING_VARIABLES:
+                srcVar = src.variables[name]
+                attrs = [(attr, srcVar.getncattr(attr))
+                         for attr in srcVar.ncattrs() if attr != '_FillValue']
+                self._vars.append((name, srcVar.dtype, srcVar.dimensions,
+                                   attrs))
+            self.shape = tuple(src.variables[MASK_VARIABLE].shape[-2:])
+        finally:
+            src.close()
+
+    def write(self, fname, fields):
+        """Write all fields to a new netCDF file in one pass
+
+        Parameters
+        ----------
+        fname : str
+           Full path of the file to create (clobbered if it exists)
+        fields : dict
+           variable name -> 2-D array
+        """
+        out = Dataset(fname, 'w', format=self._format)
+        try:
+            for dimName, length in self._dims:
+                out.createDimension(dimName, length)
+
+            # define everything first, then write the data
+            outVars = {}
+            for name, dtype, dims, attrs in self._vars:
+                var = out.createVariable(name, dtype, dims,
+                                         fill_value=FILL_VALUE)
+                for attr, value in attrs:
+                    var.setncattr(attr, value)
+                outVars[name] = var
+            for name in FORCING_VARIABLES:
+                var = outVars[name]
+                if (var.ndim == 3):
+                    # (Time, south_north, west_east)
+                    var[0, :, :] = fields[name]
+                else:
+                    var[:] = fields[name]
+        finally:
+            out.close()
+
+#----------------------------------------------------------------------------
+def writeLdasin(fname, fields, title):
+    """Write forcing fields to a new LDASIN file in one pass
+
+    Variables are (Time, south_north, west_east) doubles with the
+    standard forcing attributes, as written by layer_anal_assim.ncl.
+
+    Parameters
+    ----------
+    fname : str
+       Full path of the file to create (clobbered if it exists)
+    fields : dict
+       variable name -> 2-D array
+    title : str
+       Title global attribute
+
+    Returns
+    -------
+    bool
+       True when written
+    """
+    shape = fields[FORCING_VARIABLES[0]].shape
+    out = Dataset(fname, 'w', format='NETCDF3_64BIT')
+    try:
+        out.title = title
+        out.creation_date = time.strftime("%a %b %d %H:%M:%S %Z %Y")
+        out.author = "National Center for Atmospheric Research"
+        out.Conventions = "None"
+        out.createDimension('Time', None)
+        out.createDimension('south_north', shape[0])
+        out.createDimension('west_east', shape[1])
+        dims = ('Time', 'south_north', 'west_east')
+
+        # define everything first, then write the data
+        outVars = {}
+        for name in FORCING_VARIABLES:
+            var = out.createVariable(name, 'f8', dims, fill_value=FILL_VALUE)
+            var.missing_value = FILL_VALUE
+            var.remap = "remapped via ESMF_regrid_with_weights: Bilinear"
+            var.units = VARIABLE_ATTRIBUTES[name][0]
+            var.long_name = VARIABLE_ATTRIBUTES[name][1]
+            if (name in VARIABLE_DESCRIPTIONS):
+                var.description = VARIABLE_DESCRIPTIONS[name]
+            outVars[name] = var
+        for name in FORCING_VARIABLES:
+            outVars[name][0, :, :] = fields[name]
+    finally:
+        out.close()
+    return 1
+
+#----------------------------------------------------------------------------
+def layer(primaryFile, secondaryFile, outFile, coverage=None):
+    """Layer two downscaled files into one output file
+
+    Parameters
+    ----------
+    primaryFile : str
+       Full path to the primary (HRRR) downscaled file
+    secondaryFile : str
+       Full path to the secondary (RAP) downscaled file
+    outFile : str
+       Full path to the layered output file
+    coverage : CoverageMask.Coverage
+       Cached coverage of the primary product, or None to compute the
+       missing-mask from the primary file
+
+    Returns
+    -------
+    bool
+       True if successful
+    """
+    return Batch(coverage).layer(primaryFile, secondaryFile, outFile)
+
+#----------------------------------------------------------------------------
+class Batch:
+    """Layers many pairs of downscaled files of the same two products on
+    the same grid, e.g. all the lead times of a Short Range forecast.
+    The missing-mask of the primary product is looked up and validated
+    for the first pair, and the output layout read from its primary
+    file; both are then used for every other pair, so each pair costs
+    one read of each input and one write.
+
+    Attributes
+    ----------
+    _coverage : CoverageMask.Coverage
+       Cached coverage of the primary product, or None to compute the
+       missing-mask from each primary file
+    _mask : numpy.ndarray
+       Missing-mask shared by the pairs, None until the first one
+    _layout : Layout
+       Layout of the output files, None until the first pair
+    """
+
+    def __init__(self, coverage=None):
+        """Initialization using input args
+        """
+        self._coverage = coverage
+        self._mask = None
+        self._layout = None
+
+    def layer(self, primaryFile, secondaryFile, outFile):
+        """Layer two downscaled files into one output file
+
+        Parameters
+        ----------
+        primaryFile : str
+           Full path to the primary (HRRR) downscaled file
+        secondaryFile : str
+           Full path to the secondary (RAP) downscaled file
+        outFile : str
+           Full path to the layered output file
+
+        Returns
+        -------
+        bool
+           True if successful
+        """
+        for f in [primaryFile, secondaryFile]:
+            if (not os.path.exists(f)):
+                logging.error("ERROR[Layering]: input %s not found", f)
+                return 0
+
+        primary = readFields(primaryFile, FORCING_VARIABLES)
+        secondary = readFields(secondaryFile, FORCING_VARIABLES)
+        field = primary[MASK_VARIABLE]
+        if (self._layout is None or self._layout.shape != field.shape):
+            # first pair, or one on another grid
+            self._layout = Layout(primaryFile)
+            self._mask = None
+        if (self._coverage is None):
+            mask = missingMask(field)
+        else:
+            if (self._mask is None):
+                self._mask = self._coverage.missing(field)
+            mask = self._mask
+        logging.debug("Layering: %d of %d cells filled from %s",
+                      np.count_nonzero(mask), mask.size, secondaryFile)
+
+        layered = layerFields(primary, secondary, mask)
+        self._layout.write(outFile, layered)
+        return 1
+
+#----------------------------------------------------------------------------
+def _fillValue(var):
+    """Return the missing value of a netCDF variable
+
+    Parameters
+    ----------
+    var : netCDF4.Variable
+
+    Returns
+    -------
+    float
+    """
+    for attr in ['_FillValue', 'missing_value']:
+        if (attr in var.ncattrs()):
+            return float(var.getncattr(attr))
+    return FILL_VALUE
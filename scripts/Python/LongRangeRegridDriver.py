@@ -1,6 +1,11 @@
 """LongRangeRegridDriver
 Checks data directory for new content, and if 
-found initiates regrid/rescaling python script.
+found initiates regrid/rescaling in process, through
+Long_Range_Forcing.process_file(), either serially or
+on a pool of long_range_num_workers worker processes
+started once per run.  Ensemble members are independent,
+so each member goes to one worker, which processes its
+files in forecast hour order.
 Keeps state in a state file that is read/written
 each time this script is invoked.  The state
 file contains the most recent data files.
@@ -13,10 +18,20 @@ import sys
 import logging
 import datetime
 import time
+import multiprocessing
 import DataFiles as df
+import Catalog
+import WRF_Hydro_forcing as whf
 import Long_Range_Forcing as lrf
+import NclExecutor
 from ConfigParser import SafeConfigParser
 
+# Worker processes, if not in the parm file
+DEFAULT_NUM_WORKERS = 1
+
+# parser of a pool worker process, set once by _initWorker()
+_workerParser = None
+
 #----------------------------------------------------------------------------
 def parmRead(fname):
    """Read in the main config file, return needed parameters
@@ -58,31 +73,157 @@ def parmRead(fname):
    maxFcstHourCfs = int(parser.get('fcsthr_max', 'CFS_fcsthr_max'))
    hoursBackCfs = int(parser.get('triggering', 'CFS_hours_back'))
    stateFile = parser.get('triggering', 'long_range_regrid_state_file')
+   if (parser.has_option('triggering', 'long_range_num_workers')):
+      numWorkers = int(parser.get('triggering', 'long_range_num_workers'))
+   else:
+      numWorkers = DEFAULT_NUM_WORKERS
+   if (parser.has_option('triggering', 'dir_cache_file')):
+      df.useDirCache(parser.get('triggering', 'dir_cache_file').strip(),
+                     "CFS")
+   if (parser.has_option('triggering', 'file_catalog_file')):
+      df.useCatalog(parser.get('triggering', 'file_catalog_file').strip())
     
    parms = Parms(cfsDir, cfsNumEnsemble, maxFcstHourCfs, hoursBackCfs,
-                 stateFile)
+                 stateFile, numWorkers)
    return parms
 
 #----------------------------------------------------------------------------
-def regridCFS(cfsFname):
-   """Invoke CFS regridding (see Long_Range_Forcing.py)
+def regridCFS(cfsFname, parser):
+   """Invoke CFS regridding in process (see Long_Range_Forcing.py)
 
    Parameters
    ----------
-   fname: str
+   cfsFname: str
       name of file to regrid and downscale, with yyyymmdd parent dir
+   parser: SafeConfigParser
+      parser for the config/param file
 
    Returns
    -------
-   None
+   int
+      0 if successful, non-zero otherwise
 
    """
    logging.info("REGRIDDING CFS DATA, file=%s", cfsFname)
-   cmd = "python Long_Range_Forcing.py -i "
-   cmd += cfsFname
-   logging.info("command: %s", cmd)
-   ret = os.system(cmd)
+   try:
+      ret = lrf.process_file(cfsFname, parser)
+   except SystemExit as e:
+      # some of the lower level steps still exit on errors
+      logging.error("Long range processing of %s exited", cfsFname)
+      ret = e.code if isinstance(e.code, int) and e.code else 1
+   except Exception:
+      # anything else would escape pool.map or the serial loop and end
+      # main() before the state is written
+      logging.exception("Long range processing of %s raised", cfsFname)
+      ret = 1
    logging.info("DONE REGRIDDING CFS DATA, file=%s, return status=%d", cfsFname, ret)
+   return ret
+
+#----------------------------------------------------------------------------
+def startPool(configFile, numWorkers):
+   """Start worker processes that each read the param file once
+
+   Parameters
+   ----------
+   configFile: str
+      Name of param file
+   numWorkers: int
+      Number of processes
+
+   Returns
+   -------
+   multiprocessing.Pool
+   """
+   return multiprocessing.Pool(numWorkers, _initWorker,
+                               (configFile, numWorkers))
+
+#----------------------------------------------------------------------------
+def byMember(files):
+   """Group CFS files by ensemble member, each in forecast hour order
+
+   Parameters
+   ----------
+   files: list[str]
+      names of files with yyyymmdd parent dir
+
+   Returns
+   -------
+   list[list[str]]
+      files of each member, members in increasing order
+   """
+   members = {}
+   for f in files:
+      try:
+         (ymd, hh, fcstHour, em) = whf.extract_file_info_cfs(f)
+      except SystemExit:
+         logging.error("Unexpected CFS file name %s", f)
+         ymd, hh, fcstHour, em = "", 0, 0, -1
+      members.setdefault(em, []).append(((ymd, hh, fcstHour), f))
+   return [[f for key, f in sorted(members[em])]
+           for em in sorted(members.keys())]
+
+#----------------------------------------------------------------------------
+def regridMember(files, parser):
+   """Regrid the files of one ensemble member, in order
+
+   Parameters
+   ----------
+   files: list[str]
+      names of files, in forecast hour order
+   parser: SafeConfigParser
+      parser for the config/param file
+
+   Returns
+   -------
+   list[int]
+      status of each file
+   """
+   return [regridCFS(f, parser) for f in files]
+
+#----------------------------------------------------------------------------
+def regridCFSFiles(files, parser, pool=None):
+   """Regrid CFS files, in this process or on a worker pool, one
+   ensemble member per worker
+
+   Parameters
+   ----------
+   files: list[str]
+      names of files to regrid and downscale, with yyyymmdd parent dir
+   parser: SafeConfigParser
+      parser for the config/param file, used without a pool
+   pool: multiprocessing.Pool
+      Pool from startPool(), or None
+
+   Returns
+   -------
+   list[int]
+      status of each file, in input order
+   """
+   members = byMember(files)
+   if (pool is None):
+      results = [regridMember(m, parser) for m in members]
+   else:
+      results = pool.map(_regridMemberInWorker, members, 1)
+   status = {}
+   for m, r in zip(members, results):
+      status.update(zip(m, r))
+   return [status[f] for f in files]
+
+#----------------------------------------------------------------------------
+def _initWorker(configFile, numWorkers):
+   """Pool worker initializer: read the param file once, and take this
+   worker's share of the NCL memory budget
+   """
+   global _workerParser
+   _workerParser = SafeConfigParser()
+   _workerParser.read(configFile)
+   NclExecutor.executor(_workerParser, numWorkers)
+
+#----------------------------------------------------------------------------
+def _regridMemberInWorker(files):
+   """Pool worker: regrid one member's files with the worker's parser
+   """
+   return regridMember(files, _workerParser)
 
 
 #----------------------------------------------------------------------------
@@ -101,10 +242,12 @@ class Parms:
       Hours back to maintain state, CFS
    _stateFile: str
       Name of file with state information that is read/written
+   _numWorkers: int
+      Number of worker processes
    """
 
    def __init__(self, cfsDir, cfsNumEnsemble, maxFcstHourCfs,
-                hoursBackCfs, stateFile):
+                hoursBackCfs, stateFile, numWorkers=DEFAULT_NUM_WORKERS):
       """Initialization using input args
 
       Parameters
@@ -116,6 +259,7 @@ class Parms:
       self._maxFcstHourCfs = maxFcstHourCfs
       self._hoursBackCfs = hoursBackCfs
       self._stateFile = stateFile
+      self._numWorkers = numWorkers
 
    def debugPrint(self):
       """ Debug logging of content
@@ -124,6 +268,7 @@ class Parms:
       logging.debug("Parms: CFS_num_ensembles = %d", self._cfsNumEnsemble)
       logging.debug("Parms: MaxFcstHourCfs = %d", self._maxFcstHourCfs)
       logging.debug("Parms: StateFile = %s", self._stateFile)
+      logging.debug("Parms: NumWorkers = %d", self._numWorkers)
 
 
 #----------------------------------------------------------------------------
@@ -138,7 +283,7 @@ class State:
    ----------
    _empty: bool
       True if state is not set
-   _cfs
+   _index: DataFiles.FileIndex
       CFS file names with yyyymmdd parent directory
    """
 
@@ -153,12 +298,12 @@ class State:
 
       if (not parmFile):
          self._empty = 1
-         self._cfs = []
+         self._index = df.FileIndex('CFS')
       else:
          self._empty = 0
          cf = SafeConfigParser()
          cf.read(parmFile)
-         self._cfs = [name for name in cf.get("latest", "cfs").split()]
+         self._index = df.FileIndex('CFS', cf.get("latest", "cfs").split())
 
    def isEmpty(self):
       """Check if state is set or not
@@ -187,7 +332,7 @@ class State:
       """
       if (self.isEmpty()):
          return ""
-      return (self._cfs[-1])
+      return self._index.newest()
       
 
    def initialize(self, cfs):
@@ -203,12 +348,12 @@ class State:
          None
       """
       self._empty = 0
-      self._cfs = cfs.getFnames()
+      self._index = df.FileIndex('CFS', cfs.getFnames())
 
    def debugPrint(self):
       """ logging debug of contents
       """
-      for f in self._cfs:
+      for f in self._index.names():
          logging.debug("State:CFS:%s", f)
         
    def update(self, time, hoursBack):
@@ -225,7 +370,7 @@ class State:
        -------
        none
        """
-      self._cfs = df.filterWithinNHours(self._cfs, 'CFS', time, hoursBack)
+      self._index.purgeOlderThan(time._issue - hoursBack)
       
    def addFileIfNew(self, f):
       """ If input file is not in state, add it
@@ -241,26 +386,7 @@ class State:
          True if added, false if already in the state
 
       """
-      ret = 0
-      if (not f in self._cfs):
-         self._cfs.append(f)
-         ret = 1
-      return ret
-   
-   def sortFiles(self):
-      """ Sort the files into ascending order for a type
-
-      Note: sort depends on naming being 'nice'
-
-      Parameters
-      ----------
-
-      Returns
-      -------
-      none
-
-      """
-      self._cfs.sort()
+      return self._index.add(f)
 
 
    def updateWithNew(self, data, hoursBack):
@@ -309,16 +435,17 @@ class State:
       for f in fnames:
          if (self.addFileIfNew(f)):
             ret.append(f)
-
-      self.sortFiles()
       return ret
         
-   def write(self, parmFile):
+   def write(self, parmFile, exclude=()):
       """ Write state to param file
 
       Parameters
       ----------
          parmFile: Name of file to write to 
+         exclude: set
+            File names in the state that are not written, because their
+            processing is not finished
             
       Returns
       -------
@@ -338,7 +465,9 @@ class State:
       config.add_section('latest')
 
       s = ""
-      for f in self._cfs:
+      for f in self._index.names():
+         if (f in exclude):
+            continue
          s += f
          s += "\n"
       config.set('latest', 'cfs', s)
@@ -426,11 +555,27 @@ def main(argv):
     # get all for that and previous issue time
     cfs = df.DataFiles(parms._cfsDir, parms._maxFcstHourCfs, "CFS")
     cfs.setNewestFiles(parms._hoursBackCfs)
+    df.saveDirCache()
 
     # Same with CFS
     toProcess = state.updateWithNew(cfs, parms._hoursBackCfs)
-    for f in toProcess:
-        regridCFS(f)
+    parser = SafeConfigParser()
+    parser.read(configFile)
+    pool = None
+    numMembers = len(byMember(toProcess))
+    if (parms._numWorkers > 1 and numMembers > 1):
+        pool = startPool(configFile, min(parms._numWorkers, numMembers))
+    try:
+        status = regridCFSFiles(toProcess, parser, pool)
+    finally:
+        if (pool is not None):
+            pool.close()
+            pool.join()
+    for ok, f in zip(status, toProcess):
+        if (ok != 0):
+            logging.error("Long range processing failed for %s", f)
+        else:
+            df.setStatus(parms._cfsDir, f, 'CFS', Catalog.REGRIDDED)
 
     # write out state and exit
     #state.debugPrint()
@@ -1,4 +1,5 @@
 import WRF_Hydro_forcing as whf
+import FileOps
 import logging
 import os
 import sys
@@ -26,14 +27,12 @@ takes place.
 # 1.) CFSv2 file 
 
 def forcing(argv):
-    """ Args:
-        1.) file (string): The file name. The full path is 
-            not necessary as full paths will be derived from
-            parameter directory paths and datetime information.
-        Returns:
-        1.) Status (integer): Integer value indicating whether
-            downscaling was successful (0), or failed (1). All
-            errors will be written to the log file. 
+    """ Command line entry point, exits with the status of process_file().
+        Args:
+        1.) argv (list): -i <file_in>, where file_in (string) is
+            the file name. The full path is not necessary as full
+            paths will be derived from parameter directory paths
+            and datetime information.
     """
 
     file_in = ''
@@ -55,33 +54,10 @@ def forcing(argv):
     parser = SafeConfigParser()
     parser.read('/d4/karsten/DFE/wrf_hydro_forcing/parm/wrf_hydro_forcing.parm')
     logging_level = parser.get('log_level', 'forcing_engine_log_level')
-    out_dir = parser.get('layering','long_range_output') 
-    tmp_dir = parser.get('bias_correction','CFS_tmp_dir')
 
-    # Define CFSv2 cycle date and valid time based on file name.
-    (cycleYYYYMMDD,cycleHH,fcsthr,em) = whf.extract_file_info_cfs(file_in)
-    em_str = str(em)
-
-    # Establish datetime objects
+    (dateCycleYYYYMMDDHH,dateFcstYYYYMMDDHH,em_str) = cycle_info(file_in)
     dateCurrent = datetime.datetime.today()
-    dateCycleYYYYMMDDHH = datetime.datetime(year=int(cycleYYYYMMDD[0:4]),
-                          month=int(cycleYYYYMMDD[4:6]),
-                          day=int(cycleYYYYMMDD[6:8]),
-                          hour=cycleHH)
-    dateFcstYYYYMMDDHH = dateCycleYYYYMMDDHH + \
-                         datetime.timedelta(seconds=fcsthr*3600)
-
-    # Determine if this is a 0hr forecast file or not.
-    if dateFcstYYYYMMDDHH == dateCycleYYYYMMDDHH:
-        fFlag = 1 
-    else:
-        fFlag = 0 
-    # Establish final output directories to hold 'LDASIN' files used for
-    # WRF-Hydro long-range forecasting. If the directory does not exist,
-    # create it.
-    out_path = out_dir + "/Member_" + em_str.zfill(2) + "/" + \
-               dateCycleYYYYMMDDHH.strftime("%Y%m%d%H")
-
+    out_path = output_path(parser, dateCycleYYYYMMDDHH, em_str)
     whf.mkdir_p(out_path)
 
     # Establish log file unique to model cycle, time, and current time
@@ -105,6 +81,70 @@ def forcing(argv):
     logging.basicConfig(format='%(asctime)s %(message)s',
                         filename=log_path, level=set_level)
 
+    sys.exit(process_file(file_in, parser))
+
+def cycle_info(file_in):
+    """ Args:
+        1.) file_in (string): The CFSv2 file name.
+        Returns:
+        1.) dateCycleYYYYMMDDHH (datetime): Model cycle.
+        2.) dateFcstYYYYMMDDHH (datetime): Forecast (valid) time.
+        3.) em_str (string): Ensemble member.
+    """
+    (cycleYYYYMMDD,cycleHH,fcsthr,em) = whf.extract_file_info_cfs(file_in)
+    dateCycleYYYYMMDDHH = datetime.datetime(year=int(cycleYYYYMMDD[0:4]),
+                          month=int(cycleYYYYMMDD[4:6]),
+                          day=int(cycleYYYYMMDD[6:8]),
+                          hour=cycleHH)
+    dateFcstYYYYMMDDHH = dateCycleYYYYMMDDHH + \
+                         datetime.timedelta(seconds=fcsthr*3600)
+    return (dateCycleYYYYMMDDHH,dateFcstYYYYMMDDHH,str(em))
+
+def output_path(parser, dateCycleYYYYMMDDHH, em_str):
+    """ Args:
+        1.) parser (SafeConfigParser): parser for the config/param file.
+        2.) dateCycleYYYYMMDDHH (datetime): Model cycle.
+        3.) em_str (string): Ensemble member.
+        Returns:
+        1.) out_path (string): Final output directory holding the
+            'LDASIN' files used for WRF-Hydro long-range forecasting.
+    """
+    out_dir = parser.get('layering','long_range_output') 
+    return out_dir + "/Member_" + em_str.zfill(2) + "/" + \
+           dateCycleYYYYMMDDHH.strftime("%Y%m%d%H")
+
+def process_file(file_in, parser):
+    """ Bias-corrects, regrids and downscales one CFSv2 file into
+        hourly LDASIN files, in the calling process. Does not set up
+        logging and does not exit, so it can be called repeatedly
+        (see LongRangeRegridDriver.py).
+        Args:
+        1.) file_in (string): The file name. The full path is 
+            not necessary as full paths will be derived from
+            parameter directory paths and datetime information.
+        2.) parser (SafeConfigParser): parser for the config/param file.
+        Returns:
+        1.) Status (integer): Integer value indicating whether
+            downscaling was successful (0), or failed (1). All
+            errors will be written to the log file. 
+    """
+    tmp_dir = parser.get('bias_correction','CFS_tmp_dir')
+
+    # Define CFSv2 cycle date and valid time based on file name.
+    (cycleYYYYMMDD,cycleHH,fcsthr,em) = whf.extract_file_info_cfs(file_in)
+    (dateCycleYYYYMMDDHH,dateFcstYYYYMMDDHH,em_str) = cycle_info(file_in)
+
+    # Determine if this is a 0hr forecast file or not.
+    if dateFcstYYYYMMDDHH == dateCycleYYYYMMDDHH:
+        fFlag = 1 
+    else:
+        fFlag = 0 
+    # Establish final output directories to hold 'LDASIN' files used for
+    # WRF-Hydro long-range forecasting. If the directory does not exist,
+    # create it.
+    out_path = output_path(parser, dateCycleYYYYMMDDHH, em_str)
+    whf.mkdir_p(out_path)
+
     in_fcst_range = whf.is_in_fcst_range("CFSv2",fcsthr,parser)
 
     if in_fcst_range:
@@ -118,6 +158,7 @@ def forcing(argv):
         # Second, regrid to the conus IOC domain
         # Loop through each hour in a six-hour CFSv2 forecast time step, compose temporary filename 
         # generated from bias-correction and call the regridding to go to the conus domain.
+        status = 0
         if fFlag == 1:
             begCt = 6 
             endCt = 7
@@ -135,11 +176,13 @@ def forcing(argv):
                          dateCycleYYYYMMDDHH.strftime('%Y%m%d%H') + \
                          " forecast time: " + dateTempYYYYMMDDHH.strftime('%Y%m%d%H'))
             fileRegridded = whf.regrid_data("CFSv2",fileBiasCorrected,parser)
+            if not fileRegridded:
+                logging.error("Failure to regrid " + fileBiasCorrected)
+                status = 1
+                continue
             # Double check to make sure file was created, delete temporary bias-corrected file
             whf.file_exists(fileRegridded)
-            cmd = "rm -rf " + fileBiasCorrected
-            status = os.system(cmd)
-            if status != 0:
+            if not FileOps.remove(fileBiasCorrected):
                 logging.error("Failure to remove " + fileBiasCorrected)
 
   
@@ -156,29 +199,30 @@ def forcing(argv):
                             dateCycleYYYYMMDDHH.strftime('%Y%m%d%H') + "_" + \
                                 dateTempYYYYMMDDHH.strftime('%Y%m%d%H') + \
                                 "_regridded.M" + em_str.zfill(2) + ".nc"
-            LDASIN_path_tmp = tmp_dir + "/" + dateTempYYYYMMDDHH.strftime('%Y%m%d%H') + "00.LDASIN_DOMAIN1.nc"
             LDASIN_path_final = out_path + "/" + dateTempYYYYMMDDHH.strftime('%Y%m%d%H') + "00.LDASIN_DOMAIN1"
-            whf.downscale_data("CFSv2",fileRegridded,parser, out_path=LDASIN_path_tmp, \
-                               verYYYYMMDDHH=dateTempYYYYMMDDHH)
-            # Double check to make sure file was created, delete temporary regridded file
+            # Downscale to a temporary name next to the final file, then
+            # rename it to the final name WRF-Hydro expects (no .nc).
+            LDASIN_path_tmp = FileOps.tempName(LDASIN_path_final, ".nc")
+            if whf.downscale_data("CFSv2",fileRegridded,parser, out_path=LDASIN_path_tmp, \
+                                  verYYYYMMDDHH=dateTempYYYYMMDDHH):
+                logging.error("Failure to downscale " + fileRegridded)
+                status = 1
+                continue
+            # Double check to make sure file was created
             whf.file_exists(LDASIN_path_tmp)
-            # Rename file to conform to WRF-Hydro expectations
-            cmd = "mv " + LDASIN_path_tmp + " " + LDASIN_path_final
-            status = os.system(cmd)
-            if status != 0:
+            if not FileOps.publish(LDASIN_path_tmp, LDASIN_path_final):
                 logging.error("Failure to rename " + LDASIN_path_tmp)
+                status = 1
             whf.file_exists(LDASIN_path_final)
-            cmd = "rm -rf " + fileRegridded
-            status = os.system(cmd)
-            if status != 0:
+            # downscale_data removes the regridded file, in case it did not
+            if not FileOps.remove(fileRegridded):
                 logging.error("Failure to remove " + fileRegridded)
         
-        # Exit gracefully with an exit status of 0
-        sys.exit(0)
+        return status
     else:
-        # Skip processing this file. Exit gracefully with a 0 exit status.
+        # Skip processing this file, with a 0 (success) status.
         logging.info('Requested file is outside max fcst for CFSv2')
-        sys.exit(0)
+        return 0
 
 if __name__ == "__main__":
     forcing(sys.argv[1:])
@@ -5,6 +5,8 @@ import sys
 from ConfigParser import SafeConfigParser
 import optparse
 import re
+import FileNames
+import FileOps
 
 """Medium_Range_Forcing
 Performs regridding,downscaling, bias
@@ -104,58 +106,8 @@ def forcing(action, prod, file, prod2=None, file2=None):
                 regridded_file = whf.regrid_data(product_data_name, file, parser, True)
                 print regridded_file
                 return(1)
-                whf.downscale_data(product_data_name,regridded_file, parser, True, True)                
-                match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',regridded_file)
-                #match2 = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1).*',regridded_file)
-                if match:
-                    ymd_dir = match.group(1)
-                    file_only = match.group(2)
-                    downscaled_dir = downscale_dir + "/" + ymd_dir
-                    downscaled_file = downscaled_dir + "/" + file_only
-                    # Check to make sure downscaled file was created
-                    whf.file_exists(downscaled_file)
-                    whf.rename_final_files(parser,"Medium_Range")
-                    #if match2:
-                    #    newFile = match2.group(2)
-                    #    finalDirYYYYMMDD = final_dir + "/" + ymd_dir
-                    #    if not os.path.exists(finalDirYYYYMMDD):
-                    #        whf.mkdir_p(finalDirYYYYMMDD)
-                    #    finalFile = finalDirYYYYMMDD + "/" + newFile
-                    #    cmd = "mv " + downscaled_file + " " + finalFile
-                    #    status = os.system(cmd)
-                    #    if status != 0:
-                    #        logging.error("ERROR: Failed to move " + downscaled_file + " to " + finalFile)
-                # Remove empty 0hr regridded file if it still exists
-                if os.path.exists(regridded_file):
-                    cmd = 'rm -rf ' + regridded_file
-                    status = os.system(cmd)
-                    if status != 0:
-                        logging.error("ERROR: Failure to remove empty file: " + regridded_file)
-                        return
             else:
-                logging.info("Regridding %s: ", file )
-                regridded_file = whf.regrid_data(product_data_name, file, parser, False)
-                whf.downscale_data(product_data_name,regridded_file, parser,True, False)                
-                match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',regridded_file)
-                match2 = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1).*',regridded_file)
-                if match:
-                    ymd_dir = match.group(1)
-                    file_only = match.group(2)
-                    downscaled_dir = downscale_dir + "/" + ymd_dir
-                    downscaled_file = downscaled_dir + "/" + file_only
-                    # Check to make sure downscaled file was created
-                    whf.file_exists(downscaled_file)
-                    whf.rename_final_files(parser,"Medium_Range")
-                    #if match2:
-                    #    newFile = match2.group(2)
-                    #    finalDirYYYYMMDD = final_dir + "/" + ymd_dir
-                    #    if not os.path.exists(finalDirYYYYMMDD):
-                    #        whf.mkdir_p(finalDirYYYYMMDD)
-                    #    finalFile = finalDirYYYYMMDD + "/" + newFile
-                    #    cmd = "mv " + downscaled_file + " " + finalFile
-                    #    status = os.system(cmd)
-                    #    if status != 0:
-                    #        logging.error("ERROR: Failed to move " + downscaled_file + " to " + finalFile) 
+                return regrid_file(parser, prod, file)
         else:
             # Skip processing this file, exiting...
             logging.info("INFO [Medium_Range_Forcing]- Skip processing, requested file is outside max fcst")
@@ -167,6 +119,48 @@ def forcing(action, prod, file, prod2=None, file2=None):
 
  
         
+def regrid_file(parser, prod, file):
+    """Regrids and downscales one (non 0hr) GFS file, the 'regrid'
+       action.  The downscaled file is written under a temporary
+       name in the Medium Range directory and renamed to its final
+       LDASIN name (without .nc) when complete.  0hr files, which
+       are missing radiation, and files outside the forecast range
+       are skipped.
+
+       Args:
+           parser (SafeConfigParser): parser for the config/param file.
+           prod (string):  The product, GFS.
+           file (string):  The file name, as for forcing().
+       Returns:
+           status (int): 0 if successful or skipped, 1 otherwise.
+    """
+    product_data_name = prod.upper()
+    final_dir = parser.get('layering','medium_range_output')
+    (date,modelrun,fcsthr) = whf.extract_file_info(file)
+    if fcsthr == 0 or not whf.is_in_fcst_range(prod, fcsthr, parser):
+        logging.info("INFO [Medium_Range_Forcing]- Skip processing %s", file)
+        return 0
+
+    logging.info("Regridding %s: ", file )
+    regridded_file = whf.regrid_data(product_data_name, file, parser, False)
+    if not regridded_file:
+        return 1
+    name = FileNames.parseLdasin(regridded_file)
+    if not name or name.baseDir is None:
+        logging.error("FAIL- unexpected regridded file name: %s", regridded_file)
+        FileOps.remove(regridded_file)
+        return 1
+    final_file = final_dir + "/" + name.issueDir + "/" + name.stem
+    # downscale_data removes the regridded file
+    if not FileOps.writeAtomic(final_file,
+                               lambda tmp: not whf.downscale_data(
+                                   product_data_name, regridded_file,
+                                   parser, True, False, out_path=tmp)):
+        logging.error("FAIL- cannot downscale %s", regridded_file)
+        return 1
+    return 0
+
+
 #--------------------------    
     
    
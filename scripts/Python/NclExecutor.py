@@ -0,0 +1,544 @@
+"""NclExecutor
+Runs the external NCL scripts without a shell.  Each command is an
+argument list (the NCL key="value" parameters are single arguments, so
+no nested quoting), at most a fixed number of them run at once per
+process, each has a timeout after which it is killed, and its stdout and
+stderr are captured and logged.  A failed or timed out run is retried a
+fixed number of times before the failure is reported.
+
+Runs are also admitted by memory: the executor keeps an estimate of the
+peak resident memory of each script (stage), learned from the peak RSS
+the kernel reports for every finished run, and starts a run only while
+the estimates of the running ones plus the new one fit the memory
+budget and the memory the kernel reports available.  One run is always
+admitted, so a job larger than the budget still runs, alone.
+
+The code base runs under Python 2, which has no asyncio, so concurrency
+comes from the callers' threads (see Scheduler.py) or processes (see
+LongRangeRegridDriver.py); a job waits here on a semaphore while the
+limit is reached and blocks only its own thread while running.
+"""
+
+import os
+import errno
+import json
+import time
+import logging
+import threading
+import subprocess
+import FileOps
+
+#----------------------------------------------------------------------------
+# Result status
+OK = 'ok'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+NOT_STARTED = 'not_started'
+
+# Defaults, if not in the [exe] section of the parm file
+DEFAULT_MAX_JOBS = 4
+DEFAULT_TIMEOUT_SECONDS = 1800
+DEFAULT_RETRIES = 1
+DEFAULT_MEMORY_BUDGET_MB = 0
+DEFAULT_JOB_MB = 4096
+
+# Weight of the old estimate when a run peaks below it; a run above it
+# replaces it
+COST_DECAY = 0.8
+
+# Seconds between admission checks while memory is short
+ADMIT_RECHECK_SECONDS = 10.0
+
+# Seconds to wait before a retry
+RETRY_DELAY_SECONDS = 5
+
+# Lines of stderr logged when a run fails
+ERROR_LINES = 20
+
+# Executor of this process, see executor()
+_executor = None
+_executorLock = threading.Lock()
+
+#----------------------------------------------------------------------------
+class Result:
+    """Outcome of one command
+
+    Attributes
+    ----------
+    _args : list[str]
+       The command
+    _status : str
+       OK, FAILED, TIMEOUT or NOT_STARTED
+    _returnCode : int
+       Exit code of the last attempt, negative for a signal, None if it
+       did not start
+    _stdout : str
+       Captured standard output of the last attempt
+    _stderr : str
+       Captured standard error of the last attempt
+    _elapsed : float
+       Seconds spent running, over all attempts
+    _attempts : int
+       Number of runs
+    _peakMb : float
+       Peak resident memory of the last attempt, 0 if not known
+    """
+
+    def __init__(self, args):
+        """Initialization using input args
+        """
+        self._args = list(args)
+        self._status = NOT_STARTED
+        self._returnCode = None
+        self._stdout = ""
+        self._stderr = ""
+        self._elapsed = 0.0
+        self._attempts = 0
+        self._peakMb = 0.0
+
+    def ok(self):
+        """Check if the command succeeded
+
+        Returns
+        -------
+        bool
+        """
+        return self._status == OK
+
+    def stage(self):
+        """Return the name the memory cost is kept under: the NCL script
+        (last argument), else the executable
+
+        Returns
+        -------
+        str
+        """
+        return os.path.basename(self._args[-1])
+
+    def describe(self):
+        """Return a one line description, for logging
+
+        Returns
+        -------
+        str
+        """
+        # the executable and, for NCL, the script
+        name = " ".join([os.path.basename(a) for a in
+                         sorted(set([self._args[0], self._args[-1]]),
+                                key=self._args.index)])
+        return "%s: %s, return code %s, %d attempt(s), %.1f sec, %.0f MB" %(
+            name, self._status, self._returnCode, self._attempts,
+            self._elapsed, self._peakMb)
+
+#----------------------------------------------------------------------------
+class Executor:
+    """Bounded, timed, retried and memory admitted runner of external
+    commands
+
+    Attributes
+    ----------
+    _maxJobs : int
+       Most commands run at once
+    _timeout : float
+       Seconds before a run is killed, 0 for no limit
+    _retries : int
+       Extra runs after a failure
+    _budgetMb : float
+       Memory the running commands may use together, 0 for no limit
+    _defaultJobMb : float
+       Estimate for a stage not yet measured
+    _modelFile : str
+       File the estimates are kept in across runs, empty for none
+    _costMb : dict
+       stage -> estimated peak resident memory, MB
+    _admit : threading.Condition
+       Protects the counts below and _costMb, notified when a run ends
+    _running : int
+       Number of commands running
+    _reservedMb : float
+       Sum of the estimates of the running commands
+    _modelVersion : int
+       Incremented, under _admit, on each change of _costMb to be saved
+    _savedVersion : int
+       Version of _costMb last saved to _modelFile
+    _saveLock : threading.Lock
+       Serializes saving _costMb, which is done without holding _admit
+    """
+
+    def __init__(self, maxJobs=DEFAULT_MAX_JOBS,
+                 timeout=DEFAULT_TIMEOUT_SECONDS, retries=DEFAULT_RETRIES,
+                 budgetMb=DEFAULT_MEMORY_BUDGET_MB,
+                 defaultJobMb=DEFAULT_JOB_MB, modelFile=""):
+        """Initialization using input args
+
+        Parameters
+        ----------
+        maxJobs : int
+           Most commands run at once
+        timeout : float
+           Seconds before a run is killed, 0 for no limit
+        retries : int
+           Extra runs after a failure or timeout
+        budgetMb : float
+           Memory the running commands may use together, 0 for no limit
+        defaultJobMb : float
+           Estimate for a stage not yet measured
+        modelFile : str
+           File to read the estimates from and save them to, if any
+        """
+        self._maxJobs = max(1, maxJobs)
+        self._timeout = timeout
+        self._retries = max(0, retries)
+        self._budgetMb = budgetMb
+        self._defaultJobMb = defaultJobMb
+        self._modelFile = modelFile
+        self._costMb = _readModel(modelFile)
+        self._admit = threading.Condition()
+        self._running = 0
+        self._reservedMb = 0.0
+        self._modelVersion = 0
+        self._savedVersion = 0
+        self._saveLock = threading.Lock()
+
+    def run(self, args):
+        """Run a command, retrying on failure
+
+        Parameters
+        ----------
+        args : list[str]
+           Executable and its arguments
+
+        Returns
+        -------
+        Result
+        """
+        result = Result(args)
+        for attempt in range(0, self._retries + 1):
+            if (attempt > 0):
+                logging.warning("Retrying %s", result.describe())
+                time.sleep(RETRY_DELAY_SECONDS)
+            cost = self._acquire(result.stage())
+            try:
+                self._runOnce(result)
+            finally:
+                self._release(result.stage(), cost, result._peakMb)
+            if (result.ok() or result._status == NOT_STARTED):
+                break
+        if (result.ok()):
+            logging.debug("%s", result.describe())
+            if (result._stdout):
+                logging.debug("stdout: %s", result._stdout.strip())
+        else:
+            logging.error("ERROR[NclExecutor]: %s", result.describe())
+            lines = result._stderr.strip().splitlines()
+            if (not lines):
+                # NCL writes its fatal errors to stdout
+                lines = result._stdout.strip().splitlines()
+            for line in lines[-ERROR_LINES:]:
+                logging.error("   %s", line)
+        return result
+
+    def estimateMb(self, stage):
+        """Return the memory estimate of a stage
+
+        Parameters
+        ----------
+        stage : str
+           Script name, see Result.stage()
+
+        Returns
+        -------
+        float
+           MB
+        """
+        with self._admit:
+            return self._costMb.get(stage, self._defaultJobMb)
+
+    def _acquire(self, stage):
+        """Wait until a run of stage may start, and reserve its memory
+
+        Returns
+        -------
+        float
+           The memory reserved, MB
+        """
+        with self._admit:
+            while (1):
+                cost = self._costMb.get(stage, self._defaultJobMb)
+                if (self._running == 0):
+                    break
+                if (self._running < self._maxJobs and self._fits(cost)):
+                    break
+                self._admit.wait(ADMIT_RECHECK_SECONDS)
+            self._running += 1
+            self._reservedMb += cost
+            return cost
+
+    def _fits(self, cost):
+        """Check if a run estimated at cost MB fits now, lock held
+        """
+        if (self._budgetMb > 0 and
+            self._reservedMb + cost > self._budgetMb):
+            return 0
+        available = memAvailableMb()
+        return available is None or cost <= available
+
+    def _release(self, stage, cost, peakMb):
+        """Return the memory reserved by a run and learn from its peak
+        """
+        snapshot = None
+        with self._admit:
+            self._running -= 1
+            self._reservedMb -= cost
+            if (peakMb > 0):
+                old = self._costMb.get(stage)
+                if (old is None or peakMb >= old):
+                    new = peakMb
+                else:
+                    new = COST_DECAY*old + (1.0 - COST_DECAY)*peakMb
+                self._costMb[stage] = new
+                if (old is None or abs(new - old) >= 1.0):
+                    logging.debug("Memory estimate of %s: %.0f MB", stage, new)
+                    self._modelVersion += 1
+                    snapshot = (self._modelVersion, dict(self._costMb))
+            self._admit.notify_all()
+        if (snapshot is not None):
+            # file I/O (fsync, maybe a shared filesystem) without holding
+            # up admissions
+            self._saveModel(snapshot[0], snapshot[1])
+
+    def _saveModel(self, version, model):
+        """Save a copy of the estimates, unless a newer one was saved
+        """
+        with self._saveLock:
+            if (version <= self._savedVersion):
+                return
+            _writeModel(self._modelFile, model)
+            self._savedVersion = version
+
+    def _runOnce(self, result):
+        """Run the command once and record the outcome in result
+        """
+        result._attempts += 1
+        start = time.time()
+        try:
+            proc = subprocess.Popen(result._args, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, close_fds=True)
+        except OSError as e:
+            result._status = NOT_STARTED
+            result._stderr = str(e)
+            return
+        timedOut = []
+        timer = None
+        if (self._timeout > 0):
+            timer = threading.Timer(self._timeout, _kill, (proc, timedOut))
+            timer.daemon = True
+            timer.start()
+        try:
+            result._stdout, result._stderr = _communicate(proc, result)
+        finally:
+            if (timer is not None):
+                timer.cancel()
+        result._elapsed += time.time() - start
+        result._returnCode = proc.returncode
+        if (timedOut):
+            result._status = TIMEOUT
+        elif (proc.returncode == 0):
+            result._status = OK
+        else:
+            result._status = FAILED
+
+#----------------------------------------------------------------------------
+def _communicate(proc, result):
+    """Collect the output of a process and reap it with wait4(), which
+    gives its peak resident memory (ru_maxrss, KB on Linux) in
+    result._peakMb
+
+    Returns
+    -------
+    tuple
+       (stdout, stderr)
+    """
+    output = {}
+    readers = []
+    for name, pipe in (('stdout', proc.stdout), ('stderr', proc.stderr)):
+        t = threading.Thread(target=_drain, args=(pipe, name, output))
+        t.daemon = True
+        t.start()
+        readers.append(t)
+    for t in readers:
+        t.join()
+    while (1):
+        try:
+            pid, status, usage = os.wait4(proc.pid, 0)
+            break
+        except OSError as e:
+            if (e.errno != errno.EINTR):
+                # already reaped
+                proc.wait()
+                return (output.get('stdout', ""), output.get('stderr', ""))
+    if (os.WIFSIGNALED(status)):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    result._peakMb = usage.ru_maxrss/1024.0
+    return (output.get('stdout', ""), output.get('stderr', ""))
+
+#----------------------------------------------------------------------------
+def _drain(pipe, name, output):
+    """Reader thread: read a pipe to its end
+    """
+    try:
+        output[name] = pipe.read()
+    finally:
+        pipe.close()
+
+#----------------------------------------------------------------------------
+def memAvailableMb():
+    """Return the memory the kernel reports available (MemAvailable)
+
+    Returns
+    -------
+    float
+       MB, None if not known
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if (line.startswith('MemAvailable:')):
+                    return int(line.split()[1])/1024.0
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+#----------------------------------------------------------------------------
+def _readModel(path):
+    """Read memory estimates saved by _writeModel()
+
+    Returns
+    -------
+    dict
+       stage -> MB, empty if none
+    """
+    if (not path or not os.path.exists(path)):
+        return {}
+    try:
+        with open(path) as f:
+            model = json.load(f)
+        return dict([(str(k), float(v)) for k, v in model.items()])
+    except (IOError, ValueError, AttributeError) as e:
+        logging.warning("Ignoring memory estimates in %s: %s", path, e)
+        return {}
+
+#----------------------------------------------------------------------------
+def _writeModel(path, model):
+    """Save memory estimates, atomically
+    """
+    if (not path):
+        return
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(model, f, indent=1, sort_keys=True)
+        return 1
+    try:
+        FileOps.writeAtomic(path, write, ".tmp")
+    except (IOError, OSError) as e:
+        logging.warning("Cannot save memory estimates to %s: %s", path, e)
+
+#----------------------------------------------------------------------------
+def _kill(proc, timedOut):
+    """Timer callback: kill a process that ran too long
+    """
+    if (proc.poll() is None):
+        timedOut.append(1)
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+#----------------------------------------------------------------------------
+def executor(parser, share=1):
+    """Return the executor shared by all threads of this process,
+    created from the parm file on first use
+
+    Parameters
+    ----------
+    parser : SafeConfigParser
+       parser for the config/param file
+    share : int
+       Number of processes on the node splitting the memory budget,
+       used on first use only
+
+    Returns
+    -------
+    Executor
+    """
+    global _executor
+    with _executorLock:
+        if (_executor is None):
+            maxJobs = DEFAULT_MAX_JOBS
+            timeout = DEFAULT_TIMEOUT_SECONDS
+            retries = DEFAULT_RETRIES
+            budgetMb = DEFAULT_MEMORY_BUDGET_MB
+            defaultJobMb = DEFAULT_JOB_MB
+            modelFile = ""
+            if (parser.has_option('exe', 'ncl_max_jobs')):
+                maxJobs = int(parser.get('exe', 'ncl_max_jobs'))
+            if (parser.has_option('exe', 'ncl_timeout_seconds')):
+                timeout = float(parser.get('exe', 'ncl_timeout_seconds'))
+            if (parser.has_option('exe', 'ncl_retries')):
+                retries = int(parser.get('exe', 'ncl_retries'))
+            if (parser.has_option('exe', 'ncl_memory_budget_mb')):
+                budgetMb = float(parser.get('exe', 'ncl_memory_budget_mb'))
+            if (parser.has_option('exe', 'ncl_default_job_mb')):
+                defaultJobMb = float(parser.get('exe', 'ncl_default_job_mb'))
+            if (parser.has_option('exe', 'ncl_memory_model_file')):
+                modelFile = parser.get('exe', 'ncl_memory_model_file').strip()
+            _executor = Executor(maxJobs, timeout, retries,
+                                 budgetMb/max(1, share), defaultJobMb,
+                                 modelFile)
+        return _executor
+
+#----------------------------------------------------------------------------
+def nclArgs(ncl_exec, script, params):
+    """Build the argument list of an NCL run
+
+    Parameters
+    ----------
+    ncl_exec : str
+       The ncl executable
+    script : str
+       The NCL script
+    params : list
+       (name, value) of the string variables to set, in order
+
+    Returns
+    -------
+    list[str]
+    """
+    args = [ncl_exec, "-Q"]
+    for name, value in params:
+        args.append('%s="%s"' %(name, value))
+    args.append(script)
+    return args
+
+#----------------------------------------------------------------------------
+def ncl(parser, ncl_exec, script, params):
+    """Run an NCL script with the shared executor
+
+    Parameters
+    ----------
+    parser : SafeConfigParser
+       parser for the config/param file
+    ncl_exec : str
+       The ncl executable
+    script : str
+       The NCL script
+    params : list
+       (name, value) of the string variables to set, in order
+
+    Returns
+    -------
+    Result
+    """
+    return executor(parser).run(nclArgs(ncl_exec, script, params))
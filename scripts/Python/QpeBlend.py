@@ -0,0 +1,221 @@
+"""QpeBlend
+Bias-weighted blending of RAP, HRRR and MRMS precipitation for the
+Analysis and Assimilation forcing configuration (the gap-filling method
+developed by David Kitzmiller at the National Water Center, formerly in
+layer_anal_assim.ncl).
+
+The monthly bias and weight parameter grids are GRIB2 files.  Each one
+is decoded once into a .npy file in a cache directory and memory mapped
+from there, so the hourly cycle does not decode the same six GRIB2
+files for every valid time.
+"""
+
+import os
+import logging
+import tempfile
+import threading
+import numpy as np
+
+#----------------------------------------------------------------------------
+# Products blended, and the prefix of their parameter file names
+PARAMETER_PREFIXES = {'HRRR': 'HRRR',
+                      'MRMS': 'MRMS_radonly',
+                      'RAP': 'RAPD'}
+
+# cache directory -> ParameterGridCache, shared by all callers in a process
+_caches = {}
+_cachesLock = threading.Lock()
+
+#----------------------------------------------------------------------------
+def parameterFiles(parmDir, month):
+    """Return the bias and weight parameter files for a month
+
+    Parameters
+    ----------
+    parmDir : str
+       Directory with the parameter files (qpe_combine_parm_dir)
+    month : int
+       Month of the valid time, 1 to 12
+
+    Returns
+    -------
+    dict
+       (product, 'bias' or 'weight') -> full path of the GRIB2 file
+    """
+    mm = "%02d" %(month)
+    files = {}
+    for product, prefix in PARAMETER_PREFIXES.items():
+        files[(product, 'bias')] = parmDir + "/" + prefix + \
+                                   "_CMC-CPC_bias-corr_m" + mm + "_v8_wrf1km.grb2"
+        files[(product, 'weight')] = parmDir + "/" + prefix + "_wgt_m" + mm + \
+                                     "_v7_wrf1km.grb2"
+    # layer_anal_assim.ncl reads the MRMS bias grid from the weight file
+    # and the weight grid from the bias file; kept so the output is the
+    # same as the NCL script's
+    files[('MRMS', 'bias')], files[('MRMS', 'weight')] = \
+        files[('MRMS', 'weight')], files[('MRMS', 'bias')]
+    return files
+
+#----------------------------------------------------------------------------
+def blend(rap, hrrr, mrms, grids):
+    """Blend RAP, HRRR and MRMS precipitation with bias and weight grids
+
+    Each product contributes precip*weight*bias, missing bias values mean
+    no bias correction (1).  HRRR and MRMS contributions are dropped
+    where they are missing; the result is missing only where RAP is.
+
+    Parameters
+    ----------
+    rap : numpy.ndarray
+       RAP precipitation rate, 2-D, NaN where missing
+    hrrr : numpy.ndarray
+       HRRR precipitation rate, 2-D, NaN where missing
+    mrms : numpy.ndarray
+       MRMS precipitation rate, 2-D, NaN where missing
+    grids : dict
+       (product, 'bias' or 'weight') -> 2-D parameter grid, NaN where missing
+
+    Returns
+    -------
+    numpy.ndarray
+       The blended precipitation rate, NaN where missing
+    """
+    rain = _contribution(rap, grids, 'RAP')
+    for product, precip in [('HRRR', hrrr), ('MRMS', mrms)]:
+        part = _contribution(precip, grids, product)
+        np.add(rain, part, out=rain, where=~np.isnan(part))
+    return rain
+
+#----------------------------------------------------------------------------
+def _contribution(precip, grids, product):
+    """Return precip*weight*bias for one product, bias defaulting to 1
+    """
+    bias = grids[(product, 'bias')]
+    return precip * grids[(product, 'weight')] * \
+        np.where(np.isnan(bias), 1.0, bias)
+
+#----------------------------------------------------------------------------
+def cacheFor(cacheDir):
+    """Return the cache of a directory, created on first use and then
+    shared by all callers in this process, so grids are mapped once
+
+    Parameters
+    ----------
+    cacheDir : str
+       Directory holding the decoded .npy grids
+
+    Returns
+    -------
+    ParameterGridCache
+    """
+    with _cachesLock:
+        cache = _caches.get(cacheDir)
+        if (cache is None):
+            cache = ParameterGridCache(cacheDir)
+            _caches[cacheDir] = cache
+        return cache
+
+#----------------------------------------------------------------------------
+class ParameterGridCache:
+    """Decoded monthly parameter grids, memory mapped from a cache directory
+
+    Attributes
+    ----------
+    _cacheDir : str
+       Directory holding the decoded .npy grids
+    _grids : dict
+       GRIB2 file name -> memory mapped grid, for grids used by this process
+    """
+
+    def __init__(self, cacheDir):
+        """Initialization using input args
+
+        Parameters
+        ----------
+        cacheDir : str
+           Directory holding the decoded .npy grids
+        """
+        self._cacheDir = cacheDir
+        self._grids = {}
+
+    def grids(self, parmDir, month):
+        """Return all bias and weight grids for a month
+
+        Parameters
+        ----------
+        parmDir : str
+           Directory with the GRIB2 parameter files
+        month : int
+           Month of the valid time, 1 to 12
+
+        Returns
+        -------
+        dict
+           (product, 'bias' or 'weight') -> 2-D grid, NaN where missing
+        """
+        ret = {}
+        for key, gribFile in parameterFiles(parmDir, month).items():
+            ret[key] = self.grid(gribFile)
+        return ret
+
+    def grid(self, gribFile):
+        """Return one parameter grid, decoding it only if not yet cached
+
+        The cached copy is redone when the GRIB2 file is newer than it.
+
+        Parameters
+        ----------
+        gribFile : str
+           Full path of the GRIB2 parameter file
+
+        Returns
+        -------
+        numpy.ndarray
+           Read-only memory mapped 2-D grid, NaN where missing
+        """
+        if (gribFile in self._grids):
+            return self._grids[gribFile]
+        npyFile = os.path.join(self._cacheDir,
+                               os.path.basename(gribFile) + ".npy")
+        if (not os.path.exists(npyFile) or
+                os.path.getmtime(npyFile) < os.path.getmtime(gribFile)):
+            self._decode(gribFile, npyFile)
+        grid = np.load(npyFile, mmap_mode='r')
+        self._grids[gribFile] = grid
+        return grid
+
+    def _decode(self, gribFile, npyFile):
+        """Decode the first message of a GRIB2 file into a .npy file
+
+        The grid is written to a temporary file and renamed into place,
+        so concurrent jobs never see a partial file.
+
+        Parameters
+        ----------
+        gribFile : str
+        npyFile : str
+        """
+        # only needed to decode, so hosts without pygrib can import this
+        # module and everything that uses it
+        import pygrib
+
+        logging.info("Decoding parameter grid %s", gribFile)
+        grbs = pygrib.open(gribFile)
+        try:
+            values = grbs.message(1).values
+        finally:
+            grbs.close()
+        grid = np.ma.filled(np.ma.asarray(values, dtype=np.float64), np.nan)
+
+        if (not os.path.isdir(self._cacheDir)):
+            os.makedirs(self._cacheDir)
+        fd, tmpPath = tempfile.mkstemp(prefix=".tmp", suffix=".npy",
+                                       dir=self._cacheDir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, grid)
+            os.rename(tmpPath, npyFile)
+        finally:
+            # left only if the write failed
+            if (os.path.exists(tmpPath)):
+                os.remove(tmpPath)
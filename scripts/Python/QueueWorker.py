@@ -0,0 +1,176 @@
+"""QueueWorker
+Runs jobs from a job queue database on shared storage (see JobQueue.py),
+so that the tasks planned by Backfill.py into job_queue_file are spread
+over every host that runs a QueueWorker.  Each of scheduler_num_workers
+threads claims the most urgent ready job, renews its lease every third
+of job_lease_seconds while it runs, and reports it done or failed.  Jobs
+of a worker that dies go back to the queue when their lease expires.
+
+The job kinds are the task methods of ForcingScheduler.Pipelines.
+
+Usage:  python QueueWorker.py <parm file> [drain]
+   drain: exit once no job is queued or running, else run until killed
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from ConfigParser import SafeConfigParser
+import ForcingScheduler as fs
+import JobQueue
+import WRF_Hydro_forcing as whf
+
+#----------------------------------------------------------------------------
+# Seconds to wait before looking for work again when none is ready
+IDLE_SECONDS = 10
+
+#----------------------------------------------------------------------------
+def queueParms(parser):
+   """Return the job queue parameters from the parm file
+
+   Parameters
+   ----------
+   parser: SafeConfigParser
+
+   Returns
+   -------
+   tuple
+      (database file or empty, lease seconds, maximum attempts)
+   """
+   path = ""
+   leaseSeconds = JobQueue.DEFAULT_LEASE_SECONDS
+   maxAttempts = JobQueue.DEFAULT_MAX_ATTEMPTS
+   if (parser.has_option('triggering', 'job_queue_file')):
+      path = parser.get('triggering', 'job_queue_file').strip()
+   if (parser.has_option('triggering', 'job_lease_seconds')):
+      leaseSeconds = float(parser.get('triggering', 'job_lease_seconds'))
+   if (parser.has_option('triggering', 'job_max_attempts')):
+      maxAttempts = int(parser.get('triggering', 'job_max_attempts'))
+   return (path, leaseSeconds, maxAttempts)
+
+#----------------------------------------------------------------------------
+def runJob(pipelines, kind, args, outcome):
+   """Job thread: run a Pipelines task method, store the outcome
+
+   Parameters
+   ----------
+   pipelines: ForcingScheduler.Pipelines
+   kind: str
+      Method name
+   args: list
+      Its arguments
+   outcome: list
+      Gets [True, result] or [False, reason]
+   """
+   func = getattr(pipelines, kind, None)
+   if (func is None):
+      outcome.extend([0, "unknown job kind " + str(kind)])
+      return
+   try:
+      outcome.extend([1, func(*args)])
+   except SystemExit as e:
+      # some of the processing steps exit on errors
+      logging.error("Job %s exited", kind)
+      outcome.extend([0, "exit %s" %(e.code)])
+   except BaseException as e:
+      # anything else would end this thread with no outcome
+      logging.exception("Job %s raised", kind)
+      outcome.extend([0, "%s %s" %(e.__class__.__name__, e)])
+
+#----------------------------------------------------------------------------
+def work(parser, pipelines, owner, drain):
+   """Worker thread: claim and run jobs
+
+   Parameters
+   ----------
+   parser: SafeConfigParser
+   pipelines: ForcingScheduler.Pipelines
+   owner: str
+      Worker name
+   drain: bool
+      Return once no job is queued or running
+   """
+   path, leaseSeconds, maxAttempts = queueParms(parser)
+   queue = JobQueue.JobQueue(path, leaseSeconds, maxAttempts)
+   while (1):
+      job = queue.claim(owner)
+      if (job is None):
+         if (drain):
+            counts = queue.counts()
+            if (not counts.get(JobQueue.QUEUED, 0) and
+                not counts.get(JobQueue.RUNNING, 0)):
+               queue.close()
+               return
+         time.sleep(IDLE_SECONDS)
+         continue
+      name, kind, args = job
+      logging.info("Job %s started", name)
+      outcome = []
+      t = threading.Thread(target=runJob,
+                           args=(pipelines, kind, args, outcome))
+      t.daemon = True
+      t.start()
+      while (t.is_alive()):
+         t.join(leaseSeconds/3.0)
+         if (t.is_alive() and not queue.heartbeat(name, owner)):
+            logging.warning("Job %s: lease lost, it may run twice", name)
+      if (not outcome):
+         outcome = [0, "job thread ended with no outcome"]
+      if (outcome[0]):
+         if (queue.complete(name, owner, outcome[1])):
+            logging.info("Job %s done", name)
+         else:
+            logging.warning("Job %s done, but its lease was lost: result"
+                            " discarded", name)
+      elif (not queue.fail(name, owner, outcome[1])):
+         logging.warning("Job %s failed (%s), but its lease was lost",
+                         name, outcome[1])
+
+#----------------------------------------------------------------------------
+def main(argv):
+
+   # User must pass the config file into the main driver.
+   configFile = argv[0]
+   if not os.path.exists(configFile):
+      print 'ERROR forcing engine config file not found.'
+      return 1
+   drain = len(argv) > 1 and argv[1] == 'drain'
+   parser = SafeConfigParser()
+   parser.read(configFile)
+   fs.setupLogging(parser, "QueueWorker.log")
+   # the NCL environment for the jobs (see ForcingScheduler.main)
+   whf.initial_setup(parser, "QueueWorker")
+   path, leaseSeconds, maxAttempts = queueParms(parser)
+   if (not path):
+      logging.error("No job_queue_file in %s", configFile)
+      return 1
+   if (parser.has_option('triggering', 'scheduler_num_workers')):
+      numWorkers = int(parser.get('triggering', 'scheduler_num_workers'))
+   else:
+      numWorkers = fs.DEFAULT_NUM_WORKERS
+
+   # task methods read results of other jobs through the queue
+   scheduler = JobQueue.QueueScheduler(JobQueue.JobQueue(path, leaseSeconds,
+                                                         maxAttempts))
+   pipelines = fs.Pipelines(parser, scheduler)
+   threads = []
+   for i in range(0, numWorkers):
+      t = threading.Thread(target=work, name="worker%d" %(i),
+                           args=(parser, pipelines,
+                                 JobQueue.workerId(str(i)), drain))
+      t.daemon = True
+      t.start()
+      threads.append(t)
+   logging.info("Queue worker started on %s with %d workers", path,
+                numWorkers)
+   while ([t for t in threads if t.is_alive()]):
+      for t in threads:
+         t.join(60)
+   return 0
+
+#----------------------------------------------
+
+if __name__ == "__main__":
+   sys.exit(main(sys.argv[1:]))
@@ -6,6 +6,18 @@ each time this script is invoked.  The state
 file contains the most recent data files.
 Logs to a log file that is created in the
 same directory from where this script is executed.  
+
+Run with a third argument 'daemon' to keep running, with the state in
+memory, and react to new files as they land (inotify), rescanning every
+regrid_rescan_seconds where inotify does not work (NFS, autofs).
+
+A file is processed only once it is complete on disk (see
+DataFiles.isComplete), so each lead hour starts as soon as it has fully
+arrived, and never while it is still being written.
+
+With staging_dir set, the new files are copied to local scratch by
+background threads before they are regridded, staging_lookahead files
+ahead of the regridding (see Staging.py).
 """
 
 import os
@@ -15,10 +27,24 @@ import datetime
 import time
 from ConfigParser import SafeConfigParser
 import DataFiles as df
+import Catalog
+import Staging
+import DirectoryWatch as dw
+import WRF_Hydro_forcing as whf
 import Short_Range_Forcing as srf
 import Analysis_Assimilation_Forcing as aaf
 import Medium_Range_Forcing as mrf
 
+# Seconds between full rescans in daemon mode, if not in the parm file
+DEFAULT_RESCAN_SECONDS = 60
+
+# Number of newest yyyymmdd directories watched in daemon mode
+NUM_ACTIVE_DIRS = 2
+
+# Seconds a data file must be unmodified to be processed, if not in the
+# parm file
+DEFAULT_SETTLE_SECONDS = 10
+
 #----------------------------------------------------------------------------
 def parmRead(fname, fileType):
    """Read in the main config file, return needed parameters
@@ -61,16 +87,38 @@ def parmRead(fname, fileType):
    maxFcstHour = int(parser.get('fcsthr_max', fileType + '_fcsthr_max'))
    hoursBack = int(parser.get('triggering', fileType + '_hours_back'))
    stateFile = parser.get('triggering', fileType + '_regrid_state_file')
+   if (parser.has_option('triggering', 'regrid_rescan_seconds')):
+      rescanSeconds = int(parser.get('triggering', 'regrid_rescan_seconds'))
+   else:
+      rescanSeconds = DEFAULT_RESCAN_SECONDS
+   if (parser.has_option('triggering', 'input_settle_seconds')):
+      settleSeconds = int(parser.get('triggering', 'input_settle_seconds'))
+   else:
+      settleSeconds = DEFAULT_SETTLE_SECONDS
+   if (parser.has_option('triggering', 'dir_cache_file')):
+      df.useDirCache(parser.get('triggering', 'dir_cache_file').strip(),
+                     fileType)
+   if (parser.has_option('triggering', 'file_catalog_file')):
+      df.useCatalog(parser.get('triggering', 'file_catalog_file').strip())
+   Staging.stager(parser)
    
-   parms = Parms(dataDir, maxFcstHour, hoursBack, stateFile)
+   parms = Parms(dataDir, maxFcstHour, hoursBack, stateFile, rescanSeconds,
+                 settleSeconds, parser)
    return parms
 
 #----------------------------------------------------------------------------
-def regrid(fname, fileType):
-   """Invoke HRRR regridding/downscaling (see Short_Range_Forcing.py)
-       
+def regrid(parser, fname, fileType):
+   """Regrid, downscale and finish one input file (see
+   Short_Range_Forcing.py, Analysis_Assimilation_Forcing.py and
+   Medium_Range_Forcing.py), and record it as Catalog.REGRIDDED when that
+   worked.  A 0 hour HRRR or RAP forecast is regridded for Short Range and
+   for Analysis and Assimilation.  The staged copy of the file, if any, is
+   released in any case (see prefetch())
+
    Parameters
    ----------
+   parser: SafeConfigParser
+      parser for the config/param file
    fname: str
       name of file to regrid and downscale, with yyyymmdd parent dir
    fileType: str
@@ -78,40 +126,77 @@ def regrid(fname, fileType):
 
    Returns
    -------
-   None
+   int
+      0 if successful, 1 otherwise
 
    """
 
    logging.info("REGRIDDING %s DATA, file=%s", fileType, fname)
-   if (fileType == 'HRRR'):
-       srf.forcing('regrid', 'HRRR', fname[9:])
-       # special case, if it is a 0 hour forecast, do double regrid
-       f = df.DataFile(fname[0:8], fname[9:], 'HRRR')
-       if (f._ok):
-          if (f._time._forecastHour == 0):
-             logging.debug("SPECIAL 0 hour case %s", fname[9:0])
-             aaf.forcing('regrid', 'HRRR', fname[9:])
-       else:
-          logging.error("Regrid error checking for 0 hour data")
-   elif (fileType == 'RAP'):
-       srf.forcing('regrid', 'RAP', fname[9:])
-       # special case, if it is a 0 hour forecast, do double regrid
-       f = df.DataFile(fname[0:8], fname[9:], 'RAP')
-       if (f._ok):
-          if (f._time._forecastHour == 0):
-             logging.debug("SPECIAL 0 hour case %s", fname[9:0])
-             aaf.forcing('regrid', 'RAP', fname[9:])
-       else:
-          logging.error("Regrid error checking for 0 hour data")
-   elif (fileType == 'GFS'):
-       mrf.forcing('regrid', 'GFS', fname[9:])
-   elif (fileType == 'MRMS'):
-       aaf.forcing('regrid', 'MRMS', fname[9:])
-   else:
-       logging.error("Unknown file type %s", fileType)
-
+   dataDir = parser.get('data_dir', fileType + '_data')
+   name = fname[9:]
+   try:
+      if (fileType == 'HRRR' or fileType == 'RAP'):
+         status = srf.process_file(parser, fileType, name)
+         # the Analysis and Assimilation regridding even if that failed;
+         # only 0 hour forecasts are regridded there
+         f = df.DataFile(fname[0:8], name, fileType)
+         if (not f._ok):
+            logging.error("Regrid error checking for 0 hour data")
+         elif (f._time._forecastHour == 0):
+            logging.debug("SPECIAL 0 hour case %s", name)
+            status = aaf.regrid_file(parser, fileType, name) or status
+      elif (fileType == 'MRMS'):
+         status = aaf.regrid_file(parser, fileType, name)
+      elif (fileType == 'GFS'):
+         status = mrf.regrid_file(parser, fileType, name)
+      else:
+         logging.error("Unknown file type %s", fileType)
+         status = 1
+   finally:
+      release(dataDir, fname)
+   if (status):
+      logging.error("REGRIDDING %s DATA FAILED, file=%s", fileType, fname)
+      return 1
    logging.info("DONE REGRIDDING %s DATA, file=%s", fileType, fname)
+   df.setStatus(dataDir, fname, fileType, Catalog.REGRIDDED)
+   return 0
     
+#----------------------------------------------------------------------------
+def prefetch(dataDir, fname, fileType):
+   """Stage an input file ahead of its processing, which then calls
+   release() once, however many times it reads the file
+
+   Parameters
+   ----------
+   dataDir: str
+      Topdir for data of the type
+   fname: str
+      name of file, with yyyymmdd parent dir
+   fileType: str
+      HRRR, RAP, ... string
+   """
+   if (fileType == 'GFS'):
+      # 0 hour GFS files are not read
+      f = df.DataFile(fname[0:8], fname[9:], fileType)
+      if (f._ok and f._time._forecastHour == 0):
+         return
+   # same name as the regridding builds
+   Staging.prefetch(dataDir + "/" + fname)
+
+#----------------------------------------------------------------------------
+def release(dataDir, fname):
+   """Record that the processing of an input file is done with its
+   staged copy, see prefetch()
+
+   Parameters
+   ----------
+   dataDir: str
+      Topdir for data of the type
+   fname: str
+      name of file, with yyyymmdd parent dir
+   """
+   Staging.release(dataDir + "/" + fname)
+
 #----------------------------------------------------------------------------
 class Parms:
    """Parameters from the main wrf_hydro param file that are needed 
@@ -126,9 +211,17 @@ class Parms:
       Hours back to maintain state
    _stateFile: str
       Name of file with state information that is read/written
+   _rescanSeconds: int
+      Seconds between full rescans of the data in daemon mode
+   _settleSeconds: int
+      Seconds a data file must be unmodified to be processed
+   _parser: SafeConfigParser
+      parser for the config/param file, used by the processing
    """
 
-   def __init__(self, dataDir, maxFcstHour, hoursBack, stateFile):
+   def __init__(self, dataDir, maxFcstHour, hoursBack, stateFile,
+                rescanSeconds=DEFAULT_RESCAN_SECONDS,
+                settleSeconds=DEFAULT_SETTLE_SECONDS, parser=None):
       """Initialization using input args
 
       Parameters
@@ -139,6 +232,9 @@ class Parms:
       self._maxFcstHour = maxFcstHour
       self._hoursBack = hoursBack
       self._stateFile = stateFile
+      self._rescanSeconds = rescanSeconds
+      self._settleSeconds = settleSeconds
+      self._parser = parser
 
    def debugPrint(self):
       """ Debug logging of content
@@ -160,7 +256,7 @@ class State:
    ----------
    _empty: bool
       True if state is not set
-   _data
+   _index: DataFiles.FileIndex
       data file names with yyyymmdd parent directory
    """
 
@@ -177,12 +273,13 @@ class State:
 
       if (not parmFile):
          self._empty = 1
-         self._data = []
+         self._index = df.FileIndex(fileType)
       else:
          self._empty = 0
          cf = SafeConfigParser()
          cf.read(parmFile)
-         self._data = [name for name in cf.get("latest", fileType).split()]
+         self._index = df.FileIndex(fileType,
+                                    cf.get("latest", fileType).split())
 
    def isEmpty(self):
       """Check if state is set or not
@@ -197,7 +294,7 @@ class State:
       """
       if (self._empty == 1):
          return 1
-      return (not self._data)
+      return (not self._index)
 
    def newest(self):
       """return newest file
@@ -210,7 +307,7 @@ class State:
       """
       if (self.isEmpty()):
          return ""
-      return (self._data[-1])
+      return self._index.newest()
       
 
    def initialize(self, data, fileType):
@@ -228,12 +325,12 @@ class State:
          None
       """
       self._empty = 0
-      self._data = data.getFnames()
+      self._index = df.FileIndex(fileType, data.getFnames())
 
    def debugPrint(self):
       """ logging debug of contents
       """
-      for f in self._data:
+      for f in self._index.names():
          logging.debug("State:%s", f)
         
    def update(self, time, hoursBack, fileType):
@@ -252,7 +349,7 @@ class State:
        -------
        none
        """
-      self._data = df.filterWithinNHours(self._data, fileType, time, hoursBack)
+      self._index.purgeOlderThan(time._issue - hoursBack)
       
 
    def addFileIfNew(self, f):
@@ -269,23 +366,7 @@ class State:
          True if added, false if already in the state
 
       """
-      ret = 0
-      if (not f in self._data):
-          self._data.append(f)
-          ret = 1
-      return ret
-   
-   def sortFiles(self):
-      """ Sort the files into ascending order for a type
-
-      Note: sort depends on naming being 'nice'
-
-      Returns
-      -------
-      none
-
-      """
-      self._data.sort()
+      return self._index.add(f)
 
    def updateWithNew(self, data, hoursBack, fileType):
       """ Update internal state with new data
@@ -333,11 +414,9 @@ class State:
       for f in fnames:
          if (self.addFileIfNew(f)):
             ret.append(f)
-
-      self.sortFiles()
       return ret
         
-   def write(self, parmFile, fileType):
+   def write(self, parmFile, fileType, exclude=()):
       """ Write state to param file
 
       Parameters
@@ -345,6 +424,9 @@ class State:
       parmFile: Name of file to write to 
       fileType: str
           'HRRR', etc
+      exclude: set
+          File names in the state that are not written, because their
+          processing is not finished
             
       Returns
       -------
@@ -364,7 +446,9 @@ class State:
       config.add_section('latest')
 
       s = ""
-      for f in self._data:
+      for f in self._index.names():
+         if (f in exclude):
+            continue
          s += f
          s += "\n"
       config.set('latest', fileType, s)
@@ -433,6 +517,8 @@ def main(argv):
     # read in fixed main params
     parms = parmRead(configFile, fileType)
     parms.debugPrint()
+    # NCARG_ROOT and NCL_DEF_LIB_DIR for the NCL runs of regrid()
+    whf.initial_setup(parms._parser, "RegridDriver" + fileType)
 
     #if there is not a state file, create one now using newest
     if (not os.path.exists(parms._stateFile)):
@@ -448,23 +534,126 @@ def main(argv):
         # error return here
         return 0
     #state.debugPrint()
-    
-    # query each directory and get newest model run file for each, then
-    # get all for that and previous issue time
-    data = df.DataFiles(parms._dataDir, parms._maxFcstHour, fileType)
-    data.setNewestFiles(parms._hoursBack)
 
-    # Update the state to reflect changes, returning those files to regrid
-    # Regrid 'em
-    toProcess = state.updateWithNew(data, parms._hoursBack, fileType)
-    for f in toProcess:
-        regrid(f, fileType)
+    if (len(argv) > 2 and argv[2] == 'daemon'):
+        daemon(parms, state, fileType)
+        return 0
+
+    regridNew(parms, state, fileType)
+    df.saveDirCache()
 
     # write out state and exit
     #state.debugPrint()
     state.write(parms._stateFile, fileType)
     return 0
 
+#----------------------------------------------------------------------------
+def regridNew(parms, state, fileType, incomplete=None):
+   """Regrid data files that are not yet in the state, and add them to it.
+   Files still being written are left for a later call.
+
+   Parameters
+   ----------
+   parms: Parms
+      Parameter settings
+   state: State
+      State, updated in place
+   fileType: str
+      'HRRR', ...
+   incomplete: list
+      If given, gets the number of files left because still being written
+
+   Returns
+   -------
+   list[str]
+      The data file names processed, successfully or not
+   """
+   # query each directory and get newest model run file for each, then
+   # get all for that and previous issue time
+   data = df.DataFiles(parms._dataDir, parms._maxFcstHour, fileType)
+   data.setNewestFiles(parms._hoursBack)
+   n = data.dropIncomplete(parms._settleSeconds)
+   if (incomplete is not None):
+      incomplete.append(n)
+
+   # Update the state to reflect changes, returning those files to regrid
+   # Regrid 'em
+   toProcess = state.updateWithNew(data, parms._hoursBack, fileType)
+   # the copies run staging_lookahead files ahead of the regridding
+   for f in toProcess:
+      prefetch(parms._dataDir, f, fileType)
+   for f in toProcess:
+      regrid(parms._parser, f, fileType)
+   return toProcess
+
+#----------------------------------------------------------------------------
+def watchActiveDirs(watch, dataDir):
+   """Watch the data directory and its newest yyyymmdd subdirectories
+
+   Parameters
+   ----------
+   watch: DirectoryWatch
+      The watches, updated in place
+   dataDir: str
+      Topdir for data
+   """
+   ymdDirs = sorted(df.getYyyymmddSubdirectories(dataDir))
+   active = [os.path.join(dataDir, d) for d in ymdDirs[-NUM_ACTIVE_DIRS:]]
+   for path in watch.watched():
+      if (os.path.dirname(path) == dataDir and path not in active):
+         watch.unwatch(path)
+   watch.watch(dataDir)
+   for path in active:
+      watch.watch(path)
+
+#----------------------------------------------------------------------------
+def daemon(parms, state, fileType):
+   """Regrid new data as it arrives, forever, keeping state in memory
+
+   Changes in the newest yyyymmdd directories are seen through inotify
+   and processed right away, with a full rescan every _rescanSeconds in
+   case an event was missed.  On network filesystems, or if inotify is
+   not available, only the rescans are done.  The state file is written
+   whenever the state changes, so a restart (or cron mode) resumes.
+
+   Parameters
+   ----------
+   parms: Parms
+      Parameter settings
+   state: State
+      State read at startup
+   fileType: str
+      'HRRR', ...
+   """
+   watch = dw.DirectoryWatch()
+   useInotify = watch.available()
+   if (useInotify and dw.isNetworkFilesystem(parms._dataDir)):
+      logging.info("%s is on a network filesystem, rescanning every %d "
+                   "seconds", parms._dataDir, parms._rescanSeconds)
+      watch.close()
+      useInotify = 0
+   logging.info("Daemon started for %s data in %s", fileType, parms._dataDir)
+
+   while (1):
+      if (useInotify):
+         watchActiveDirs(watch, parms._dataDir)
+      incomplete = []
+      if (regridNew(parms, state, fileType, incomplete)):
+         state.write(parms._stateFile, fileType)
+      df.saveDirCache()
+      wait = parms._rescanSeconds
+      if (incomplete[0] > 0):
+         # look again once they may have settled
+         wait = min(wait, max(1, parms._settleSeconds))
+      if (not useInotify):
+         time.sleep(wait)
+         continue
+      events = watch.wait(wait)
+      while (events):
+         # drain anything already pending so one rescan covers a burst
+         logging.debug("%d change(s) in %s", len(events), parms._dataDir)
+         events = watch.wait(0)
+
 #----------------------------------------------
 
 if __name__ == "__main__":
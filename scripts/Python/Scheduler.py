@@ -0,0 +1,672 @@
+"""Scheduler
+In-memory task graph run on a shared pool of worker threads.  A task
+runs as soon as every task it depends on has finished, so a chain like
+regrid -> downscale -> finish -> layer moves on the moment each step
+completes, with no polling of directories or state files in between.
+The workers are threads: the heavy lifting is done by NCL subprocesses
+and NumPy, which do not hold the interpreter lock.
+
+Ready tasks run in priority order: forcing configuration class first
+(Analysis and Assimilation, Short, Medium, then Long Range), then lead
+hour.  While latency-critical (Analysis or Short Range) work is ready or
+running, batch (Long Range) tasks are throttled to a few workers, so a
+CFS backfill cannot hold up the hourly products.  A task may have a soft
+deadline: if some of its dependencies are optional and not done by
+then, it stops waiting for them and runs a fallback instead.
+
+A task may also have a stage function that prefetches its inputs (see
+Staging.py).  It is called for the stageAhead ready tasks next to run;
+when more urgent tasks become ready, the least urgent staged ones are
+unstaged again.  The copies are so made just ahead of the tasks that
+read them, whatever order the tasks were added in.
+"""
+
+import time
+import heapq
+import logging
+import threading
+
+#----------------------------------------------------------------------------
+# Task states
+WAITING = 'waiting'
+READY = 'ready'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Priority classes, most urgent first
+ANALYSIS = 0
+SHORT_RANGE = 1
+MEDIUM_RANGE = 2
+LONG_RANGE = 3
+
+# Classes that are latency critical, and classes that are batch work
+LATENCY_CRITICAL = [ANALYSIS, SHORT_RANGE]
+BATCH = [LONG_RANGE]
+
+# Longest a worker sleeps before checking deadlines again
+MAX_IDLE_SECONDS = 60.0
+
+#----------------------------------------------------------------------------
+class TaskError(Exception):
+   """Raised by a task function to mark the task failed
+   """
+   pass
+
+#----------------------------------------------------------------------------
+class Task:
+   """One unit of work in the graph
+
+   Attributes
+   ----------
+   _name: str
+      Unique name
+   _func: callable
+      Function run by a worker, func(*args).  Its return value is the
+      task result, raising an exception fails the task
+   _args: tuple
+      Arguments to _func
+   _deps: list[str]
+      Names of the tasks that must be done first
+   _optional: list[str]
+      Dependencies given up on at the deadline, or if they fail
+   _fallback: tuple
+      (func, args) run instead of _func once optional ones are given up
+   _priority: int
+      ANALYSIS, SHORT_RANGE, MEDIUM_RANGE or LONG_RANGE
+   _lead: int
+      Lead (forecast) hour, lower runs first within a class
+   _deadline: float
+      Epoch seconds of the soft deadline, None if there is none
+   _stage: tuple
+      (func, args) called ahead of _func to prefetch its inputs, None if
+      there is none
+   _unstage: tuple
+      (func, args) undoing _stage, None if there is none
+   _seq: int
+      Order in which it became ready, within equal priority and lead
+   _staged: bool
+      True while staged
+   _staging: bool
+      True while its stage or unstage function is being called
+   _waitingOn: set
+      Names of dependencies not yet done
+   _state: str
+      WAITING, READY, RUNNING, DONE or FAILED
+   _result
+      Return value of _func once DONE
+   """
+
+   def __init__(self, name, func, args, deps, optional, fallback, priority,
+                lead, deadline, stage=None, unstage=None):
+      """Initialization using input args
+      """
+      self._name = name
+      self._func = func
+      self._args = args
+      self._deps = list(deps)
+      self._optional = list(optional)
+      self._fallback = fallback
+      self._priority = priority
+      self._lead = lead
+      self._deadline = deadline
+      self._stage = stage
+      self._unstage = unstage
+      self._seq = 0
+      self._staged = 0
+      self._staging = 0
+      self._waitingOn = set()
+      self._state = WAITING
+      self._result = None
+
+   def finished(self):
+      """Check if the task has run, successfully or not
+
+      Returns
+      -------
+      bool
+      """
+      return self._state == DONE or self._state == FAILED
+
+   def isBatch(self):
+      """Check if the task is batch work
+
+      Returns
+      -------
+      bool
+      """
+      return self._priority in BATCH
+
+   def order(self):
+      """Return the key tasks run in, lowest first, once ready
+
+      Returns
+      -------
+      tuple
+         (priority, lead, sequence)
+      """
+      return (self._priority, self._lead, self._seq)
+
+   def useFallback(self):
+      """Give up on the optional dependencies and switch to the fallback
+
+      Returns
+      -------
+      bool
+         True if switched, False if there is no fallback or already done
+      """
+      if (self._fallback is None):
+         return 0
+      self._func, self._args = self._fallback
+      self._fallback = None
+      self._stage = None
+      self._unstage = None
+      self._deadline = None
+      for d in self._optional:
+         self._waitingOn.discard(d)
+      self._optional = []
+      return 1
+
+#----------------------------------------------------------------------------
+class Scheduler:
+   """Task graph and prioritised worker pool
+
+   Tasks can be added at any time, also while others are running, and
+   may depend on tasks that have not been added yet.
+
+   Attributes
+   ----------
+   _tasks: dict
+      name -> Task
+   _dependents: dict
+      name -> list[str], tasks waiting on that name
+   _ready: list
+      heap of (priority, lead, sequence, Task), tasks ready to run
+   _seq: int
+      Insertion counter, keeps the heap order stable
+   _deadlines: dict
+      name -> deadline of waiting tasks with a fallback
+   _unstaged: list
+      heap of (priority, lead, sequence, Task), ready tasks with a stage
+      function that are not staged; entries of tasks that started or
+      were staged since are skipped
+   _staged: list[Task]
+      Ready tasks staged, stageAhead at most
+   _stageAhead: int
+      Number of ready tasks, next to run, that are staged
+   _lock: threading.Condition
+      Protects everything above, notified on any change
+   _active: int
+      Number of tasks ready or running
+   _urgent: int
+      Number of latency-critical tasks ready or running
+   _batchRunning: int
+      Number of batch tasks running
+   _busyBatchWorkers: int
+      Most batch tasks run at once while there is urgent work
+   _workers: list[threading.Thread]
+   _stopping: bool
+      Set by shutdown(), the workers exit instead of taking more tasks
+   """
+
+   def __init__(self, numWorkers, busyBatchWorkers=1, stageAhead=0):
+      """Start the worker threads
+
+      Parameters
+      ----------
+      numWorkers: int
+         Number of tasks run at once
+      busyBatchWorkers: int
+         Number of batch tasks run at once while latency-critical tasks
+         are ready or running
+      stageAhead: int
+         Number of ready tasks, next to run, that are staged; 0 to never
+         call the stage functions
+      """
+      self._tasks = {}
+      self._dependents = {}
+      self._ready = []
+      self._seq = 0
+      self._deadlines = {}
+      self._unstaged = []
+      self._staged = []
+      self._stageAhead = stageAhead
+      self._lock = threading.Condition()
+      self._active = 0
+      self._urgent = 0
+      self._batchRunning = 0
+      self._busyBatchWorkers = busyBatchWorkers
+      self._workers = []
+      self._stopping = 0
+      for i in range(0, max(1, numWorkers)):
+         t = threading.Thread(target=self._work, name="worker%d" %(i))
+         t.daemon = True
+         t.start()
+         self._workers.append(t)
+
+   def add(self, name, func, args=(), deps=(), priority=SHORT_RANGE, lead=0,
+           optional=(), fallback=None, deadline=None, stage=None,
+           unstage=None):
+      """Add a task, unless one with the same name exists
+
+      Parameters
+      ----------
+      name: str
+         Unique task name
+      func: callable
+         Function to run, func(*args)
+      args: tuple
+         Arguments to func
+      deps: list[str]
+         Names of tasks that must be done first
+      priority: int
+         ANALYSIS, SHORT_RANGE, MEDIUM_RANGE or LONG_RANGE
+      lead: int
+         Lead hour, lower runs first within a priority class
+      optional: list[str]
+         Those deps that may be given up on
+      fallback: tuple
+         (func, args) to run instead when optional deps are given up on,
+         at the deadline or when one of them fails
+      deadline: float
+         Soft deadline, epoch seconds
+      stage: tuple
+         (func, args) to prefetch the inputs of func, called shortly
+         before it runs; not called for the fallback
+      unstage: tuple
+         (func, args) undoing stage, called if more urgent tasks push
+         this one out of the stageAhead next to run
+
+      Returns
+      -------
+      bool
+         True if added
+      """
+      with self._lock:
+         if (name in self._tasks):
+            return 0
+         task = Task(name, func, args, deps, optional, fallback, priority,
+                     lead, deadline, stage, unstage)
+         self._tasks[name] = task
+         optional = set(task._optional)
+         for d in task._deps:
+            dep = self._tasks.get(d)
+            if (d in optional and d not in task._optional):
+               # already gave up on the optional ones
+               continue
+            if (dep is not None and dep._state == DONE):
+               continue
+            if (dep is not None and dep._state == FAILED):
+               if (d in optional and task.useFallback()):
+                  continue
+               self._fail(task, "dependency %s failed" %(d))
+               return 1
+            task._waitingOn.add(d)
+            self._dependents.setdefault(d, []).append(name)
+         if (not task._waitingOn):
+            self._enqueue(task)
+         elif (task._fallback is not None and deadline is not None):
+            self._deadlines[name] = deadline
+            self._lock.notify_all()
+         staging = self._toStage()
+      self._stage(staging)
+      return 1
+
+   def addDone(self, name, result=None):
+      """Add a task that is already done, for instance in an earlier run,
+      unless one with the same name exists
+
+      Parameters
+      ----------
+      name: str
+         Unique task name
+      result:
+         Its result, see result()
+
+      Returns
+      -------
+      bool
+         True if added
+      """
+      with self._lock:
+         if (name in self._tasks):
+            return 0
+         task = Task(name, None, (), (), (), None, SHORT_RANGE, 0, None)
+         self._tasks[name] = task
+         self._done(task, result)
+         return 1
+
+   def failMissing(self, why):
+      """Fail the dependencies that no task was added for, so the tasks
+      waiting on them fail or fall back instead of waiting forever
+
+      Parameters
+      ----------
+      why: str
+         Reason logged
+
+      Returns
+      -------
+      int
+         Number of dependencies failed
+      """
+      with self._lock:
+         missing = [d for d in self._dependents.keys() if d not in self._tasks]
+         for d in missing:
+            task = Task(d, None, (), (), (), None, SHORT_RANGE, 0, None)
+            self._tasks[d] = task
+            self._fail(task, why)
+         self._lock.notify_all()
+         return len(missing)
+
+   def counts(self):
+      """Return the number of tasks in each state
+
+      Returns
+      -------
+      dict
+         state -> number of tasks
+      """
+      with self._lock:
+         ret = {}
+         for task in self._tasks.values():
+            ret[task._state] = ret.get(task._state, 0) + 1
+         return ret
+
+   def state(self, name):
+      """Return the state of a task
+
+      Parameters
+      ----------
+      name: str
+
+      Returns
+      -------
+      str
+         WAITING, READY, RUNNING, DONE or FAILED, None if not known
+      """
+      with self._lock:
+         task = self._tasks.get(name)
+         if (task is None):
+            return None
+         return task._state
+
+   def result(self, name):
+      """Return the result of a task that is done
+
+      Parameters
+      ----------
+      name: str
+
+      Returns
+      -------
+         The return value of the task function, None if not done
+      """
+      with self._lock:
+         task = self._tasks.get(name)
+         if (task is None or task._state != DONE):
+            return None
+         return task._result
+
+   def wait(self, timeout=None):
+      """Wait until no task is ready or running
+
+      Tasks still waiting on dependencies that have not been added do
+      not count.
+
+      Parameters
+      ----------
+      timeout: float
+         Maximum seconds to wait, None for no limit
+
+      Returns
+      -------
+      bool
+         True if idle
+      """
+      with self._lock:
+         if (self._active > 0):
+            self._lock.wait(timeout)
+         return self._active == 0
+
+   def shutdown(self, timeout=None):
+      """Stop the workers once their running tasks are done; tasks not
+      started stay as they are
+
+      Parameters
+      ----------
+      timeout: float
+         Maximum seconds to wait for each worker, None for no limit
+      """
+      with self._lock:
+         self._stopping = 1
+         self._lock.notify_all()
+      for t in self._workers:
+         t.join(timeout)
+
+   def purge(self, keep):
+      """Forget finished or waiting tasks, to bound memory in a
+      long-running process.  A task added later that depends on a
+      forgotten one waits until that one is added again.
+
+      Parameters
+      ----------
+      keep: callable
+         keep(name) returns True for tasks to keep
+
+      Returns
+      -------
+      int
+         Number of tasks removed
+      """
+      with self._lock:
+         names = [n for n, t in self._tasks.items()
+                  if (t.finished() or t._state == WAITING) and not keep(n)]
+         for n in names:
+            del self._tasks[n]
+            self._deadlines.pop(n, None)
+         for d in self._dependents.keys():
+            waiting = [n for n in self._dependents[d] if n in self._tasks]
+            if (waiting):
+               self._dependents[d] = waiting
+            else:
+               del self._dependents[d]
+         return len(names)
+
+   def _enqueue(self, task):
+      """Mark a task ready and queue it, lock held
+      """
+      task._state = READY
+      self._deadlines.pop(task._name, None)
+      self._active += 1
+      if (task._priority in LATENCY_CRITICAL):
+         self._urgent += 1
+      self._seq += 1
+      task._seq = self._seq
+      heapq.heappush(self._ready, task.order() + (task,))
+      if (task._stage is not None and self._stageAhead > 0):
+         heapq.heappush(self._unstaged, task.order() + (task,))
+      self._lock.notify_all()
+
+   def _toStage(self):
+      """Stage the most urgent unstaged ready tasks while fewer than
+      stageAhead are staged, or while they are more urgent than the
+      least urgent staged task, which is then unstaged; lock held
+
+      Returns
+      -------
+      list
+         (Task, (func, args)) stage and unstage calls that the caller
+         makes, with _stage(), once it released the lock
+      """
+      calls = []
+      while (self._unstaged):
+         task = self._unstaged[0][3]
+         if (task._state != READY or task._staged):
+            # started before its turn came, or staged again
+            heapq.heappop(self._unstaged)
+            continue
+         if (task._staging):
+            # still being unstaged
+            break
+         if (len(self._staged) >= self._stageAhead):
+            last = max(self._staged, key=Task.order)
+            if (last.order() < task.order() or last._staging):
+               break
+            self._staged.remove(last)
+            last._staged = 0
+            last._staging = 1
+            heapq.heappush(self._unstaged, last.order() + (last,))
+            calls.append((last, last._unstage))
+         heapq.heappop(self._unstaged)
+         task._staged = 1
+         task._staging = 1
+         self._staged.append(task)
+         calls.append((task, task._stage))
+      return calls
+
+   def _stage(self, calls):
+      """Make the stage and unstage calls chosen by _toStage(), and the
+      ones that become possible as they are made, lock not held
+      """
+      while (calls):
+         task, call = calls.pop(0)
+         if (call is not None):
+            func, args = call
+            try:
+               func(*args)
+            except Exception:
+               # the task then reads its inputs in place
+               logging.exception("Staging for task %s failed", task._name)
+         with self._lock:
+            task._staging = 0
+            self._lock.notify_all()
+            if (not calls):
+               calls = self._toStage()
+
+   def _fail(self, task, why):
+      """Mark a task and everything that depends on it failed, lock held
+      """
+      logging.error("Task %s failed: %s", task._name, why)
+      task._state = FAILED
+      self._deadlines.pop(task._name, None)
+      for name in self._dependents.pop(task._name, []):
+         dependent = self._tasks.get(name)
+         if (dependent is None or dependent._state != WAITING):
+            continue
+         if (task._name in dependent._optional and dependent.useFallback()):
+            logging.info("Task %s falls back, %s failed", name, task._name)
+            self._deadlines.pop(name, None)
+            if (not dependent._waitingOn):
+               self._enqueue(dependent)
+         else:
+            self._fail(dependent, "dependency %s failed" %(task._name))
+
+   def _done(self, task, result):
+      """Mark a task done and queue dependents now ready, lock held
+      """
+      task._state = DONE
+      task._result = result
+      for name in self._dependents.pop(task._name, []):
+         dependent = self._tasks.get(name)
+         if (dependent is None or dependent._state != WAITING):
+            continue
+         dependent._waitingOn.discard(task._name)
+         if (not dependent._waitingOn):
+            self._enqueue(dependent)
+
+   def _releaseOverdue(self):
+      """Switch waiting tasks past their deadline to their fallback,
+      lock held
+
+      Returns
+      -------
+      float
+         Seconds until the next deadline, MAX_IDLE_SECONDS at most
+      """
+      now = time.time()
+      wait = MAX_IDLE_SECONDS
+      # _enqueue() removes entries too
+      for name, deadline in list(self._deadlines.items()):
+         if (deadline > now):
+            wait = min(wait, deadline - now)
+            continue
+         del self._deadlines[name]
+         task = self._tasks.get(name)
+         if (task is None or task._state != WAITING):
+            continue
+         if (task.useFallback()):
+            logging.info("Task %s passed its deadline, falling back", name)
+            if (not task._waitingOn):
+               self._enqueue(task)
+      return wait
+
+   def _next(self):
+      """Pop the next task to run, or None if nothing may run now,
+      lock held
+      """
+      if (not self._ready):
+         return None
+      task = self._ready[0][3]
+      if (task.isBatch() and self._urgent > 0 and
+          self._batchRunning >= self._busyBatchWorkers):
+         # throttled: only urgent work can be ahead of it, and it waits
+         return None
+      heapq.heappop(self._ready)
+      if (task._staged):
+         self._staged.remove(task)
+         task._staged = 0
+      return task
+
+   def _work(self):
+      """Worker thread: run ready tasks in priority order until shutdown()
+      """
+      while (1):
+         with self._lock:
+            task = None
+            while (task is None):
+               if (self._stopping):
+                  return
+               idle = self._releaseOverdue()
+               task = self._next()
+               if (task is None):
+                  self._lock.wait(idle)
+            task._state = RUNNING
+            if (task.isBatch()):
+               self._batchRunning += 1
+            while (task._staging):
+               # another thread is staging or unstaging it
+               self._lock.wait()
+            staging = self._toStage()
+         self._stage(staging)
+         if (task._deadline is not None and time.time() > task._deadline):
+            logging.warning("Task %s started after its deadline", task._name)
+         logging.debug("Task %s started", task._name)
+         try:
+            result = task._func(*task._args)
+            ok = 1
+         except SystemExit as e:
+            # some of the processing steps exit on errors
+            logging.error("Task %s exited", task._name)
+            result = "exit %s" %(e.code)
+            ok = 0
+         except BaseException as e:
+            # anything else that escapes would kill this worker and leave
+            # the task RUNNING for good
+            logging.exception("Task %s raised", task._name)
+            result = "%s %s" %(e.__class__.__name__, e)
+            ok = 0
+         with self._lock:
+            if (ok):
+               self._done(task, result)
+            else:
+               self._fail(task, str(result))
+            self._active -= 1
+            if (task._priority in LATENCY_CRITICAL):
+               self._urgent -= 1
+            if (task.isBatch()):
+               self._batchRunning -= 1
+            self._lock.notify_all()
+            staging = self._toStage()
+         self._stage(staging)
+         logging.debug("Task %s %s", task._name, task._state)
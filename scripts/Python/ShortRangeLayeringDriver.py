@@ -6,6 +6,9 @@ each time this script is invoked.  The state
 file shows the most recent issue times status as regards inputs and layering.
 Logs to a log file that is created in the
 same directory from where this script is executed.  
+
+With file_catalog_file set, whether an input is finished is looked up in
+the file catalog (see Catalog.py) instead of listing its directory.
 """
 
 import os
@@ -15,6 +18,10 @@ import datetime
 import time
 from ConfigParser import SafeConfigParser
 import Short_Range_Forcing as srf
+import FileOps
+import DirScan
+import DataFiles as df
+import Catalog
 
 #----------------------------------------------------------------------------
 def isYyyymmddhh(name):
@@ -92,8 +99,7 @@ def getFileNames(aDir):
    List[str]
       the data files in the directory
    """
-   return [name for name in os.listdir(aDir)
-           if not os.path.isdir(os.path.join(aDir, name))]
+   return DirScan.listing(aDir)[0]
 
 #----------------------------------------------------------------------------
 def getImmediateSubdirectories(aDir):
@@ -111,12 +117,8 @@ def getImmediateSubdirectories(aDir):
 
    """
 
-   # does the dir exist?
-   if (not os.path.exists(aDir)):
-       return []
-
-   return [name for name in os.listdir(aDir)
-           if os.path.isdir(os.path.join(aDir, name))]
+   # (empty if the dir does not exist)
+   return DirScan.listing(aDir)[1]
 
 #---------------------------------------------------------------------------
 def getYyyymmddhhSubdirectories(dir):
@@ -205,6 +207,8 @@ def parmRead(fname):
     veryLateMinutes=int(parser.get('triggering',
                                    'short_range_fcst_very_late_minutes'))
     stateFile = parser.get('triggering', 'short_range_layering_state_file')
+    if (parser.has_option('triggering', 'file_catalog_file')):
+        df.useCatalog(parser.get('triggering', 'file_catalog_file').strip())
 
     parms = Parms(hrrrDir, rapDir, layerDir, maxFcstHour, hoursBack,
                   maxWaitMinutes, veryLateMinutes, stateFile)
@@ -472,6 +476,11 @@ class ForecastStatus:
            True if the forecast does exist on disk
         """
            
+        if (df.hasCatalog()):
+            # recorded when moved to the finished area, see
+            # WRF_Hydro_forcing.move_to_finished_area
+            status = df.outputStatus(dir + "/" + self.layerPath())
+            return int(status == Catalog.FINISHED)
         path = dir + "/"
         path += self._issue.strftime("%Y%m%d%H")
         if (os.path.isdir(path)):
@@ -485,6 +494,21 @@ class ForecastStatus:
         else:
             return 0
 
+    def readyToLayer(self):
+        """ Check if both inputs are available and layering not yet done
+
+        Returns
+        -------
+        bool
+           True if HRRR and RAP inputs exist and the forecast is not layered
+        """
+        return (self._layered == 0 and self._hrrr == 1 and self._rap == 1)
+
+    def setLayered(self):
+        """ Mark this forecast as layered
+        """
+        self._layered = 1
+
     def layerIfReady(self, parms):
         """  Perform layering if state is such that it should be done
 
@@ -529,12 +553,23 @@ class ForecastStatus:
           parameters
 
         """        
-        path = self._issue.strftime("%Y%m%d%H") + "/"
-        path += self._valid.strftime("%Y%m%d%H%M") + ".LDASIN_DOMAIN1.nc"
+        path = self.layerPath()
         logging.info("LAYERING %s ", path)
         srf.forcing('layer', 'HRRR', path, 'RAP', path)
         logging.info("DONE LAYERING file=%s", path)
 
+    def layerPath(self):
+        """ Return the input file to layer, with its issue time directory
+
+        Returns
+        -------
+        str
+           'yyyymmddhh/yyyymmddhhmm.LDASIN_DOMAIN1.nc'
+        """
+        path = self._issue.strftime("%Y%m%d%H") + "/"
+        path += self._valid.strftime("%Y%m%d%H%M") + ".LDASIN_DOMAIN1.nc"
+        return path
+
     def passthroughRap(self, parms):
         """ Perform pass through of RAP data as if it were layered
 
@@ -564,14 +599,14 @@ class ForecastStatus:
         if not os.path.isdir(fullPath):
             logging.error("%s is not a directory", fullPath)
         else:
-            # create copy command and do it
-            cmd = "cp " + parms._rapDir
-            cmd += "/" + path
-            cmd += " " + fullPath
-            cmd += "/"
-            cmd += fnameOut
-            logging.info(cmd)
-            os.system(cmd)
+            # hardlink or copy it in place, no shell
+            src = parms._rapDir + "/" + path
+            dst = fullPath + "/" + fnameOut
+            method = FileOps.materialize(src, dst)
+            if not method:
+                logging.error("Passthrough of %s failed", src)
+            else:
+                logging.info("%s -> %s (%s)", src, dst, method)
 
         logging.info("LAYERING (Passthrough) %s complete", path)
             
@@ -894,15 +929,43 @@ class State:
     def layerIfReady(self, parms):
         """ Perform layering for all forecasts that indicate it should be done
 
+        All forecasts with both inputs available are layered together in
+        one batch, the rest are checked individually for RAP passthrough.
+
         Parameters
         ----------
         parms : Parms
            Params
         """
+        ready = [f for f in self._fState if f.readyToLayer()]
+        if (ready):
+            layerForecasts(ready)
         for f in self._fState:
             f.layerIfReady(parms)
             
         
+#----------------------------------------------------------------------------
+def layerForecasts(forecasts):
+    """ Layer a batch of forecasts in one call, marking each one layered
+
+    As with single forecast layering, a forecast is marked layered even
+    when layering fails, so it is not retried every pass.
+
+    Parameters
+    ----------
+    forecasts : list[ForecastStatus]
+       Forecasts whose HRRR and RAP inputs are both available
+    """
+    paths = [f.layerPath() for f in forecasts]
+    logging.info("LAYERING %d forecasts in one batch", len(paths))
+    status = srf.layer(paths, 'HRRR', 'RAP')
+    for ok, path in zip(status, paths):
+        if (not ok):
+            logging.error("Layering failed for %s", path)
+    for f in forecasts:
+        f.setLayered()
+    logging.info("DONE LAYERING batch of %d", len(paths))
+
 #----------------------------------------------------------------------------
 def main(argv):
 
@@ -3,6 +3,8 @@ import logging
 import os
 import sys
 import re
+import FileNames
+import FileOps
 from ConfigParser import SafeConfigParser
 import optparse
 import shutil
@@ -72,99 +74,7 @@ def forcing(action, prod, file, prod2=None, file2=None):
     action_requested = action.lower()
     product_data_name = prod.upper()
     if action == 'regrid': 
-        # Get the finished directory locations for the relevant product.
-        if prod == 'RAP':
-            regridded_dir = parser.get('regridding', 'RAP_output_dir')
-            downscale_dir = parser.get('downscaling', 'RAP_downscale_output_dir')
-            finished_downscale_dir = parser.get('downscaling', 'RAP_finished_output_dir')
-            downscale_input_dir = parser.get('downscaling',  'RAP_data_to_downscale')
-      
-        elif prod == 'HRRR':
-            regridded_dir = parser.get('regridding', 'HRRR_output_dir')
-            downscale_dir = parser.get('downscaling', 'HRRR_downscale_output_dir')
-            finished_downscale_dir = parser.get('downscaling', 'HRRR_finished_output_dir')
-            downscale_input_dir = parser.get('downscaling',  'HRRR_data_to_downscale')
-
-
-        (date,modelrun,fcsthr) = whf.extract_file_info(file)
-        # Determine whether this current file lies within the forecast range
-        # for the data product (e.g. if processing RAP, use only the 0hr-18hr forecasts).
-        # Skip if this file has a forecast hour greater than the max indicated in the 
-        # parm/config file.
-        in_fcst_range = whf.is_in_fcst_range(prod, fcsthr, parser)
-
-        if in_fcst_range:
-            # Check for RAP or GFS data products.  If this file is
-            # a 0 hr fcst and is RAP or GFS, substitute each 0hr forecast
-            # with the file from the previous model run and the same valid
-            # time.  This is necessary because there are missing variables
-            # in the 0hr forecasts (e.g. precip rate for RAP and radiation
-            # in GFS).
-    
-            logging.info("Regridding and Downscaling for %s", product_data_name)
-            # Determine if this is a 0hr forecast for RAP data (GFS is also missing
-            # some variables for 0hr forecast, but GFS is not used for Short Range
-            # forcing). We will need to substitute this file for the downscaled
-            # file from a previous model run with the same valid time.  
-            # We only need to do this for downscaled files, as the Short Range 
-            # forcing files that are regridded always get downscaled and we don't want
-            # to do this for both the regridding and downscaling.
-            if fcsthr == 0 and prod == 'RAP':
-                logging.info("Regridding, ignoring f0 RAP files " )
-                regridded_file = whf.regrid_data(product_data_name, file, parser, True)
-
-                # Downscaling...
-                stat= whf.downscale_data(product_data_name,regridded_file, parser, True, True)
-                if (stat == 0):
-                    # Move the finished downscaled file to the "finished" area so the triggering
-                    # script can determine when to layer with other data.
-                    match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',regridded_file)
-                    if match:
-                        downscaled_dir = finished_downscale_dir + "/" + match.group(1)
-                        input_dir = downscale_dir + "/" + match.group(1)
-                        if not os.path.exists(downscaled_dir):
-                            whf.mkdir_p(downscaled_dir)
-                            downscaled_file = downscaled_dir + "/" + match.group(2)
-                            input_file = input_dir + "/" + match.group(2)
-                            whf.move_to_finished_area(parser, prod, input_file) 
-                    else:
-                        logging.error("FAIL- cannot move finished file: %s", regridded_file) 
-                        return 
-                else:
-                    logging.error("FAIL dould not downscale data for hour 0 RAP")
-                # Remove empty 0hr regridded file if it still exists
-                if os.path.exists(regridded_file):
-                    cmd = 'rm -rf ' + regridded_file
-                    status = os.system(cmd)
-                    if status != 0:
-                        logging.error("ERROR: Failure to remove empty file: " + regridded_file)
-                        return
-
-            else:
-                regridded_file = whf.regrid_data(product_data_name, file, parser, False)
-                # Downscaling...
-                whf.downscale_data(product_data_name,regridded_file, parser,True, False)                
-                # Move the downscaled file to the finished area.
-                # Move the downscaled file to the finished location 
-                match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',regridded_file)
-                if match:
-                    full_dir = finished_downscale_dir + "/" + match.group(1)
-                    input_dir = downscale_dir + "/" + match.group(1)
-                    full_input_file = input_dir + "/" + match.group(2)
-                    full_finished_file = full_dir + "/" + match.group(2)
-                    if not os.path.exists(full_dir):
-                        logging.info("finished dir doesn't exist, creating it now...")
-                        whf.mkdir_p(full_dir)
-                    logging.info("Moving now, source = %s", full_input_file)
-                    whf.move_to_finished_area(parser, prod, full_input_file)
-                    #whf.move_to_finished_area(parser, prod, full_finished_file)
-                else:
-                    logging.error("FAIL- cannot move finished file: %s", full_finished_file) 
-                    return
-
-        else:
-            # Skip processing this file, exiting...
-            logging.info("INFO [Short_Range_Forcing]- Skip processing, requested file is outside max fcst")
+        process_file(parser, prod, file)
     elif action_requested == 'layer':
         logging.info("Layering requested for %s and %s", prod, prod2)
         # Do some checking to make sure that there are two data products 
@@ -178,7 +88,6 @@ def forcing(action, prod, file, prod2=None, file2=None):
         else:
             # We have everything we need, request layering
             whf.layer_data(parser,file, file2, prod, prod2, 'Short_Range')
-            whf.rename_final_files(parser,'Short_Range')
              
     elif action_requested == 'bias':
         logging.info("Bias correction requested for %s", file)
@@ -188,6 +97,182 @@ def forcing(action, prod, file, prod2=None, file2=None):
 
 
  
+
+def process_file(parser, prod, file):
+    """Regrids, downscales and finishes one file, the 'regrid' action.
+
+       Args:
+           parser (SafeConfigParser): parser for the config/param file.
+           prod (string):  The product, HRRR or RAP.
+           file (string):  The file name, as for forcing().
+       Returns:
+           status (int): 0 if successful or if the file is outside the
+                         forecast range, 1 otherwise.
+    """
+    product_data_name = prod.upper()
+    # Get the finished directory locations for the relevant product.
+    if prod == 'RAP':
+        downscale_dir = parser.get('downscaling', 'RAP_downscale_output_dir')
+        finished_downscale_dir = parser.get('downscaling', 'RAP_finished_output_dir')
+    elif prod == 'HRRR':
+        downscale_dir = parser.get('downscaling', 'HRRR_downscale_output_dir')
+        finished_downscale_dir = parser.get('downscaling', 'HRRR_finished_output_dir')
+
+    (date,modelrun,fcsthr) = whf.extract_file_info(file)
+    # Determine whether this current file lies within the forecast range
+    # for the data product (e.g. if processing RAP, use only the 0hr-18hr forecasts).
+    # Skip if this file has a forecast hour greater than the max indicated in the 
+    # parm/config file.
+    if not whf.is_in_fcst_range(prod, fcsthr, parser):
+        # Skip processing this file, exiting...
+        logging.info("INFO [Short_Range_Forcing]- Skip processing, requested file is outside max fcst")
+        return 0
+
+    # Check for RAP or GFS data products.  If this file is
+    # a 0 hr fcst and is RAP or GFS, substitute each 0hr forecast
+    # with the file from the previous model run and the same valid
+    # time.  This is necessary because there are missing variables
+    # in the 0hr forecasts (e.g. precip rate for RAP and radiation
+    # in GFS).
+    logging.info("Regridding and Downscaling for %s", product_data_name)
+    # Determine if this is a 0hr forecast for RAP data (GFS is also missing
+    # some variables for 0hr forecast, but GFS is not used for Short Range
+    # forcing). We will need to substitute this file for the downscaled
+    # file from a previous model run with the same valid time.  
+    # We only need to do this for downscaled files, as the Short Range 
+    # forcing files that are regridded always get downscaled and we don't want
+    # to do this for both the regridding and downscaling.
+    if fcsthr == 0 and prod == 'RAP':
+        logging.info("Regridding, ignoring f0 RAP files " )
+        regridded_file = whf.regrid_data(product_data_name, file, parser, True)
+        if not regridded_file:
+            return 1
+
+        # Downscaling... (downscale_data returns None when successful)
+        stat= whf.downscale_data(product_data_name,regridded_file, parser, True, True)
+        if not stat:
+            # Move the finished downscaled file to the "finished" area so the triggering
+            # script can determine when to layer with other data.
+            parts = FileNames.ldasinParts(regridded_file)
+            if parts:
+                downscaled_dir = finished_downscale_dir + "/" + parts[0]
+                input_dir = downscale_dir + "/" + parts[0]
+                if not os.path.exists(downscaled_dir):
+                    whf.mkdir_p(downscaled_dir)
+                    downscaled_file = downscaled_dir + "/" + parts[1]
+                    input_file = input_dir + "/" + parts[1]
+                    whf.move_to_finished_area(parser, prod, input_file) 
+            else:
+                logging.error("FAIL- cannot move finished file: %s", regridded_file) 
+                return 1
+        else:
+            logging.error("FAIL dould not downscale data for hour 0 RAP")
+        # Remove empty 0hr regridded file if it still exists
+        if not FileOps.remove(regridded_file):
+            logging.error("ERROR: Failure to remove empty file: " + regridded_file)
+            return 1
+        if stat:
+            return 1
+        return 0
+
+    regridded_file = regrid_file(parser, product_data_name, file)
+    if not regridded_file:
+        return 1
+    # Downscaling...
+    if downscale_file(parser, product_data_name, regridded_file):
+        return 1
+    # Move the downscaled file to the finished area.
+    if finish_file(parser, prod, regridded_file) is None:
+        return 1
+    return 0
+
+
+def regrid_file(parser, prod, file):
+    """Regrids one (non 0hr) file, the first step of 'regrid'.
+
+       Args:
+           parser (SafeConfigParser): parser for the config/param file.
+           prod (string):  The product, HRRR or RAP.
+           file (string):  The file name, as for forcing().
+       Returns:
+           regridded_file (string): Full path of the regridded file,
+                                    None if regridding failed.
+    """
+    return whf.regrid_data(prod.upper(), file, parser, False)
+
+
+def downscale_file(parser, prod, regridded_file):
+    """Downscales a regridded file, the second step of 'regrid'.
+
+       Args:
+           parser (SafeConfigParser): parser for the config/param file.
+           prod (string):  The product, HRRR or RAP.
+           regridded_file (string): Full path from regrid_file().
+       Returns:
+           status (int): 0 if successful, 1 otherwise.
+    """
+    if whf.downscale_data(prod.upper(), regridded_file, parser, True, False):
+        return 1
+    return 0
+
+
+def finish_file(parser, prod, regridded_file):
+    """Moves the downscaled file of a regridded file to the finished
+       area, the last step of 'regrid', where it is ready to layer.
+
+       Args:
+           parser (SafeConfigParser): parser for the config/param file.
+           prod (string):  The product, HRRR or RAP.
+           regridded_file (string): Full path from regrid_file().
+       Returns:
+           layer_file (string): The YYYYMMDDHH/<file> name to layer
+                                (see layer()), None if it failed.
+    """
+    downscale_dir = parser.get('downscaling', prod + '_downscale_output_dir')
+    finished_downscale_dir = parser.get('downscaling', prod + '_finished_output_dir')
+    parts = FileNames.ldasinParts(regridded_file)
+    if not parts:
+        logging.error("FAIL- cannot move finished file: %s", regridded_file) 
+        return None
+    full_dir = finished_downscale_dir + "/" + parts[0]
+    input_dir = downscale_dir + "/" + parts[0]
+    full_input_file = input_dir + "/" + parts[1]
+    if not os.path.exists(full_dir):
+        logging.info("finished dir doesn't exist, creating it now...")
+        whf.mkdir_p(full_dir)
+    logging.info("Moving now, source = %s", full_input_file)
+    whf.move_to_finished_area(parser, prod, full_input_file)
+    return parts[0] + "/" + parts[1]
+
+
+def layer(files, prod='HRRR', prod2='RAP'):
+    """Layers many files in one call, reading the config/param
+       file and setting up logging only once, and sharing the
+       coverage mask of the first product and the output layout
+       between all files (see whf.layer_data_batch).
+
+       Args:
+           files (list):  The YYYYMMDDHH/<file> names to layer, each
+                          names both the first and second product file.
+           prod (string):  The first product, default HRRR.
+           prod2 (string): The second product, default RAP.
+       Returns:
+           status (list): 1 or 0 for each file, in input order, 1 if
+                          the file was layered.
+    """
+
+    # Read the parameters from the config/param file.
+    parser = SafeConfigParser()
+    parser.read('/d4/karsten/DFE/wrf_hydro_forcing/parm/wrf_hydro_forcing.parm')
+
+    # Set up logging, environments, etc.
+    forcing_config_label = "Short_Range"
+    logging = whf.initial_setup(parser,forcing_config_label)
+
+    logging.info("Batch layering requested for %s and %s, %d files", prod,
+                 prod2, len(files))
+    return whf.layer_data_batch(parser, files, prod, prod2, 'Short_Range')
+
         
 #--------------------------    
     
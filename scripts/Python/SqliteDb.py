@@ -0,0 +1,54 @@
+"""SqliteDb
+SQLite helpers shared by the databases on shared storage (see JobQueue.py
+and Catalog.py).
+
+Connections are in autocommit mode, and every change is made in an
+explicit IMMEDIATE transaction, which takes the write lock up front, so
+two connections never both read and then try to write.
+"""
+
+import sqlite3
+
+#----------------------------------------------------------------------------
+# Seconds a connection waits for another one's lock
+BUSY_TIMEOUT_SECONDS = 60
+
+#----------------------------------------------------------------------------
+def connect(path, schema):
+   """Open a database in autocommit mode, creating the tables if needed
+
+   Parameters
+   ----------
+   path: str
+      Database file
+   schema: str
+      SQL script creating the tables if they do not exist
+
+   Returns
+   -------
+   sqlite3.Connection
+      Usable from any thread, one at a time
+   """
+   db = sqlite3.connect(path, timeout=BUSY_TIMEOUT_SECONDS,
+                        isolation_level=None, check_same_thread=False)
+   db.executescript(schema)
+   return db
+
+#----------------------------------------------------------------------------
+class Transaction:
+   """with-statement IMMEDIATE transaction on a connection in autocommit
+   mode, rolled back if the block raises
+   """
+
+   def __init__(self, db):
+      self._db = db
+
+   def __enter__(self):
+      self._db.execute("begin immediate")
+
+   def __exit__(self, excType, exc, tb):
+      if (excType is None):
+         self._db.execute("commit")
+      else:
+         self._db.execute("rollback")
+      return False
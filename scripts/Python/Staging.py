@@ -0,0 +1,419 @@
+"""Staging
+Local scratch copies of the input files.  The drivers hand each input
+file to prefetch() ahead of its processing (the task graph does so for
+the next tasks to run, see Scheduler.py), and a pool of threads copies
+it to a directory on local disk; the regridding then reads the local
+copy (see local()) instead of the network mount, so the mount latency is
+out of the critical path and a file read twice (HRRR and RAP 0 hour
+forecasts, regridded for Short Range and for Analysis and Assimilation)
+is fetched once.
+
+Each copy is prefetched for a number of consumers and removed when all of
+them called release(); a consumer releases the file when its processing
+of it ends, also when that failed or raised.  At most staging_lookahead files are staged at a
+time: later prefetches wait, in order, for earlier copies to be
+released, so a long list of files is copied a window ahead of its
+processing instead of all up front.  The total size of the copies is
+capped too: room is made by removing least recently used copies that no
+consumer needs any more, and a file that does not fit is not staged.  A
+file whose copy has not started when it is needed is read from the
+mount, and the queued copy is dropped.
+
+Copies are made with FileOps.materialize(), so they never appear
+partially written.  Each process stages in its own subdirectory of the
+scratch directory, removed when the process exits; subdirectories left by
+processes that died are removed when the next one starts.
+"""
+
+import os
+import errno
+import atexit
+import shutil
+import logging
+import threading
+import collections
+import Queue
+import FileOps
+
+#----------------------------------------------------------------------------
+# Copy states
+QUEUED = 'queued'
+COPYING = 'copying'
+READY = 'ready'
+FAILED = 'failed'
+
+# Defaults for the parm file options
+DEFAULT_MAX_MB = 20000
+DEFAULT_THREADS = 4
+DEFAULT_LOOKAHEAD = 16
+
+_stager = None
+_stagerLock = threading.Lock()
+
+#----------------------------------------------------------------------------
+class _Entry:
+    """One staged file
+
+    Attributes
+    ----------
+    _local : str
+       Full path of the copy
+    _size : int
+       Size in bytes
+    _consumers : int
+       Number of release() calls still expected
+    _state : str
+       QUEUED, COPYING, READY or FAILED
+    _done : threading.Event
+       Set when the copy is READY or FAILED
+    """
+
+    def __init__(self, local, size, consumers):
+        self._local = local
+        self._size = size
+        self._consumers = consumers
+        self._state = QUEUED
+        self._done = threading.Event()
+
+#----------------------------------------------------------------------------
+class Stager:
+    """The staging area of this process
+
+    Attributes
+    ----------
+    _dir : str
+       This process's subdirectory of the scratch directory
+    _maxBytes : int
+       Cap on the total size of the copies
+    _lookahead : int
+       Cap on the number of files staged at a time
+    _bytes : int
+       Total size of the copies, queued ones included
+    _entries : collections.OrderedDict
+       Source full path -> _Entry, least recently used first
+    _waiting : collections.OrderedDict
+       Source full path -> number of consumers, of the files prefetched
+       beyond the lookahead, in prefetch order
+    _queue : Queue.Queue
+       Source full paths to copy
+    _lock : threading.Lock
+       Protects _entries, _waiting and _bytes
+    """
+
+    def __init__(self, scratchDir, maxBytes, numThreads,
+                 lookahead=DEFAULT_LOOKAHEAD):
+        """Create the subdirectory and start the copy threads
+
+        Parameters
+        ----------
+        scratchDir : str
+           Local scratch directory
+        maxBytes : int
+           Cap on the total size of the copies
+        numThreads : int
+           Number of copy threads
+        lookahead : int
+           Cap on the number of files staged at a time
+        """
+        removeStale(scratchDir)
+        self._dir = os.path.join(scratchDir, str(os.getpid()))
+        if (not os.path.isdir(self._dir)):
+            os.makedirs(self._dir)
+        self._maxBytes = maxBytes
+        self._lookahead = max(1, lookahead)
+        self._bytes = 0
+        self._entries = collections.OrderedDict()
+        self._waiting = collections.OrderedDict()
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        for i in range(max(1, numThreads)):
+            t = threading.Thread(target=self._copyLoop,
+                                 name="Staging-%d" %(i))
+            t.daemon = True
+            t.start()
+
+    def close(self):
+        """Remove all the copies
+        """
+        with self._lock:
+            self._entries.clear()
+            self._waiting.clear()
+            self._bytes = 0
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def prefetch(self, path, consumers=1):
+        """Queue a file for copying, or add consumers if already staged
+
+        Parameters
+        ----------
+        path : str
+           Full path of the input file
+        consumers : int
+           Number of release() calls to expect
+
+        Returns
+        -------
+        bool
+           True if the file is, or may be, staged
+        """
+        with self._lock:
+            e = self._entries.get(path)
+            if (e is not None):
+                e._consumers += consumers
+                return True
+            if (path in self._waiting):
+                self._waiting[path] += consumers
+                return True
+            if (self._waiting or len(self._entries) >= self._lookahead):
+                self._waiting[path] = consumers
+                return True
+            return self._stage(path, consumers)
+
+    def _stage(self, path, consumers):
+        """Add a file and queue its copy, called with the lock held
+
+        Returns
+        -------
+        bool
+           True if it fits
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError as err:
+            logging.warning("Not staging %s: %s", path, err)
+            return False
+        if (not self._makeRoom(size)):
+            logging.debug("Not staging %s, %d bytes do not fit", path, size)
+            return False
+        self._entries[path] = _Entry(self._localName(path), size, consumers)
+        self._bytes += size
+        self._queue.put(path)
+        return True
+
+    def _admit(self):
+        """Stage waiting files while there is room in the lookahead,
+        called with the lock held
+        """
+        while (self._waiting and len(self._entries) < self._lookahead):
+            path, consumers = self._waiting.popitem(last=False)
+            self._stage(path, consumers)
+
+    def local(self, path):
+        """Return the name to read a file from: its copy if staged,
+        waiting for a copy in progress, else the file itself
+
+        Parameters
+        ----------
+        path : str
+           Full path of the input file
+
+        Returns
+        -------
+        str
+        """
+        with self._lock:
+            if (self._waiting.pop(path, None) is not None):
+                # needed before its turn came
+                return path
+            e = self._entries.get(path)
+            if (e is None):
+                return path
+            if (e._state == QUEUED):
+                # reading the mount now beats waiting for the queue
+                self._remove(path)
+                self._admit()
+                return path
+            # most recently used
+            del self._entries[path]
+            self._entries[path] = e
+        e._done.wait()
+        if (e._state != READY):
+            return path
+        logging.debug("Reading staged %s", e._local)
+        return e._local
+
+    def release(self, path):
+        """Record that a consumer is done with a file, removing the copy
+        when it was the last one, or that it no longer needs a file still
+        waiting for its turn
+
+        Parameters
+        ----------
+        path : str
+           Full path of the input file
+        """
+        with self._lock:
+            if (path in self._waiting):
+                self._waiting[path] -= 1
+                if (self._waiting[path] <= 0):
+                    del self._waiting[path]
+                return
+            e = self._entries.get(path)
+            if (e is None):
+                return
+            e._consumers -= 1
+            if (e._consumers <= 0 and e._state != COPYING):
+                self._remove(path)
+                self._admit()
+
+    def _localName(self, path):
+        """Return the name of the copy: <dir>/<n>/yyyymmdd/<file>, with n
+        from the top directory, so equal names of different products do
+        not collide
+        """
+        ymdDir, name = os.path.split(path)
+        top, ymd = os.path.split(ymdDir)
+        return os.path.join(self._dir, "%08x" %(hash(top) & 0xffffffff),
+                            ymd, name)
+
+    def _makeRoom(self, size):
+        """Remove least recently used copies that no consumer needs until
+        size more bytes fit, called with the lock held
+
+        Returns
+        -------
+        bool
+           True if they fit
+        """
+        if (size > self._maxBytes):
+            return False
+        for path in list(self._entries.keys()):
+            if (self._bytes + size <= self._maxBytes):
+                break
+            e = self._entries[path]
+            if (e._consumers <= 0 and e._state in (READY, FAILED)):
+                logging.debug("Evicting staged %s", e._local)
+                self._remove(path)
+        return self._bytes + size <= self._maxBytes
+
+    def _remove(self, path):
+        """Forget a file and remove its copy, called with the lock held
+        """
+        e = self._entries.pop(path)
+        self._bytes -= e._size
+        if (e._state == READY):
+            FileOps.remove(e._local)
+
+    def _copyLoop(self):
+        """Copy thread: copy the queued files
+        """
+        while (1):
+            path = self._queue.get()
+            with self._lock:
+                e = self._entries.get(path)
+                if (e is None or e._state != QUEUED):
+                    # dropped while queued
+                    continue
+                e._state = COPYING
+            ok = FileOps.materialize(path, e._local)
+            with self._lock:
+                e._state = READY if ok else FAILED
+                e._done.set()
+                if (self._entries.get(path) is e and
+                    (not ok or e._consumers <= 0)):
+                    self._remove(path)
+                    self._admit()
+
+#----------------------------------------------------------------------------
+def removeStale(scratchDir):
+    """Remove the subdirectories of processes that no longer run
+
+    Parameters
+    ----------
+    scratchDir : str
+       Local scratch directory
+    """
+    try:
+        names = os.listdir(scratchDir)
+    except OSError:
+        return
+    for name in names:
+        if (not name.isdigit() or int(name) == os.getpid()):
+            continue
+        try:
+            os.kill(int(name), 0)
+        except OSError as e:
+            if (e.errno == errno.ESRCH):
+                logging.info("Removing stale staging directory %s", name)
+                shutil.rmtree(os.path.join(scratchDir, name),
+                              ignore_errors=True)
+
+#----------------------------------------------------------------------------
+def stager(parser):
+    """Return the staging area of this process, created from the parm file
+    on first use
+
+    Parameters
+    ----------
+    parser : SafeConfigParser
+       parser for the config/param file
+
+    Returns
+    -------
+    Stager
+       None if the parm file has no staging directory
+    """
+    global _stager
+    with _stagerLock:
+        if (_stager is None):
+            scratchDir = ""
+            maxMb = DEFAULT_MAX_MB
+            numThreads = DEFAULT_THREADS
+            lookahead = DEFAULT_LOOKAHEAD
+            if (parser.has_option('triggering', 'staging_dir')):
+                scratchDir = parser.get('triggering', 'staging_dir').strip()
+            if (parser.has_option('triggering', 'staging_max_mb')):
+                maxMb = float(parser.get('triggering', 'staging_max_mb'))
+            if (parser.has_option('triggering', 'staging_threads')):
+                numThreads = int(parser.get('triggering', 'staging_threads'))
+            if (parser.has_option('triggering', 'staging_lookahead')):
+                lookahead = int(parser.get('triggering', 'staging_lookahead'))
+            if (not scratchDir):
+                return None
+            _stager = Stager(scratchDir, int(maxMb*1024*1024), numThreads,
+                             lookahead)
+            atexit.register(_stager.close)
+        return _stager
+
+#----------------------------------------------------------------------------
+def lookahead(parser):
+    """Return the number of files staged at a time, creating the staging
+    area from the parm file if needed (see stager())
+
+    Parameters
+    ----------
+    parser : SafeConfigParser
+       parser for the config/param file
+
+    Returns
+    -------
+    int
+       0 if the parm file has no staging directory
+    """
+    s = stager(parser)
+    if (s is None):
+        return 0
+    return s._lookahead
+
+#----------------------------------------------------------------------------
+def prefetch(path, consumers=1):
+    """Stage a file, if this process has a staging area (see Stager)
+    """
+    if (_stager is None):
+        return False
+    return _stager.prefetch(path, consumers)
+
+#----------------------------------------------------------------------------
+def local(path):
+    """Return the name to read a file from (see Stager)
+    """
+    if (_stager is None):
+        return path
+    return _stager.local(path)
+
+#----------------------------------------------------------------------------
+def release(path):
+    """Record that a consumer is done with a file (see Stager)
+    """
+    if (_stager is not None):
+        _stager.release(path)
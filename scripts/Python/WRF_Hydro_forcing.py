@@ -9,6 +9,15 @@ import datetime
 import shutil
 import sys
 from ConfigParser import SafeConfigParser
+import Layering
+import CoverageMask
+import FileOps
+import NclExecutor
+import DirScan
+import FileNames
+import Staging
+import DataFiles
+import Catalog
 
 
 
@@ -28,6 +37,10 @@ from ConfigParser import SafeConfigParser
 #  etc. which are not always conducive in an operational setting.
 
 
+# File names picked by get_filepaths and get_layered_files
+GRIB_FILE_PATTERN = re.compile(r'.*(grib|grb|grib2|grb2)$')
+LAYERED_FILE_PATTERN = re.compile(r'.*(.nc)$')
+
 
 def regrid_data( product_name, file_to_regrid, parser, substitute_fcst = False, \
                  zero_process = False):
@@ -158,24 +171,18 @@ def regrid_data( product_name, file_to_regrid, parser, substitute_fcst = False,
             # Compose output file name, which will be in temporary directory. 
             regridded_file = path_split[0] + "_regridded." + path_split[1] + \
                              "." + path_split[2]
-            srcfilename_param =  "'srcfilename=" + '"' + file_to_regrid +  \
-                                     '"' + "' "
-            wgtFileName_in_param =  "'wgtFileName=" + '"' + wgt_file + \
-                                        '"' + "' "
-            dstGridName_param =  "'dstGridName=" + '"' + dst_grid_name + '"' + "' "
-            outfilename_param = "'outfilename=" + '"' + regridded_file + \
-                                '"' + "' "
-
-            regrid_params = srcfilename_param + outfilename_param + \
-                            dstGridName_param + wgtFileName_in_param
+            regrid_params = [('srcfilename', file_to_regrid),
+                             ('outfilename', regridded_file),
+                             ('dstGridName', dst_grid_name),
+                             ('wgtFileName', wgt_file)]
         else:
        	    (date,model,fcsthr) = extract_file_info(file_to_regrid)  
             data_file_to_regrid= data_dir + "/" + date + "/" + file_to_regrid 
-            srcfilename_param =  "'srcfilename=" + '"' + data_file_to_regrid +  \
-                                     '"' + "' "
-            wgtFileName_in_param =  "'wgtFileName_in=" + '"' + wgt_file + \
-                                        '"' + "' "
-            dstGridName_param =  "'dstGridName=" + '"' + dst_grid_name + '"' + "' "
+            # Read the local copy, if staged
+            regrid_params = [('srcfilename',
+                              Staging.local(data_file_to_regrid)),
+                             ('wgtFileName_in', wgt_file),
+                             ('dstGridName', dst_grid_name)]
    
             # Create the output filename following the 
             # naming convention for the WRF-Hydro model 
@@ -190,14 +197,14 @@ def regrid_data( product_name, file_to_regrid, parser, substitute_fcst = False,
                 output_file_dir = output_dir_root + "/" + subdir_file_path
  
             mkdir_p(output_file_dir)
-            outdir_param = "'outdir=" + '"' + output_file_dir + '"' + "' " 
+            regrid_params.append(('outdir', output_file_dir))
             regridded_file = output_file_dir + "/" + hydro_filename
 
             if product == "HRRR" or product == "NAM" \
                or product == "GFS" or product == "RAP":
                full_output_file = output_file_dir + "/"  
                # Create the new output file subdirectory
-               outFile_param = "'outFile=" + '"' + hydro_filename+ '"' + "' "
+               regrid_params.append(('outFile', hydro_filename))
             elif product == "MRMS":
                # !!!!!!NOTE!!!!!
                # MRMS regridding script differs from the HRRR and NAM scripts in that 
@@ -205,31 +212,21 @@ def regrid_data( product_name, file_to_regrid, parser, substitute_fcst = False,
                # directory (outdir) into the outFile variable.
                full_output_file = output_file_dir + "/"  + hydro_filename
                mkdir_p(output_file_dir)
-               outFile_param = "'outFile=" + '"' + full_output_file + '"' + "' "
-
-            regrid_params = srcfilename_param + wgtFileName_in_param + \
-                        dstGridName_param + outdir_param + \
-                        outFile_param
+               regrid_params.append(('outFile', full_output_file))
       
         if zero_process == True:
-            regrid_prod_cmd = ncl_exec + " -Q "  + regrid_params + " " + \
-                              regridding_exec_0hr
+            regrid_script = regridding_exec_0hr
         else:
-            regrid_prod_cmd = ncl_exec + " -Q "  + regrid_params + " " + \
-                              regridding_exec
+            regrid_script = regridding_exec
     
-        #logging.debug("regridding command: %s",regrid_prod_cmd)
-
-        # Measure how long it takes to run the NCL script for regridding.
-        start_NCL_regridding = time.time()
-        return_value = os.system(regrid_prod_cmd)
-        end_NCL_regridding = time.time()
-        elapsed_time_sec = end_NCL_regridding - start_NCL_regridding
-        logging.info("Time(sec) to regrid file  %s" %  elapsed_time_sec)
+        # Run the NCL script for regridding, with a timeout and retries
+        result = NclExecutor.ncl(parser, ncl_exec, regrid_script,
+                                 regrid_params)
+        logging.info("Time(sec) to regrid file  %s" %  result._elapsed)
         
-        if return_value != 0:
+        if not result.ok():
             logging.info('ERROR: The regridding of %s was unsuccessful, \
-                          return value of %s', product,return_value)
+                          status %s', product,result._status)
             #TO DO: Determine the proper action to take when the NCL file 
             #fails. For now, exit.
             return 
@@ -254,23 +251,8 @@ def get_filepaths(dir):
         
     """
 
-    # Create an empty list which will eventually store 
-    # all the full filenames
-    file_paths = []
-
-    # Walk the tree
-    for root, directories, files in os.walk(dir):
-        for filename in files:
-            # add it to the list only if it is a grib file
-            match = re.match(r'.*(grib|grb|grib2|grb2)$',filename)
-            if match:
-                # Join the two strings to form the full
-                # filepath.
-                filepath = os.path.join(root,filename)
-                file_paths.append(filepath)
-            else:
-                continue
-    return file_paths
+    # Walk the tree, keeping only grib files
+    return list(DirScan.walkFiles(dir, GRIB_FILE_PATTERN))
 
 
 
@@ -322,53 +304,30 @@ def create_output_name_and_subdir(product, filename, input_data_file):
  
     """
 
-    # Convert product to uppercase for easy, consistent 
-    # comparison.
-    product_name = product.upper() 
-
     if product == 'HRRR' or product == 'GFS' \
        or product == "NAM" or product == 'RAP':
-        match =  re.match(r'.*/([0-9]{8})_i([0-9]{2})_f([0-9]{3,4}).*',filename)
-        if match:
-            year_month_day = match.group(1)
-            init_hr = int(match.group(2))
-            fcst_hr = int(match.group(3))
-            valid_time = fcst_hr + init_hr
-            init_hr_str = (str(init_hr)).rjust(2,'0')
-            year_month_day_subdir = year_month_day + init_hr_str
-        else:
+        name = FileNames.parseInput(product, filename)
+        if name is None:
             logging.error("ERROR [create_output_name_and_subdir]: %s has an unexpected name." ,filename) 
             return
  
     elif product == 'MRMS':
-        match = re.match(r'.*([0-9]{8})_([0-9]{2}).*',filename) 
-        if match:
-           year_month_day = match.group(1)
-           init_hr =  match.group(2)
-
-           # Radar data- not a model, therefore no forecast
-           # therefore valid time is the init time
-           valid_time = int(init_hr)
-           year_month_day_subdir = year_month_day + init_hr 
-        else:
+        # Radar data- not a model, therefore no forecast
+        # therefore valid time is the init time
+        name = FileNames.parseInput(product, filename)
+        if name is None:
            logging.error("ERROR: MRMS data filename %s \
                           has an unexpected file name.",\
                           filename) 
            return
 
-   
-    if valid_time >= 24:
-        num_days_ahead =  valid_time/24
-        # valid time in 24 hour time
-        valid_time_str =  str(valid_time%24)
-        valid_time_corr = valid_time_str.rjust(2,'0')
-        updated_date = get_past_or_future_date(year_month_day, num_days_ahead)
-        # Assemble the filename and the full output directory path
-        hydro_filename = updated_date + valid_time_corr + "00.LDASIN_DOMAIN1.nc" 
     else:
-        # Assemble the filename and the full output directory path
-        valid_time_str = (str(valid_time)).rjust(2,'0')
-        hydro_filename = year_month_day + valid_time_str + "00.LDASIN_DOMAIN1.nc" 
+        logging.error("ERROR [create_output_name_and_subdir]: %s is unsupported", product)
+        return
+
+    # The valid time (issue time + forecast hour) may be days ahead
+    year_month_day_subdir, hydro_filename = \
+        FileNames.ldasinName(name.issueTime, name.validTime).split("/")
 
     return (year_month_day_subdir, hydro_filename)
 
@@ -395,7 +354,7 @@ def mkdir_p(dir):
 
 
 def downscale_data(product_name, file_to_downscale, parser, downscale_shortwave=False,
-                   substitute_fcst=False,out_path='./',verYYYYMMDDHH='1900010100', \
+                   substitute_fcst=False,out_path=None,verYYYYMMDDHH='1900010100', \
                    zero_process = False):
     """Performs downscaling of data by calling the necessary
     NCL code (specific to the model/product).  There is an
@@ -435,8 +394,10 @@ def downscale_data(product_name, file_to_downscale, parser, downscale_shortwave=
                                   the same valid time and rename it.
                                   'False' by default.
         out_path (string) : Optional output file path string to specify
-                            the output path. This is more geared towards 
-                            CFSv2 downscaling.
+                            the output path. Required for CFSv2
+                            downscaling; for the other products the
+                            output goes to the product's downscale
+                            output directory by default.
         verYYYYMMDDHH (string) : Optional string representing datetime
                                  of data being downscaled. Used for shortwave
                                  radiation downscaling calculations.
@@ -511,99 +472,84 @@ def downscale_data(product_name, file_to_downscale, parser, downscale_shortwave=
             file_exists(file_to_downscale)
 
             # Create input NCL command components
-            input_file1_param = "'hgtFileSrc=" + '"' + hgt_data_file + '"' + "' "
-            input_file2_param = "'hgtFileDst=" + '"' + geo_data_file + '"' + "' "
-            input_file3_param = "'inFile=" + '"' + file_to_downscale + '"' + "' "
-            input_file4_param = "'outFile=" + '"' + out_path + '"' + "' "
-            lapse_file_param =  "'lapseFile=" + '"' + lapse_rate_file + '"' + "' "
-            time_param = "'verYYYYMMDDHH=" + '"' + verYYYYMMDDHH.strftime("%Y%m%d%H") + '"' + "' "
-            downscale_params =  input_file1_param + input_file2_param + \
-                      input_file3_param + input_file4_param + lapse_file_param + \
-                      time_param 
-            downscale_cmd = ncl_exec + " -Q " + downscale_params + " " + downscale_exe 
+            downscale_params = [('hgtFileSrc', hgt_data_file),
+                                ('hgtFileDst', geo_data_file),
+                                ('inFile', file_to_downscale),
+                                ('outFile', out_path),
+                                ('lapseFile', lapse_rate_file),
+                                ('verYYYYMMDDHH',
+                                 verYYYYMMDDHH.strftime("%Y%m%d%H"))]
+            downscale_script = downscale_exe
+            # the output is the given file
+            full_downscaled_file = out_path
         else:
-            match = re.match(r'(.*)([0-9]{10})/([0-9]{8}([0-9]{2})00.LDASIN_DOMAIN1.*)',file_to_downscale)
-            if match:
-                yr_month_day_init = match.group(2)
-                regridded_file = match.group(3)
-                valid_hr = match.group(4)
+            name = FileNames.parseLdasin(file_to_downscale)
+            if name:
+                yr_month_day_init = name.issueDir
+                regridded_file = name.stem + name.ext
             else:
                 logging.error("ERROR: regridded file's name: %s is an unexpected format",\
                                    file_to_downscale)
                 sys.exit() 
   
-            if zero_process == True:
-                full_downscaled_dir = downscale_output_dir_0hr + "/" + yr_month_day_init
-            else: 
-                full_downscaled_dir = downscale_output_dir + "/" + yr_month_day_init  
-            full_downscaled_file = full_downscaled_dir + "/" +  regridded_file
-
-            # Create the full output directory for the downscaled data if it doesn't 
-            # already exist. 
-            if not os.path.exists(full_downscaled_dir):
-                mkdir_p(full_downscaled_dir) 
+            if out_path:
+                # the caller names the output file
+                full_downscaled_file = out_path
+            else:
+                if zero_process == True:
+                    full_downscaled_dir = downscale_output_dir_0hr + "/" + yr_month_day_init
+                else: 
+                    full_downscaled_dir = downscale_output_dir + "/" + yr_month_day_init  
+                full_downscaled_file = full_downscaled_dir + "/" +  regridded_file
+
+                # Create the full output directory for the downscaled data if it doesn't 
+                # already exist. 
+                if not os.path.exists(full_downscaled_dir):
+                    mkdir_p(full_downscaled_dir) 
     
             # Create the key-value pairs that make up the
             # input for the NCL script responsible for
             # the downscaling.
-            input_file1_param = "'inputFile1=" + '"' + hgt_data_file + '"' + "' "
-            input_file2_param = "'inputFile2=" + '"' + geo_data_file + '"' + "' "
-            input_file3_param = "'inputFile3=" + '"' + file_to_downscale + '"' + "' "
-            lapse_file_param =  "'lapseFile=" + '"' + lapse_rate_file + '"' + "' "
-            output_file_param = "'outFile=" + '"' + full_downscaled_file + '"' + "' "
-            downscale_params =  input_file1_param + input_file2_param + \
-                      input_file3_param + lapse_file_param +  output_file_param
+            downscale_params = [('inputFile1', hgt_data_file),
+                                ('inputFile2', geo_data_file),
+                                ('inputFile3', file_to_downscale),
+                                ('lapseFile', lapse_rate_file),
+                                ('outFile', full_downscaled_file)]
             if zero_process == True:
-                downscale_cmd = ncl_exec + " -Q " + downscale_params + " " + downscale_exe_0hr
+                downscale_script = downscale_exe_0hr
             else:  
-                downscale_cmd = ncl_exec + " -Q " + downscale_params + " " + downscale_exe
+                downscale_script = downscale_exe
     
         # Downscale the shortwave radiation, if requested...
         # Key-value pairs for downscaling SWDOWN, shortwave radiation.
         if downscale_shortwave:
             logging.info("Shortwave downscaling requested...")
             downscale_swdown_exe = parser.get('exe', 'shortwave_downscaling_exe') 
-            swdown_output_file_param = "'outFile=" + '"' + \
-                                       full_downscaled_file + '"' + "' "
-    
-            swdown_geo_file_param = "'inputGeo=" + '"' + geo_data_file + '"' + "' "
-            swdown_params = swdown_geo_file_param + " " + swdown_output_file_param
-            downscale_shortwave_cmd = ncl_exec + " -Q " + swdown_params + " " \
-                                      + downscale_swdown_exe 
-            logging.info("SWDOWN downscale command: %s", downscale_shortwave_cmd)
+            swdown_params = [('inputGeo', geo_data_file),
+                             ('outFile', full_downscaled_file)]
   
-            # Crude measurement of performance for downscaling.
-            # Wall clock time used to determine the elapsed time
-            # for downscaling each file.
-            start = time.time()
-    
-            #Invoke the NCL script for performing a single downscaling.
-            return_value = os.system(downscale_cmd)
-            swdown_return_value = os.system(downscale_shortwave_cmd)
-            end = time.time()
-            elapsed = end - start
+            #Invoke the NCL scripts for performing a single downscaling,
+            #the shortwave one only if the first succeeded.
+            result = NclExecutor.ncl(parser, ncl_exec, downscale_script,
+                                     downscale_params)
+            if result.ok():
+                result = NclExecutor.ncl(parser, ncl_exec,
+                                         downscale_swdown_exe, swdown_params)
     
             # Check for successful or unsuccessful downscaling
             # of the required and shortwave radiation
-            if return_value != 0 or swdown_return_value != 0:
+            if not result.ok():
                 logging.info('ERROR: The downscaling of %s was unsuccessful, \
-                             return value of %s', product,return_value)
+                             status %s', product,result._status)
                 # Remove regridded file and downscaled file 
-                cmd = 'rm -rf ' + file_to_downscale
-                status = os.system(cmd)
-                if status != 0:
+                if not FileOps.remove(file_to_downscale):
                   logging.error('ERROR: Failed to remove ' + file_to_downscale)
                 # If output file was generated, remove it as it's corrupted/incomplete
-                if os.path.exists(full_downscaled_file):
-                    cmd = 'rm -rf ' + full_downscaled_file 
-                    status = os.system(cmd)
-                    if status != 0:
-                      logging.error('ERROR: Failed to remove ' + full_downscaled_file)
+                if not FileOps.remove(full_downscaled_file):
+                  logging.error('ERROR: Failed to remove ' + full_downscaled_file)
                 sys.exit()
             else: # Remove regridded file as it's no longer needed
-                cmd = 'rm -rf ' + file_to_downscale
-                status = os.system(cmd)
-                if status != 0:
+                if not FileOps.remove(file_to_downscale):
                   logging.error('ERROR: Failed to remove ' + file_to_downscale)
                   return(1) 
     
@@ -611,35 +557,25 @@ def downscale_data(product_name, file_to_downscale, parser, downscale_shortwave=
             # No additional downscaling of
             # the short wave radiation is required.
     
-            # Crude measurement of performance for downscaling.
-            start = time.time()
-    
             #Invoke the NCL script for performing the generic downscaling.
-            return_value = os.system(downscale_cmd)
-            end = time.time()
-            elapsed = end - start
-            logging.info("Elapsed time (sec) for downscaling: %s",elapsed)
+            result = NclExecutor.ncl(parser, ncl_exec, downscale_script,
+                                     downscale_params)
+            logging.info("Elapsed time (sec) for downscaling: %s",
+                         result._elapsed)
     
             # Check for successful or unsuccessful downscaling
-            if return_value != 0:
+            if not result.ok():
                 logging.info('ERROR: The downscaling of %s was unsuccessful, \
-                             return value of %s', product,return_value)
+                             status %s', product,result._status)
                 # Remove regridded file and downscaled SW file
-                cmd = 'rm -rf ' + file_to_downscale
-                status = os.system(cmd)
-                if status != 0:
+                if not FileOps.remove(file_to_downscale):
                   logging.error('ERROR: Failed to remove ' + file_to_downscale)
                 # If output file was generated, remove it as it's corrupted/incomplete
-                if os.path.exists(full_downscaled_file):
-                    cmd = 'rm -rf ' + full_downscaled_file
-                    status = os.system(cmd)
-                    if status != 0:
-                      logging.error('ERROR: Failed to remove ' + full_downscaled_file)
+                if not FileOps.remove(full_downscaled_file):
+                  logging.error('ERROR: Failed to remove ' + full_downscaled_file)
                 return(1) 
             else: # Remove regridded file as it's no longer needed
-                cmd = 'rm -rf ' + file_to_downscale
-                status = os.system(cmd)
-                if status != 0:
+                if not FileOps.remove(file_to_downscale):
                   logging.error('ERROR: Failed to remove ' + file_to_downscale)
                   return(1) 
     
@@ -839,59 +775,52 @@ def bias_correction(product_name,file_in,cycleYYYYMMDDHH,fcstYYYYMMDDHH,
         file_exists(CFS_param_2mQ_path0)
         file_exists(CFS_param_2mQ_path1)
 
-        # Compose NCL command that calls bias-correction program.
-        bias_params = "'fileIn=" + '"' + file_in_path + '"' + "' " + \
-                      "'tmpDir=" + '"' + tmp_dir + '"' + "' " + \
-                      "'nldasParamHr1=" + '"' + NLDAS_param_path_1 + '"' + "' " + \
-                      "'nldasParamHr2=" + '"' + NLDAS_param_path_2 + '"' + "' " + \
-                      "'nldasParamHr3=" + '"' + NLDAS_param_path_3 + '"' + "' " + \
-                      "'nldasParamHr4=" + '"' + NLDAS_param_path_4 + '"' + "' " + \
-                      "'nldasParamHr5=" + '"' + NLDAS_param_path_5 + '"' + "' " + \
-                      "'nldasParamHr6=" + '"' + NLDAS_param_path_6 + '"' + "' " + \
-                      "'cfs2TParam0=" + '"' + CFS_param_2mT_path0 + '"' + "' " + \
-                      "'cfs2TParam1=" + '"' + CFS_param_2mT_path1 + '"' + "' " + \
-                      "'cfsSWParam0=" + '"' + CFS_param_SW_path0 + '"' + "' " + \
-                      "'cfsSWParam1=" + '"' + CFS_param_SW_path1 + '"' + "' " + \
-                      "'cfsLWParam0=" + '"' + CFS_param_LW_path0 + '"' + "' " + \
-                      "'cfsLWParam1=" + '"' + CFS_param_LW_path1 + '"' + "' " + \
-                      "'cfsPCPParam0=" + '"' + CFS_param_PCP_path0 + '"' + "' " + \
-                      "'cfsPCPParam1=" + '"' + CFS_param_PCP_path1 + '"' + "' " + \
-                      "'cfsPRESParam0=" + '"' + CFS_param_PRES_path0 + '"' + "' " + \
-                      "'cfsPRESParam1=" + '"' + CFS_param_PRES_path1 + '"' + "' " + \
-                      "'cfsUParam0=" + '"' + CFS_param_U_path0 + '"' + "' " + \
-                      "'cfsUParam1=" + '"' + CFS_param_U_path1 + '"' + "' " + \
-                      "'cfsVParam0=" + '"' + CFS_param_V_path0 + '"' + "' " + \
-                      "'cfsVParam1=" + '"' + CFS_param_V_path1 + '"' + "' " + \
-                      "'cfs2QParam0=" + '"' + CFS_param_2mQ_path0 + '"' + "' " + \
-                      "'cfs2QParam1=" + '"' + CFS_param_2mQ_path1 + '"' + "' " + \
-                      "'cycleYYYYMMDDHH=" + '"' + cycleYYYYMMDDHH.strftime("%Y%m%d%H") + \
-                      '"' + "' " + \
-                      "'fcstYYYYMMDDHH=" + '"' + fcstYYYYMMDDHH.strftime("%Y%m%d%H") + \
-                      '"' + "' " + \
-                      "'prevYYYYMMDDHH=" + '"' + prevYYYYMMDDHH.strftime("%Y%m%d%H") + \
-                      '"' + "' " + \
-                      "'modFile=" + '"' + CFS_bias_mod + '"' + "' " + \
-                      "'corrFile=" + '"' + CFS_corr_file + '"' + "' " + \
-                      "'fileInPrev=" + '"' + file_in_path_prev + '"' + "' " + \
-                      "'em=" + '"' + em_str + '"' + "' "  
-        ncl_cmd = "ncl -Q " + CFS_bias_exe + " " + bias_params
-        #logging.debug("Bias command: %s",ncl_cmd)
-
-        # Measure how long it takes to run the NCL script for bias correction.
-        start_NCL_bias = time.time()
-        return_value = os.system(ncl_cmd)
-        if return_value != 0:
-            logging.error('Bias correction returned an exit status of ' + str(return_value))
+        # Compose the NCL variables of the bias-correction program.
+        bias_params = [('fileIn', file_in_path),
+                       ('tmpDir', tmp_dir),
+                       ('nldasParamHr1', NLDAS_param_path_1),
+                       ('nldasParamHr2', NLDAS_param_path_2),
+                       ('nldasParamHr3', NLDAS_param_path_3),
+                       ('nldasParamHr4', NLDAS_param_path_4),
+                       ('nldasParamHr5', NLDAS_param_path_5),
+                       ('nldasParamHr6', NLDAS_param_path_6),
+                       ('cfs2TParam0', CFS_param_2mT_path0),
+                       ('cfs2TParam1', CFS_param_2mT_path1),
+                       ('cfsSWParam0', CFS_param_SW_path0),
+                       ('cfsSWParam1', CFS_param_SW_path1),
+                       ('cfsLWParam0', CFS_param_LW_path0),
+                       ('cfsLWParam1', CFS_param_LW_path1),
+                       ('cfsPCPParam0', CFS_param_PCP_path0),
+                       ('cfsPCPParam1', CFS_param_PCP_path1),
+                       ('cfsPRESParam0', CFS_param_PRES_path0),
+                       ('cfsPRESParam1', CFS_param_PRES_path1),
+                       ('cfsUParam0', CFS_param_U_path0),
+                       ('cfsUParam1', CFS_param_U_path1),
+                       ('cfsVParam0', CFS_param_V_path0),
+                       ('cfsVParam1', CFS_param_V_path1),
+                       ('cfs2QParam0', CFS_param_2mQ_path0),
+                       ('cfs2QParam1', CFS_param_2mQ_path1),
+                       ('cycleYYYYMMDDHH', cycleYYYYMMDDHH.strftime("%Y%m%d%H")),
+                       ('fcstYYYYMMDDHH', fcstYYYYMMDDHH.strftime("%Y%m%d%H")),
+                       ('prevYYYYMMDDHH', prevYYYYMMDDHH.strftime("%Y%m%d%H")),
+                       ('modFile', CFS_bias_mod),
+                       ('corrFile', CFS_corr_file),
+                       ('fileInPrev', file_in_path_prev),
+                       ('em', em_str)]
+
+        # Run the NCL script for bias correction, with a timeout and retries
+        result = NclExecutor.ncl(parser, ncl_exec, CFS_bias_exe, bias_params)
+        if not result.ok():
+            logging.error('Bias correction failed, status ' + result._status)
             sys.exit(1)
-        end_NCL_bias = time.time()
-        elapsed_time_sec = end_NCL_bias - start_NCL_bias
-        logging.info('Time(sec) to bias correct file %s' % elapsed_time_sec)  
+        logging.info('Time(sec) to bias correct file %s' % result._elapsed)
         
-def layer_data(parser, first_data, second_data, first_data_product, second_data_product, forcing_type):
-    """Invokes the NCL script, combine.ncl
-       to layer/combine two files:  first_data and 
-       second_data, with product type of first_prod and
-       second_prod respectively.
+def layer_data(parser, first_data, second_data, first_data_product, second_data_product, forcing_type,
+               coverage = None, batch = None):
+    """Layers/combines two files: first_data and second_data,
+       with product type of first_prod and second_prod
+       respectively, using the NumPy layering engine in
+       Layering.py (formerly the NCL script, combine.ncl).
 
 
         Args:
@@ -916,24 +845,33 @@ def layer_data(parser, first_data, second_data, first_data_product, second_data_
               forcing_type (string): The forcing configuration:
                                      Anal_Assim, Short_Range,
                                      Medium_Range, or Long_Range
+              coverage (CoverageMask.Coverage): Optional coverage of
+                                     the first data product, shared
+                                     when layering many files. By
+                                     default it is looked up from the
+                                     config/parm file.
+              batch (Layering.Batch): Optional batch the file is
+                                     layered in, which shares the
+                                     mask and output layout with the
+                                     other files of the batch (see
+                                     layer_data_batch). Overrides
+                                     coverage.
 
         Output:
-              None:  For each first and second file that is
+              status (int):  1 if the layered file was created, 0
+                     otherwise. For each first and second file that is
                      combined/layered, create a file
                      (name and location defined in the config/parm 
                      file).
     """
     # Retrieve any necessary data from the parameter/config file.
-    ncl_exe = parser.get('exe', 'ncl_exe')
     forcing_config = forcing_type.lower()
     if forcing_config == 'anal_assim':
         layered_output_dir = parser.get('layering', 'analysis_assimilation_output')
-        layering_exe = parser.get('exe','Analysis_Assimilation_layering')
     elif forcing_config == 'short_range':
         layered_output_dir = parser.get('layering', 'short_range_output')
         downscaled_first_dir = parser.get('layering','short_range_primary')
         downscaled_second_dir = parser.get('layering','short_range_secondary')
-        layering_exe = parser.get('exe','Short_Range_layering')
     elif forcing_config == 'medium_range':
         # No layering needed for Medium range
         layered_output_dir = parser.get('layering', 'medium_range_output')
@@ -950,52 +888,79 @@ def layer_data(parser, first_data, second_data, first_data_product, second_data_
     # portion of the first and second data file will be identical, they differ
     # by their directory path names). Note: DO NOT include the .nc file extension
     # for the final output file, the WRF-Hydro model is NOT looking for these.
-    # NCL requires a recognized file extension, therefore remove the .nc
-    # extension after the layering is complete.
-    match = re.match(r'([0-9]{10}/[0-9]{12}.LDASIN_DOMAIN1).nc',first_data)
-    if match:
-        file_name_only = match.group(1)
+    # The layered file is written under a temporary name and renamed to
+    # the name without .nc when complete.
+    name = FileNames.parseLdasin(first_data)
+    if name and name.baseDir is None and name.ext.startswith('.nc'):
+        file_name_only = name.issueDir + "/" + name.stem
     else:
         logging.error("ERROR[layer_data]: File name format is not what was expected")
-        return
-
-    # Create the key-value pair of
-    # input needed to run the NCL layering script.
-    hrrrFile_param = "'hrrrFile=" + '"' + downscaled_first_dir + "/" + first_data + '"' + "' "
-    rapFile_param =  "'rapFile="  + '"' + downscaled_second_dir + "/" +second_data + '"' + "' "
-    # Create the output filename for the layered file
-    layered_outfile = layered_output_dir + "/" \
-                                        + file_name_only
-    full_layered_outfile = layered_outfile + ".nc"
-    outFile_param = "'outFile=" + '"' + full_layered_outfile + '"' + "' "
-    print ("full_layered_outfile: %s")%(full_layered_outfile)
-    if not os.path.exists(full_layered_outfile):
-        mkdir_p(full_layered_outfile)
-    init_indexFlag = "false"
-    indexFlag = "true"
-    init_indexFlag_param = "'indexFlag=" + '"' +  init_indexFlag + '"' + "' "
-    indexFlag_param = "'indexFlag=" + '"' + indexFlag + '"' + "' "
-    init_layering_params = hrrrFile_param + rapFile_param + init_indexFlag_param\
-                           + outFile_param 
-    layering_params = hrrrFile_param + rapFile_param + indexFlag_param\
-                      + outFile_param
-    init_layering_cmd = ncl_exe + " " + init_layering_params + " " + \
-                        layering_exe
-    layering_cmd = ncl_exe + " " + layering_params + " " + \
-                        layering_exe
-    print ("layering command: %s")%(layering_cmd)    
-    init_return_value = os.system(init_layering_cmd)
-    if init_return_value != 0:
+        return 0
+
+    first_file = downscaled_first_dir + "/" + first_data
+    second_file = downscaled_second_dir + "/" + second_data
+
+    # Create the output filename for the layered file, and its
+    # YYYYMMDDHH subdirectory.
+    layered_outfile = layered_output_dir + "/" + file_name_only
+    logging.info("layered_outfile: %s", layered_outfile)
+    mkdir_p(os.path.dirname(layered_outfile))
+
+    start = time.time()
+    if batch is None:
+        if coverage is None:
+            coverage = CoverageMask.coverageFor(parser, first_data_product)
+        batch = Layering.Batch(coverage)
+    status = FileOps.writeAtomic(layered_outfile,
+                                 lambda tmp: batch.layer(first_file,
+                                                         second_file, tmp))
+    elapsed = time.time() - start
+    logging.info("Time(sec) to layer %s: %s", file_name_only, elapsed)
+    if not status:
         logging.error("ERROR[layer_data]: layering was unsuccessful")
+        return 0
+    return 1
+    
+
+def layer_data_batch(parser, files, first_data_product, second_data_product, forcing_type):
+    """Layers/combines many pairs of files in one Layering.Batch:
+       the coverage mask of the first data product is looked up and
+       validated once, and the output layout read once, for all of
+       them.  The first and second data files of each pair have the
+       same YYYYMMDDHH/<file> name (see layer_data); being different
+       lead times, each pair is still read once and written once.
+
+        Args:
+              parser (ConfigParser):  The parser to the config/parm
+                                      file containing all the defined
+                                      values.
+              files (list):  The YYYYMMDDHH/<file> names to layer.
+              first_data_product (string): The product name of the
+                                   first data product (e.g. HRRR).
+              second_data_product (string): The product name of the
+                                   second data product (e.g. RAP).
+              forcing_type (string): The forcing configuration:
+                                     Anal_Assim, Short_Range,
+                                     Medium_Range, or Long_Range
+
+        Output:
+              status (list):  1 or 0 for each file, in the same order
+                              as the input, 1 if the layered file was
+                              created.
+    """
+    batch = Layering.Batch(CoverageMask.coverageFor(parser,
+                                                    first_data_product))
+    start = time.time()
+    status = []
+    for f in files:
+        status.append(layer_data(parser, f, f, first_data_product,
+                                 second_data_product, forcing_type,
+                                 batch = batch))
+    elapsed = time.time() - start
+    logging.info("Time(sec) to layer %d files: %s", len(files), elapsed)
+    return status
 
-    else:
-        # Move/rename the processed files to the corresponding forcing
-        # configuration directory. 
-        os.rename(full_layered_outfile, layered_outfile)
 
-    return_value = os.system(layering_cmd) 
-    
-    
 def read_input():
     """Read in the command line arguments
        Uses optparse, which is available for Python 2.6
@@ -1123,23 +1088,15 @@ def extract_file_info(input_file):
             fcst_hr (int):  HHH
     """
 
-    # Regexp check for model data
-    match = re.match(r'.*([0-9]{8})_i([0-9]{2})_f([0-9]{3,4}).*', input_file)
-
-    # Regexp check for MRMS data
-    match2 = re.match(r'.*(GaugeCorr_QPE_00.00)_([0-9]{8})_([0-9]{6})',input_file)
-    if match:
-       date = match.group(1)
-       model_run = int(match.group(2))
-       fcst_hr  = int(match.group(3))
-       return (date, model_run, fcst_hr)
-    elif match2:
-       date = match2.group(2)
-       model_run = match2.group(3)
-       fcst_hr = int(0)
-       return (date, model_run, fcst_hr)
-    else:
+    # Model data, else MRMS data
+    name = FileNames.parseInput(None, input_file)
+    if name is None:
         logging.error("ERROR [extract_file_info]: File name doesn't follow expected format")
+    elif len(name.runTime) == 6:
+       # MRMS, the run time is hhmmss
+       return (name.ymd, name.runTime, 0)
+    else:
+       return (name.ymd, name.issueHour, name.fcstHour)
 
 def extract_file_info_cfs(input_file):
 
@@ -1160,18 +1117,9 @@ def extract_file_info_cfs(input_file):
            em (int) :: N
     """
 
-    # Regexp check for model data
-    match = re.match(r'.*([0-9]{8})/([0-9]{8})_i([0-9]{2})_f([0-9]{3,4})_e([0-9]{2}).*',input_file)
-    if match:
-        date = match.group(1)
-        date2 = match.group(1)
-        if date != date2:
-            logging.error("ERROR [extract_file_info_cfs]: File name doesn't follow expected format")
-            sys.exit(1)
-        model_run = int(match.group(3))
-        fcst_hr = int(match.group(4))
-        em = int(match.group(5))
-        return (date, model_run, fcst_hr, em)
+    name = FileNames.parseInput('CFS', input_file)
+    if name:
+        return (name.ymd, name.issueHour, name.fcstHour, name.member)
     else:
         logging.error("ERROR [extract_file_info]:2File name doesn't follow expected format")
         sys.exit(1)
@@ -1256,13 +1204,9 @@ def replace_fcst0hr(parser, file_to_replace, product):
     """
     # Retrieve the date, model time,valid time, and filename from the full filename 
     logging.info("INFO[replace_fcst0hr]: file to replace=%s", file_to_replace)
-    match = re.match(r'(.*)/([0-9]{8})([0-9]{2})/([0-9]{8}([0-9]{2})00.LDASIN_DOMAIN1.nc)',file_to_replace)
-    if match:
-        base_dir = match.group(1)
-        curr_date = match.group(2)
-        model_time = int(match.group(3))
-        file_only = match.group(4) 
-        valid_time = int(match.group(5))
+    name = FileNames.parseLdasin(file_to_replace)
+    if name and name.baseDir is not None and name.ext.startswith('.nc'):
+        file_only = name.stem + name.ext
     else:
         logging.error("ERROR[replace_fcst0hr]: filename %s  is unexpected, exiting.", file_to_replace)
         return
@@ -1270,19 +1214,8 @@ def replace_fcst0hr(parser, file_to_replace, product):
 
     if product == 'RAP':
         # Get the previous directory corresponding to the previous
-        # model run/init time.
-        if model_time == 0:
-            # Use the previous day's last model run
-            # and date.
-            prev_model_time = 23
-            date = get_past_or_future_date(curr_date,-1)
-            prev_model_time_str = (str(prev_model_time)).rjust(2,'0')
-            
-
-        else:
-            prev_model_time = model_time - 1
-            prev_model_time_str = (str(prev_model_time)).rjust(2,'0')
-            date = curr_date
+        # model run/init time (the previous day's last one at 0Z).
+        prev_model = name.issueTime - datetime.timedelta(hours=1)
     
         # Create the full file path and name to create the directory of
         # the previous model run/init time (i.e. YYYYMMDDH'H', 
@@ -1293,19 +1226,22 @@ def replace_fcst0hr(parser, file_to_replace, product):
 
         base_dir = parser.get('downscaling','RAP_finished_output_dir')
 
-        full_path = base_dir + '/' + date + prev_model_time_str + "/" + \
-                    file_only
+        full_path = base_dir + '/' + prev_model.strftime("%Y%m%d%H") + \
+                    "/" + file_only
         logging.info("INFO [replace_fcst0hr]: full path = %s", full_path)
         if os.path.isfile(full_path):
             # Make a copy
-            file_dir_fcst0hr = base_dir + "/" + curr_date + (str(model_time)).rjust(2,'0') 
+            file_dir_fcst0hr = base_dir + "/" + name.issueDir
             # Make the directory for the downscaled fcst 0hr 
             if not os.path.exists(file_dir_fcst0hr):
                 mkdir_p(file_dir_fcst0hr)
             file_path_to_replace = file_dir_fcst0hr + "/" + file_only
-            copy_cmd = "cp " + full_path + " " + file_path_to_replace
-            logging.info("copying the previous model run's file: %s",copy_cmd)      
-            os.system(copy_cmd)
+            logging.info("copying the previous model run's file: %s to %s",
+                         full_path, file_path_to_replace)
+            method = FileOps.materialize(full_path, file_path_to_replace)
+            if not method:
+                logging.error("ERROR [replace_fcst0hr]: could not copy %s",
+                              full_path)
             return
         else:
             # If we are here, we didn't find any file from a previous RAP model run...
@@ -1317,25 +1253,22 @@ def replace_fcst0hr(parser, file_to_replace, product):
         # Get the previous directory corresponding to the previous
         # model/init run. GFS only has 0,6,12,and 18 Z model/init run times.
         # Available forecasts are 0,3,6,9,12,15, and 18 hours.
-        prev_model = model_time - 6
-        if prev_model < 0:
-            prev_model_time_str = str(18)   
-            date = get_past_or_future_date(curr_date, -1)
-        else:
-            date = curr_date
-            prev_model_time_str = (str(prev_model)).rjust(2,'0')
-        full_path = base_dir + '/' + date + prev_model_time_str + "/" +\
-                    file_only
+        prev_model = name.issueTime - datetime.timedelta(hours=6)
+        full_path = base_dir + '/' + prev_model.strftime("%Y%m%d%H") + \
+                    "/" + file_only
         if os.path.isfile(full_path):
             # Make a copy
-            file_dir_fcst0hr = base_dir + "/" + curr_date + (str(model_time)).rjust(2,'0') 
+            file_dir_fcst0hr = base_dir + "/" + name.issueDir
             # Make the directory for the downscaled fcst 0hr 
             if not os.path.exists(file_dir_fcst0hr):
                 mkdir_p(file_dir_fcst0hr)
             file_path_to_replace = file_dir_fcst0hr + "/" + file_only
-            copy_cmd = "cp " + full_path + " " + file_path_to_replace
-            logging.info("copying the previous model run's file: %s",copy_cmd)      
-            os.system(copy_cmd)
+            logging.info("copying the previous model run's file: %s to %s",
+                         full_path, file_path_to_replace)
+            method = FileOps.materialize(full_path, file_path_to_replace)
+            if not method:
+                logging.error("ERROR [replace_fcst0hr]: could not copy %s",
+                              full_path)
             return
         else:
             # If we are here, we didn't find any file from a previous GFS model run...
@@ -1366,16 +1299,10 @@ def get_past_or_future_date(curr_date, num_days = -1):
 
     """        
 
-    curr_dt = datetime.datetime.strptime(curr_date, "%Y%m%d")
+    curr_dt = datetime.date(int(curr_date[0:4]), int(curr_date[4:6]),
+                            int(curr_date[6:8]))
     prev_dt = curr_dt + datetime.timedelta(days=num_days)
-    year = str(prev_dt.year)
-    month = str(prev_dt.month)
-    day = str(prev_dt.day)
-    month  = month.rjust(2,'0')
-    day = day.rjust(2, '0')
-    prev_list = [year, month, day]
-    prev_date = ''.join(prev_list)
-    return prev_date
+    return prev_dt.strftime("%Y%m%d")
     
 def dir_exists(dir):
     """ Check for directory existence 
@@ -1441,10 +1368,10 @@ def rename_final_files(parser, forcing_type):
         anal_assim_files = get_layered_files(anal_assim_dir)
         for file in anal_assim_files:
             # Get the filename without the .nc extension
-            match = re.match(r'.*/(([0-9]{10})/[0-9]{12}.LDASIN_DOMAIN1).*', file)
-            if match:
-                filename_only = match.group(1)
-                ymd_dir = match.group(2)
+            name = FileNames.parseLdasin(file)
+            if name and name.baseDir is not None:
+                filename_only = name.issueDir + "/" + name.stem
+                ymd_dir = name.issueDir
                 destination_dir = anal_assim_dir + "/" + ymd_dir
                 destination = anal_assim_dir + "/" + filename_only
                 if not os.path.exists(destination_dir):
@@ -1458,10 +1385,10 @@ def rename_final_files(parser, forcing_type):
         # Move the MRMS files to their own location.
         for mrms in mrms_dir:
             # Get the filename without the .nc extension
-            match = re.match(r'.*/(([0-9]{10})/[0-9]{12}.LDASIN_DOMAIN1).*', file)
-            if match:
-                filename_only = match.group(1)
-                ymd_dir = match.group(2)
+            name = FileNames.parseLdasin(file)
+            if name and name.baseDir is not None:
+                filename_only = name.issueDir + "/" + name.stem
+                ymd_dir = name.issueDir
                 destination_dir = anal_assim_dir + "/" + ymd_dir  
                 destination = mrms_dir +  "/" + filename_only
                 if not os.path.exists(destination_dir):
@@ -1479,10 +1406,10 @@ def rename_final_files(parser, forcing_type):
         short_range_files = get_layered_files(short_range_dir)
         for file in short_range_files:
             # Get the filename without the .nc extension
-            match = re.match(r'.*/(([0-9]{10})/[0-9]{12}.LDASIN_DOMAIN1).*', file)
-            if match:
-                filename_only = match.group(1)
-                ymd_dir = match.group(2)
+            name = FileNames.parseLdasin(file)
+            if name and name.baseDir is not None:
+                filename_only = name.issueDir + "/" + name.stem
+                ymd_dir = name.issueDir
                 destination_dir = short_range_dir + "/" + ymd_dir
                 destination = short_range_dir + "/" + filename_only
                 if not os.path.exists(destination_dir):
@@ -1502,10 +1429,10 @@ def rename_final_files(parser, forcing_type):
         medium_range_files = get_layered_files(medium_range_downscale_dir)
         for file in medium_range_files:
             # Get the filename without the .nc extension
-            match = re.match(r'.*/(([0-9]{10})/[0-9]{12}.LDASIN_DOMAIN1).*', file)
-            if match:
-                filename_only = match.group(1)
-                ymd_dir = match.group(2)
+            name = FileNames.parseLdasin(file)
+            if name and name.baseDir is not None:
+                filename_only = name.issueDir + "/" + name.stem
+                ymd_dir = name.issueDir
                 destination_dir = medium_range_dir + "/" + ymd_dir 
                 destination = medium_range_dir + "/" + filename_only
                 if not os.path.exists(destination_dir):
@@ -1538,23 +1465,8 @@ def get_layered_files(dir):
                                files in the input directory.
     """
 
-    # Create an empty list which will eventually store
-    # all the full filenames
-    file_paths = []
-
-    # Walk the tree
-    for root, directories, files in os.walk(dir):
-        for filename in files:
-            # add it to the list only if it is a grib file
-            match = re.match(r'.*(.nc)$',filename)
-            if match:
-                # Join the two strings to form the full
-                # filepath.
-                filepath = os.path.join(root,filename)
-                file_paths.append(filepath)
-            else:
-                continue
-    return file_paths
+    # Walk the tree, keeping only netCDF files
+    return list(DirScan.walkFiles(dir, LAYERED_FILE_PATTERN))
 
 
 def move_to_finished_area(parser, product, src, zero_move = False):
@@ -1594,10 +1506,9 @@ def move_to_finished_area(parser, product, src, zero_move = False):
         logging.error("[move_to_finished_area]: %s is unsupported",product) 
     # Get the YYYYMMDDHH subdirectory from the full file path and
     # name (src).
-    match = re.match(r'.*/([0-9]{10})/([0-9]{12}.LDASIN_DOMAIN1.nc)',src)
-    if match:
-        ymd_dir = match.group(1)
-        file_only = match.group(2)
+    parts = FileNames.ldasinParts(src)
+    if parts:
+        ymd_dir, file_only = parts
         if zero_move == True:
             finished_dir = dest_dir_0hr + "/" + ymd_dir
         else:
@@ -1608,6 +1519,8 @@ def move_to_finished_area(parser, product, src, zero_move = False):
         logging.info("moving %s", src)
         logging.info("...to %s", finished_dest)
         shutil.move(src, finished_dest) 
+        # status lookups of the layering (see ShortRangeLayeringDriver)
+        DataFiles.recordOutput(finished_dest, product, Catalog.FINISHED)
         #cmd = "mv "+ src + " " + finished_dest
         #logging.info(cmd)
         #status = os.system(cmd)
@@ -0,0 +1,92 @@
+"""Tests of Catalog: directory listings, processing status and the
+intermediate files looked up by the layering
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import Catalog
+import DataFiles
+
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._c = Catalog.Catalog(os.path.join(self._dir, 'db', 'files.db'))
+
+    def tearDown(self):
+        self._c.close()
+        shutil.rmtree(self._dir)
+
+    def test_relisting_keeps_status(self):
+        c = self._c
+        c.replaceDir('/data', '20160301', 'HRRR', 1.0, 2.0,
+                     [('20160301/a', 100, 1, -1), ('20160301/b', 100, 2, -1)])
+        c.setStatus('/data', '20160301/a', 'HRRR', Catalog.REGRIDDED)
+        c.replaceDir('/data', '20160301', 'HRRR', 3.0, 4.0,
+                     [('20160301/a', 100, 1, -1), ('20160301/c', 100, 3, -1)])
+        self.assertEqual(c.status('/data', '20160301/a'), Catalog.REGRIDDED)
+        self.assertEqual(c.status('/data', '20160301/c'), Catalog.NEW)
+        self.assertTrue(c.status('/data', '20160301/b') is None)
+        self.assertEqual(c.dirState('/data/20160301'), (3.0, 4.0))
+        self.assertEqual([r[0] for r in c.dirFiles('/data', '20160301', 2)],
+                         ['20160301/a'])
+
+    def test_files_in_time_order(self):
+        c = self._c
+        c.replaceDir('/data', '20160301', 'HRRR', 1.0, 1.0,
+                     [('20160301/x', 101, 0, -1), ('20160301/y', 100, 5, -1),
+                      ('20160301/z', 100, 1, -1)])
+        rows = c.files('/data', 'HRRR', (100, 1), (101, 0), 18)
+        self.assertEqual([r[0] for r in rows],
+                         ['20160301/z', '20160301/y', '20160301/x'])
+        rows = c.files('/data', 'HRRR', (100, 2), (101, 0), 18)
+        self.assertEqual([r[0] for r in rows], ['20160301/y', '20160301/x'])
+
+    def test_forget_dir(self):
+        c = self._c
+        c.replaceDir('/data', '20160301', 'HRRR', 1.0, 1.0,
+                     [('20160301/a', 100, 1, -1)])
+        c.forgetDir('/data', '20160301')
+        self.assertTrue(c.dirState('/data/20160301') is None)
+        self.assertTrue(c.status('/data', '20160301/a') is None)
+
+    def test_counts(self):
+        c = self._c
+        c.setStatus('/data', '20160301/a', 'HRRR', Catalog.COMPLETE, 10, 1.0)
+        c.setStatus('/data', '20160301/b', 'HRRR', Catalog.REGRIDDED)
+        c.setStatus('/data', '20160301/c', 'HRRR', Catalog.REGRIDDED)
+        self.assertEqual(c.counts(), {Catalog.COMPLETE: 1,
+                                      Catalog.REGRIDDED: 2})
+
+
+class OutputStatusTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        DataFiles.useCatalog("")
+        shutil.rmtree(self._dir)
+
+    def test_finished_outputs_are_looked_up(self):
+        hrrr = '/finished/HRRR/2016030100/201603010100.LDASIN_DOMAIN1.nc'
+        rap = '/finished/RAP/2016030100/201603010100.LDASIN_DOMAIN1.nc'
+        DataFiles.recordOutput(hrrr, 'HRRR', Catalog.FINISHED)
+        self.assertFalse(DataFiles.hasCatalog())
+        self.assertTrue(DataFiles.outputStatus(hrrr) is None)
+        DataFiles.useCatalog(os.path.join(self._dir, 'files.db'))
+        self.assertTrue(DataFiles.hasCatalog())
+        DataFiles.recordOutput(hrrr, 'HRRR', Catalog.FINISHED)
+        self.assertEqual(DataFiles.outputStatus(hrrr), Catalog.FINISHED)
+        self.assertTrue(DataFiles.outputStatus(rap) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Tests of CoverageMask: masks are built once, stored, read back by a new
+cache and rebuilt when they no longer match the incoming data.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import CoverageMask
+import Layering
+
+FILL = Layering.FILL_VALUE
+
+
+def _field(missingColumns, shape=(4, 6)):
+    """Return a field that is missing in the given columns
+    """
+    field = np.full(shape, 280.0)
+    field[:, missingColumns] = FILL
+    return field
+
+
+class CoverageMaskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._grid = os.path.join(self._dir, 'geo_em.d01.nc')
+        with open(self._grid, 'w') as f:
+            f.write('grid')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _cache(self):
+        return CoverageMask.CoverageMaskCache(os.path.join(self._dir, 'masks'))
+
+    def test_mask_is_built_and_stored(self):
+        coverage = self._cache().coverage('HRRR', self._grid)
+        mask = coverage.missing(_field([5]))
+        np.testing.assert_array_equal(mask, Layering.missingMask(_field([5])))
+        stored = os.listdir(os.path.join(self._dir, 'masks'))
+        self.assertEqual(len(stored), 1)
+        self.assertTrue(stored[0].startswith('HRRR_geo_em.d01_'))
+        self.assertTrue(stored[0].endswith(CoverageMask.MASK_EXTENSION))
+
+    def test_stored_mask_is_used_by_itself(self):
+        self._cache().coverage('HRRR', self._grid).missing(_field([5]))
+        # a new process reads the stored mask, which passes the sample
+        # check, and does not add the cells missing in this field
+        cache = CoverageMask.CoverageMaskCache(os.path.join(self._dir, 'masks'),
+                                               sampleSize=2)
+        field = _field([5])
+        field[1, 2] = FILL
+        mask = cache.coverage('HRRR', self._grid).missing(field)
+        np.testing.assert_array_equal(mask, Layering.missingMask(_field([5])))
+
+    def test_mask_is_rebuilt_when_validation_fails(self):
+        cache = self._cache()
+        cache.coverage('HRRR', self._grid).missing(_field([5]))
+        mask = cache.coverage('HRRR', self._grid).missing(_field([0, 5]))
+        np.testing.assert_array_equal(mask,
+                                      Layering.missingMask(_field([0, 5])))
+        # and the rebuilt mask is the one stored
+        mask = self._cache().coverage('HRRR', self._grid).missing(
+            _field([0, 5]))
+        np.testing.assert_array_equal(mask,
+                                      Layering.missingMask(_field([0, 5])))
+
+    def test_mask_is_rebuilt_when_the_shape_changes(self):
+        cache = self._cache()
+        cache.coverage('HRRR', self._grid).missing(_field([5]))
+        field = _field([1], shape=(3, 3))
+        mask = cache.coverage('HRRR', self._grid).missing(field)
+        self.assertEqual(mask.shape, (3, 3))
+        np.testing.assert_array_equal(mask, Layering.missingMask(field))
+
+    def test_products_and_grids_have_their_own_masks(self):
+        cache = self._cache()
+        other = os.path.join(self._dir, 'geo_em.d02.nc')
+        keys = set([cache.coverage('HRRR', self._grid)._key,
+                    cache.coverage('RAP', self._grid)._key,
+                    cache.coverage('HRRR', other)._key])
+        self.assertEqual(len(keys), 3)
+
+    def test_cache_is_shared_per_directory(self):
+        masks = os.path.join(self._dir, 'masks')
+        self.assertTrue(CoverageMask.cacheFor(masks) is
+                        CoverageMask.cacheFor(masks))
+        self.assertFalse(CoverageMask.cacheFor(masks) is
+                         CoverageMask.cacheFor(self._dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Tests of DataFiles: epochHours(), FileIndex and DirCache
+"""
+
+import os
+import sys
+import json
+import shutil
+import calendar
+import datetime
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import DataFiles as df
+
+
+def _hours(y, m, d, h):
+    """Return hours since 1970 the slow way
+    """
+    return calendar.timegm(datetime.datetime(y, m, d, h).timetuple()) // 3600
+
+
+def _name(ymd, issueHour, fcstHour):
+    """Return an HRRR file name with its yyyymmdd parent directory
+    """
+    return "%s/%s_i%02d_f%03d_HRRR.grb2" %(ymd, ymd, issueHour, fcstHour)
+
+
+class EpochHoursTest(unittest.TestCase):
+
+    def test_epoch(self):
+        self.assertEqual(df.epochHours(1970, 1, 1, 0), 0)
+        self.assertEqual(df.epochHours(1970, 1, 2, 5), 29)
+
+    def test_against_calendar(self):
+        for y, m, d, h in [(1999, 12, 31, 23), (2000, 2, 29, 12),
+                           (2000, 3, 1, 0), (2015, 7, 23, 9),
+                           (2016, 1, 1, 0), (2016, 2, 29, 23),
+                           (2016, 12, 31, 23), (2100, 2, 28, 6),
+                           (2100, 3, 1, 6), (1969, 12, 31, 23)]:
+            self.assertEqual(df.epochHours(y, m, d, h), _hours(y, m, d, h),
+                             "%d-%02d-%02d %02dZ" %(y, m, d, h))
+
+    def test_consecutive_days(self):
+        t = datetime.datetime(2015, 1, 1)
+        for i in range(800):
+            self.assertEqual(df.epochHours(t.year, t.month, t.day, 0),
+                             _hours(t.year, t.month, t.day, 0))
+            t += datetime.timedelta(days=1)
+
+
+class FileIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self._names = [_name('20160102', 0, 1), _name('20160101', 23, 2),
+                       _name('20160101', 23, 1), _name('20160101', 22, 0),
+                       _name('20160102', 1, 0)]
+        self._index = df.FileIndex('HRRR', self._names)
+
+    def test_sorted_by_issue_then_forecast_hour(self):
+        self.assertEqual(self._index.names(),
+                         [_name('20160101', 22, 0), _name('20160101', 23, 1),
+                          _name('20160101', 23, 2), _name('20160102', 0, 1),
+                          _name('20160102', 1, 0)])
+        self.assertEqual(self._index.newest(), _name('20160102', 1, 0))
+
+    def test_window_is_inclusive(self):
+        oldest = df.epochHours(2016, 1, 1, 23)
+        newest = df.epochHours(2016, 1, 2, 0)
+        self.assertEqual(self._index.window(oldest, newest),
+                         [_name('20160101', 23, 1), _name('20160101', 23, 2),
+                          _name('20160102', 0, 1)])
+        self.assertEqual(self._index.window(newest, newest),
+                         [_name('20160102', 0, 1)])
+        self.assertEqual(self._index.window(newest + 2, newest + 10), [])
+
+    def test_unparsable_names_are_outside_windows(self):
+        self._index.add('20160101/junk')
+        self.assertTrue('20160101/junk' in self._index)
+        self.assertEqual(self._index.names()[0], '20160101/junk')
+        self.assertEqual(len(self._index.window(0, 10**7)), 5)
+
+    def test_add_and_purge(self):
+        self.assertFalse(self._index.add(_name('20160101', 22, 0)))
+        self.assertTrue(self._index.add(_name('20160102', 2, 0)))
+        self.assertEqual(len(self._index), 6)
+        n = self._index.purgeOlderThan(df.epochHours(2016, 1, 2, 0))
+        self.assertEqual(n, 3)
+        self.assertFalse(_name('20160101', 23, 2) in self._index)
+        self.assertEqual(self._index.window(0, 10**7),
+                         [_name('20160102', 0, 1), _name('20160102', 1, 0),
+                          _name('20160102', 2, 0)])
+
+
+class DirCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._data = os.path.join(self._dir, 'HRRR')
+        for ymd in ['20160101', '20160102']:
+            os.makedirs(os.path.join(self._data, ymd))
+        self._path = os.path.join(self._dir, 'dirs.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _saved(self):
+        with open(self._path) as f:
+            return sorted(json.load(f).keys())
+
+    def _scan(self, cache, ymds):
+        """List the top directory and the given yyyymmdd directories
+        """
+        cache.listing(self._data)
+        for ymd in ymds:
+            cache.listing(os.path.join(self._data, ymd))
+
+    def test_directories_not_scanned_are_dropped(self):
+        cache = df.DirCache(self._path)
+        self._scan(cache, ['20160101', '20160102'])
+        cache.save()
+        self.assertEqual(len(self._saved()), 3)
+        # the next scan no longer reaches back to 20160101
+        cache = df.DirCache(self._path)
+        self._scan(cache, ['20160102'])
+        cache.save()
+        self.assertEqual(self._saved(),
+                         [self._data, os.path.join(self._data, '20160102')])
+
+    def test_save_without_a_scan_keeps_the_listings(self):
+        cache = df.DirCache(self._path)
+        self._scan(cache, ['20160101', '20160102'])
+        cache.save()
+        cache.save()
+        self.assertEqual(len(self._saved()), 3)
+        self.assertEqual(len(cache._dirs), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Tests of FileNames: input and LDASIN file name parsing
+"""
+
+import os
+import sys
+import datetime
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import FileNames
+
+
+class ParseInputTest(unittest.TestCase):
+
+    def test_model(self):
+        name = FileNames.parseInput('HRRR',
+                                    '/data/HRRR/20150723/20150723_i23_f010_HRRR.grb2')
+        self.assertEqual(name.ymd, '20150723')
+        self.assertEqual(name.issueHour, 23)
+        self.assertEqual(name.fcstHour, 10)
+        self.assertEqual(name.member, -1)
+        self.assertEqual(name.runTime, '23')
+        self.assertEqual(name.issueTime, datetime.datetime(2015, 7, 23, 23))
+        self.assertEqual(name.validTime, datetime.datetime(2015, 7, 24, 9))
+
+    def test_four_digit_forecast_hour(self):
+        name = FileNames.parseInput('GFS', '20150723_i00_f0240_GFS.grb2')
+        self.assertEqual(name.fcstHour, 240)
+        self.assertEqual(name.validTime, datetime.datetime(2015, 8, 2, 0))
+
+    def test_cfs(self):
+        name = FileNames.parseInput(
+            'CFS', '/data/CFS/20150723/20150723_i06_f0006_e03_CFS.grb2')
+        self.assertEqual(name.ymd, '20150723')
+        self.assertEqual(name.issueHour, 6)
+        self.assertEqual(name.fcstHour, 6)
+        self.assertEqual(name.member, 3)
+        self.assertEqual(name.validTime, datetime.datetime(2015, 7, 23, 12))
+        # the CFSv2 spelling is the same format
+        self.assertEqual(FileNames.parseInput(
+            'CFSv2', '20150723/20150723_i06_f0006_e03_CFS.grb2').member, 3)
+
+    def test_mrms(self):
+        fname = 'GaugeCorr_QPE_00.00_20150723_130000.grib2'
+        for product in ('MRMS', None):
+            name = FileNames.parseInput(product, fname)
+            self.assertEqual(name.ymd, '20150723')
+            self.assertEqual(name.issueHour, 13)
+            self.assertEqual(name.fcstHour, 0)
+            self.assertEqual(name.runTime, '130000')
+            self.assertEqual(name.issueTime, name.validTime)
+
+    def test_not_matching(self):
+        self.assertTrue(FileNames.parseInput('HRRR', 'readme.txt') is None)
+        self.assertTrue(FileNames.parseInput(
+            'MRMS', '20150723_i23_f010_HRRR.grb2') is None)
+        self.assertTrue(FileNames.parseInput(
+            'CFS', '20150723_i23_f010_HRRR.grb2') is None)
+
+    def test_invalid_date(self):
+        self.assertTrue(FileNames.parseInput(
+            'HRRR', '20151323_i23_f010_HRRR.grb2') is None)
+        self.assertTrue(FileNames.parseInput(
+            'HRRR', '20150723_i24_f010_HRRR.grb2') is None)
+
+    def test_results_are_cached(self):
+        a = FileNames.parseInput('RAP', '20150723_i01_f001_RAP.grb2')
+        b = FileNames.parseInput('RAP', '20150723_i01_f001_RAP.grb2')
+        self.assertTrue(a is b)
+
+
+class LdasinTest(unittest.TestCase):
+
+    def test_parse(self):
+        name = FileNames.parseLdasin(
+            '/out/2015072309/201507241900.LDASIN_DOMAIN1.nc')
+        self.assertEqual(name.baseDir, '/out')
+        self.assertEqual(name.issueDir, '2015072309')
+        self.assertEqual(name.stem, '201507241900.LDASIN_DOMAIN1')
+        self.assertEqual(name.ext, '.nc')
+        self.assertEqual(name.issueTime, datetime.datetime(2015, 7, 23, 9))
+        self.assertEqual(name.validTime, datetime.datetime(2015, 7, 24, 19))
+
+    def test_parse_without_directory_or_extension(self):
+        name = FileNames.parseLdasin('2015072309/201507241900.LDASIN_DOMAIN1')
+        self.assertTrue(name.baseDir is None)
+        self.assertEqual(name.ext, '')
+
+    def test_parse_not_matching(self):
+        self.assertTrue(FileNames.parseLdasin(
+            '/out/201507241900.LDASIN_DOMAIN1.nc') is None)
+        self.assertTrue(FileNames.parseLdasin(
+            '/out/2015132309/201513241900.LDASIN_DOMAIN1.nc') is None)
+
+    def test_parts(self):
+        self.assertEqual(FileNames.ldasinParts(
+            '/out/2015072309/201507241900.LDASIN_DOMAIN1.nc'),
+            ('2015072309', '201507241900.LDASIN_DOMAIN1.nc'))
+        self.assertTrue(FileNames.ldasinParts(
+            '2015072309/201507241900.LDASIN_DOMAIN1.nc') is None)
+        self.assertTrue(FileNames.ldasinParts(
+            '/out/2015072309/201507241900.LDASIN_DOMAIN1') is None)
+
+    def test_name_round_trip(self):
+        issue = datetime.datetime(2015, 7, 23, 9)
+        valid = datetime.datetime(2015, 7, 24, 19)
+        name = FileNames.ldasinName(issue, valid)
+        self.assertEqual(name, '2015072309/201507241900.LDASIN_DOMAIN1.nc')
+        parsed = FileNames.parseLdasin(name)
+        self.assertEqual((parsed.issueTime, parsed.validTime), (issue, valid))
+
+
+if __name__ == '__main__':
+    unittest.main()
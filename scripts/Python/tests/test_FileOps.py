@@ -0,0 +1,143 @@
+"""Tests of FileOps: files are materialised, written and published through
+a temporary name, so a reader never sees a partial file
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import FileOps
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class MaterializeTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._src = os.path.join(self._dir, 'in.nc')
+        _write(self._src, 'forcing')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_same_filesystem_is_a_hardlink(self):
+        dst = os.path.join(self._dir, '2016030100', 'out.nc')
+        self.assertEqual(FileOps.materialize(self._src, dst), 'hardlink')
+        self.assertEqual(_read(dst), 'forcing')
+        self.assertEqual(os.stat(dst).st_ino, os.stat(self._src).st_ino)
+        # no temporary file is left behind
+        self.assertEqual(os.listdir(os.path.dirname(dst)), ['out.nc'])
+
+    def test_existing_file_is_replaced(self):
+        dst = os.path.join(self._dir, 'out.nc')
+        _write(dst, 'old')
+        self.assertTrue(FileOps.materialize(self._src, dst))
+        self.assertEqual(_read(dst), 'forcing')
+
+    def test_missing_source(self):
+        dst = os.path.join(self._dir, 'out.nc')
+        self.assertEqual(FileOps.materialize(os.path.join(self._dir, 'none'),
+                                             dst), '')
+        self.assertFalse(os.path.exists(dst))
+        self.assertEqual(sorted(os.listdir(self._dir)), ['in.nc'])
+
+    def test_copy_when_not_linked(self):
+        # as done across filesystems
+        dst = os.path.join(self._dir, 'out.nc')
+        method = FileOps._copy(self._src, dst)
+        self.assertTrue(method in ['reflink', 'copy_file_range', 'copy'])
+        self.assertEqual(_read(dst), 'forcing')
+        self.assertNotEqual(os.stat(dst).st_ino, os.stat(self._src).st_ino)
+
+    def test_temporary_names_are_hidden_and_per_thread(self):
+        path = os.path.join(self._dir, 'out')
+        tmp = FileOps.tempName(path, '.nc')
+        self.assertEqual(os.path.dirname(tmp), self._dir)
+        self.assertTrue(os.path.basename(tmp).startswith('.out.'))
+        self.assertTrue(tmp.endswith('.nc'))
+        self.assertTrue(str(os.getpid()) in tmp)
+
+
+class PublishTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_write_atomic_publishes_the_final_name(self):
+        path = os.path.join(self._dir, '2016030100',
+                            '201603010100.LDASIN_DOMAIN1')
+        tmps = []
+
+        def write(tmp):
+            tmps.append(tmp)
+            self.assertTrue(tmp.endswith('.nc'))
+            self.assertFalse(os.path.exists(path))
+            _write(tmp, 'forcing')
+            return 1
+
+        self.assertTrue(FileOps.writeAtomic(path, write))
+        self.assertEqual(_read(path), 'forcing')
+        self.assertFalse(os.path.exists(tmps[0]))
+        self.assertEqual(os.listdir(os.path.dirname(path)),
+                         ['201603010100.LDASIN_DOMAIN1'])
+
+    def test_failed_write_leaves_nothing(self):
+        path = os.path.join(self._dir, 'out')
+
+        def write(tmp):
+            _write(tmp, 'partial')
+            return 0
+
+        self.assertFalse(FileOps.writeAtomic(path, write))
+        self.assertEqual(os.listdir(self._dir), [])
+
+    def test_raising_write_leaves_nothing(self):
+        path = os.path.join(self._dir, 'out')
+
+        def write(tmp):
+            _write(tmp, 'partial')
+            raise ValueError("broken")
+
+        self.assertRaises(ValueError, FileOps.writeAtomic, path, write)
+        self.assertEqual(os.listdir(self._dir), [])
+
+    def test_publish_replaces_and_fails_cleanly(self):
+        path = os.path.join(self._dir, 'out')
+        _write(path, 'old')
+        tmp = FileOps.tempName(path)
+        _write(tmp, 'new')
+        self.assertTrue(FileOps.publish(tmp, path))
+        self.assertEqual(_read(path), 'new')
+        self.assertFalse(FileOps.publish(tmp, path))
+        self.assertEqual(_read(path), 'new')
+
+    def test_remove(self):
+        path = os.path.join(self._dir, 'out')
+        _write(path, 'x')
+        self.assertTrue(FileOps.remove(path))
+        self.assertFalse(os.path.exists(path))
+        # already gone is fine
+        self.assertTrue(FileOps.remove(path))
+        # a directory is not removed
+        self.assertFalse(FileOps.remove(self._dir))
+        self.assertTrue(os.path.isdir(self._dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+"""Tests of JobQueue: claims, leases, requeues and QueueScheduler
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import JobQueue
+
+
+class _Pipelines:
+    """Stands in for ForcingScheduler.Pipelines: the method names are the
+    job kinds
+    """
+
+    def regrid(self, fname):
+        pass
+
+    def layer(self, path):
+        pass
+
+    def passthrough(self, path):
+        pass
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'jobs.db')
+        self._q = JobQueue.JobQueue(self._path, leaseSeconds=60,
+                                    maxAttempts=2)
+
+    def tearDown(self):
+        self._q.close()
+        shutil.rmtree(self._dir)
+
+    def test_claim_in_priority_order(self):
+        q = self._q
+        q.put('long', 'regrid', ['c'], priority=3)
+        q.put('short2', 'regrid', ['b'], priority=1, lead=2)
+        q.put('short1', 'regrid', ['a'], priority=1, lead=1)
+        self.assertEqual(q.claim('w1'), ('short1', 'regrid', ['a']))
+        self.assertEqual(q.claim('w2')[0], 'short2')
+        self.assertEqual(q.claim('w3')[0], 'long')
+        self.assertTrue(q.claim('w4') is None)
+        self.assertEqual(q.state('short1'), JobQueue.RUNNING)
+
+    def test_claims_from_two_connections_do_not_overlap(self):
+        other = JobQueue.JobQueue(self._path)
+        try:
+            self._q.put('a', 'regrid')
+            self._q.put('b', 'regrid')
+            names = set([self._q.claim('w1')[0], other.claim('w2')[0]])
+            self.assertEqual(names, set(['a', 'b']))
+            self.assertTrue(other.claim('w2') is None)
+        finally:
+            other.close()
+
+    def test_dependencies(self):
+        q = self._q
+        q.put('b', 'layer', deps=['a'])
+        q.put('a', 'regrid')
+        self.assertEqual(q.claim('w')[0], 'a')
+        self.assertTrue(q.claim('w') is None)
+        self.assertTrue(q.complete('a', 'w', 'out.nc'))
+        self.assertEqual(q.result('a'), 'out.nc')
+        self.assertEqual(q.claim('w')[0], 'b')
+
+    def test_failed_dependency_fails_dependents(self):
+        q = JobQueue.JobQueue(self._path, maxAttempts=1)
+        try:
+            q.put('b', 'layer', deps=['a'])
+            q.put('a', 'regrid')
+            q.claim('w')
+            self.assertTrue(q.fail('a', 'w', 'broken'))
+            self.assertEqual(q.state('a'), JobQueue.FAILED)
+            self.assertEqual(q.state('b'), JobQueue.FAILED)
+        finally:
+            q.close()
+
+    def test_fail_requeues_until_max_attempts(self):
+        q = self._q
+        q.put('a', 'regrid')
+        q.claim('w')
+        q.fail('a', 'w', 'first')
+        self.assertEqual(q.state('a'), JobQueue.QUEUED)
+        self.assertEqual(q.claim('w')[0], 'a')
+        q.fail('a', 'w', 'second')
+        self.assertEqual(q.state('a'), JobQueue.FAILED)
+        self.assertTrue(q.claim('w') is None)
+        # put again, e.g. by a later backfill
+        self.assertTrue(q.put('a', 'regrid'))
+        self.assertEqual(q.claim('w')[0], 'a')
+
+    def test_lease_expiry_requeues(self):
+        q = JobQueue.JobQueue(self._path, leaseSeconds=0.2, maxAttempts=2)
+        try:
+            q.put('a', 'regrid')
+            self.assertEqual(q.claim('dead')[0], 'a')
+            self.assertTrue(q.heartbeat('a', 'dead'))
+            time.sleep(0.3)
+            self.assertEqual(q.claim('alive')[0], 'a')
+            # the first worker lost the job
+            self.assertFalse(q.heartbeat('a', 'dead'))
+            self.assertFalse(q.complete('a', 'dead', 'late'))
+            self.assertFalse(q.fail('a', 'dead', 'late'))
+            self.assertEqual(q.state('a'), JobQueue.RUNNING)
+            time.sleep(0.3)
+            # out of attempts
+            self.assertTrue(q.claim('other') is None)
+            self.assertEqual(q.state('a'), JobQueue.FAILED)
+        finally:
+            q.close()
+
+    def test_heartbeat_keeps_the_lease(self):
+        q = JobQueue.JobQueue(self._path, leaseSeconds=0.3)
+        try:
+            q.put('a', 'regrid')
+            q.claim('w')
+            for i in range(4):
+                time.sleep(0.1)
+                self.assertTrue(q.heartbeat('a', 'w'))
+            self.assertTrue(q.claim('other') is None)
+            self.assertTrue(q.complete('a', 'w'))
+        finally:
+            q.close()
+
+    def test_optional_dependency_fallback(self):
+        q = self._q
+        q.put('rap', 'regrid')
+        q.put('layer', 'layer', ['p'], deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=('passthrough', ['p']),
+              deadline=time.time() + 60)
+        q.claim('w')
+        q.complete('rap', 'w')
+        # before the deadline it waits for HRRR
+        self.assertTrue(q.claim('w') is None)
+        self.assertEqual(q.failMissing("no input"), ['hrrr'])
+        self.assertEqual(q.claim('w'), ('layer', 'passthrough', ['p']))
+
+    def test_deadline_fallback(self):
+        q = self._q
+        q.put('rap', 'regrid')
+        q.put('layer', 'layer', ['p'], deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=('passthrough', ['p']),
+              deadline=time.time() - 1)
+        q.claim('w')
+        q.complete('rap', 'w')
+        self.assertEqual(q.claim('w'), ('layer', 'passthrough', ['p']))
+
+    def test_counts(self):
+        q = self._q
+        q.put('a', 'regrid')
+        q.put('b', 'regrid')
+        q.putDone('c', 1)
+        q.claim('w')
+        self.assertEqual(q.counts(), {JobQueue.QUEUED: 1,
+                                      JobQueue.RUNNING: 1,
+                                      JobQueue.DONE: 1})
+        self.assertEqual(q.counts(['b', 'c', 'unknown']),
+                         {JobQueue.QUEUED: 1, JobQueue.DONE: 1})
+        names = ['n%d' %(i) for i in range(JobQueue.NAMES_PER_QUERY + 10)]
+        for n in names:
+            q.put(n, 'regrid')
+        self.assertEqual(q.counts(names), {JobQueue.QUEUED: len(names)})
+
+
+class QueueSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'jobs.db')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_counts_only_its_own_jobs(self):
+        p = _Pipelines()
+        earlier = JobQueue.QueueScheduler(JobQueue.JobQueue(self._path))
+        earlier.add('old', p.regrid, ('x',), deps=['gone'])
+        earlier.failMissing("no input")
+        s = JobQueue.QueueScheduler(JobQueue.JobQueue(self._path))
+        s.add('layer', p.layer, ('p',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(p.passthrough, ('p',)))
+        s.add('rap', p.regrid, ('r',))
+        s.addDone('done', 1)
+        self.assertEqual(s.failMissing("no input"), 1)
+        self.assertEqual(s.counts(), {JobQueue.QUEUED: 2,
+                                      JobQueue.DONE: 1,
+                                      JobQueue.FAILED: 1})
+        # its dependent fails when a worker looks at it
+        self.assertEqual(earlier.counts(), {JobQueue.QUEUED: 1,
+                                            JobQueue.FAILED: 1})
+        self.assertEqual(s.result('done'), 1)
+
+    def test_jobs_are_method_names(self):
+        p = _Pipelines()
+        s = JobQueue.QueueScheduler(JobQueue.JobQueue(self._path))
+        s.add('rap', p.regrid, ('r',), priority=1, lead=3)
+        q = JobQueue.JobQueue(self._path)
+        try:
+            self.assertEqual(q.claim('w'), ('rap', 'regrid', ['r']))
+            self.assertFalse(s.wait(0))
+            q.complete('rap', 'w')
+            self.assertTrue(s.wait(0))
+        finally:
+            q.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
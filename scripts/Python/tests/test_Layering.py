@@ -0,0 +1,227 @@
+"""Tests of Layering: mosaic() and layerFields() against the layering of
+combine.ncl and layer_anal_assim.ncl, which take a higher priority
+product wherever it is not missing and the lower priority one elsewhere,
+with LWDOWN from RAP everywhere.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import Layering
+
+FILL = Layering.FILL_VALUE
+
+
+def _fields(value, shape=(3, 4)):
+    """Return every forcing variable as a constant field
+    """
+    return dict((name, np.full(shape, value, dtype=np.float64))
+                for name in Layering.FORCING_VARIABLES)
+
+
+def _write(path, value, missingColumn=None, shape=(3, 4)):
+    """Write a downscaled file with every forcing variable constant
+    """
+    nc = Dataset(path, 'w')
+    nc.createDimension('Time', None)
+    nc.createDimension('south_north', shape[0])
+    nc.createDimension('west_east', shape[1])
+    for name in Layering.FORCING_VARIABLES:
+        var = nc.createVariable(name, 'f4',
+                                ('Time', 'south_north', 'west_east'),
+                                fill_value=FILL)
+        var.units = Layering.VARIABLE_ATTRIBUTES[name][0]
+        data = np.full((1,) + shape, value)
+        if (missingColumn is not None):
+            data[0, :, missingColumn] = FILL
+        var[:] = data
+    nc.close()
+
+
+class _Coverage:
+    """Stands in for CoverageMask.Coverage, counting the lookups
+    """
+
+    def __init__(self):
+        self.lookups = 0
+
+    def missing(self, field):
+        self.lookups += 1
+        return Layering.missingMask(field)
+
+
+class MissingMaskTest(unittest.TestCase):
+
+    def test_fill_and_nan_are_missing(self):
+        field = np.array([[1.0, FILL], [np.nan, 2.0 * FILL]])
+        np.testing.assert_array_equal(Layering.missingMask(field),
+                                      [[False, True], [True, True]])
+
+
+class MosaicTest(unittest.TestCase):
+
+    def test_highest_priority_valid_value_wins(self):
+        mrms = {'RAINRATE': np.array([[5.0, FILL, np.nan, FILL]])}
+        hrrr = {'RAINRATE': np.array([[2.0, 3.0, FILL, FILL]])}
+        rap = {'RAINRATE': np.array([[1.0, 1.0, 1.0, 1.0]])}
+        out = Layering.mosaic({'RAINRATE': ['MRMS', 'HRRR', 'RAP']},
+                              {'MRMS': mrms, 'HRRR': hrrr, 'RAP': rap})
+        np.testing.assert_array_equal(out['RAINRATE'],
+                                      [[5.0, 3.0, 1.0, 1.0]])
+
+    def test_missing_mask_overrides_values(self):
+        # cells a source mask marks missing are not taken, whatever they
+        # hold, as where the HRRR coverage ends
+        hrrr = {'T2D': np.array([[10.0, 11.0, 12.0]])}
+        rap = {'T2D': np.array([[20.0, 21.0, 22.0]])}
+        mask = np.array([[False, True, False]])
+        out = Layering.mosaic({'T2D': ['HRRR', 'RAP']},
+                              {'HRRR': hrrr, 'RAP': rap}, {'HRRR': mask})
+        np.testing.assert_array_equal(out['T2D'], [[10.0, 21.0, 12.0]])
+
+    def test_single_source_is_taken_as_is(self):
+        rap = {'LWDOWN': np.array([[300.0, FILL]])}
+        out = Layering.mosaic({'LWDOWN': ['RAP']}, {'RAP': rap})
+        np.testing.assert_array_equal(out['LWDOWN'], [[300.0, FILL]])
+
+    def test_float64_base_is_filled_in_place(self):
+        hrrr = {'T2D': np.array([[1.0, FILL]])}
+        base = np.array([[7.0, 8.0]])
+        out = Layering.mosaic({'T2D': ['HRRR', 'RAP']},
+                              {'HRRR': hrrr, 'RAP': {'T2D': base}})
+        self.assertTrue(out['T2D'] is base)
+        np.testing.assert_array_equal(base, [[1.0, 8.0]])
+        np.testing.assert_array_equal(hrrr['T2D'], [[1.0, FILL]])
+
+    def test_other_bases_are_copied(self):
+        hrrr = {'T2D': np.array([[1.0, FILL]])}
+        ints = np.array([[7, 8]], dtype=np.int32)
+        readOnly = np.array([[7.0, 8.0]])
+        readOnly.flags.writeable = False
+        for base in (ints, readOnly):
+            out = Layering.mosaic({'T2D': ['HRRR', 'RAP']},
+                                  {'HRRR': hrrr, 'RAP': {'T2D': base}})
+            self.assertFalse(out['T2D'] is base)
+            self.assertEqual(out['T2D'].dtype, np.float64)
+            np.testing.assert_array_equal(out['T2D'], [[1.0, 8.0]])
+            np.testing.assert_array_equal(base, [[7, 8]])
+
+
+class LayerFieldsTest(unittest.TestCase):
+
+    def test_short_range_layering(self):
+        hrrr = _fields(1.0)
+        rap = _fields(2.0)
+        mask = np.zeros((3, 4), dtype=bool)
+        mask[:, 3] = True
+        out = Layering.layerFields(hrrr, rap, mask)
+        self.assertEqual(sorted(out.keys()),
+                         sorted(Layering.FORCING_VARIABLES))
+        for name in Layering.FORCING_VARIABLES:
+            if (name in Layering.SECONDARY_ONLY_VARIABLES):
+                np.testing.assert_array_equal(out[name], 2.0)
+            else:
+                np.testing.assert_array_equal(out[name][:, 0:3], 1.0)
+                np.testing.assert_array_equal(out[name][:, 3], 2.0)
+
+    def test_missing_primary_values_are_not_filled_outside_the_mask(self):
+        # layer() puts the missing cells of the primary T2D in the mask;
+        # a variable missing elsewhere is kept missing, as in combine.ncl
+        hrrr = _fields(1.0)
+        hrrr['Q2D'][0, 0] = FILL
+        rap = _fields(2.0)
+        mask = Layering.missingMask(hrrr[Layering.MASK_VARIABLE])
+        out = Layering.layerFields(hrrr, rap, mask)
+        self.assertEqual(out['Q2D'][0, 0], FILL)
+
+
+class ReadFieldsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_fill_value_is_normalized(self):
+        path = os.path.join(self._dir, 'in.nc')
+        nc = Dataset(path, 'w')
+        nc.createDimension('Time', 1)
+        nc.createDimension('south_north', 2)
+        nc.createDimension('west_east', 2)
+        var = nc.createVariable('T2D', 'f4',
+                                ('Time', 'south_north', 'west_east'),
+                                fill_value=-999.0)
+        var[:] = np.array([[[280.0, -999.0], [281.0, 282.0]]])
+        nc.close()
+        fields = Layering.readFields(path, ['T2D'])
+        self.assertEqual(fields['T2D'].shape, (2, 2))
+        np.testing.assert_array_equal(
+            Layering.missingMask(fields['T2D']),
+            [[False, True], [False, False]])
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _pair(self, lead, missingColumn=None, shape=(3, 4)):
+        """Write an HRRR and a RAP file, return their paths and the output
+        """
+        hrrr = os.path.join(self._dir, 'hrrr%d.nc' %(lead))
+        rap = os.path.join(self._dir, 'rap%d.nc' %(lead))
+        _write(hrrr, 1.0, missingColumn, shape)
+        _write(rap, 2.0, shape=shape)
+        return (hrrr, rap, os.path.join(self._dir, 'out%d.nc' %(lead)))
+
+    def test_mask_is_looked_up_once(self):
+        coverage = _Coverage()
+        batch = Layering.Batch(coverage)
+        for lead in [1, 2]:
+            self.assertTrue(batch.layer(*self._pair(lead, 3)))
+        self.assertEqual(coverage.lookups, 1)
+        for lead in [1, 2]:
+            out = Layering.readFields(os.path.join(self._dir,
+                                                   'out%d.nc' %(lead)),
+                                      ['T2D', 'LWDOWN'])
+            np.testing.assert_array_equal(out['T2D'][:, 0:3], 1.0)
+            np.testing.assert_array_equal(out['T2D'][:, 3], 2.0)
+            np.testing.assert_array_equal(out['LWDOWN'], 2.0)
+        nc = Dataset(os.path.join(self._dir, 'out2.nc'))
+        try:
+            self.assertEqual(nc.variables['T2D'].units, 'K')
+            self.assertEqual(nc.variables['T2D'].shape, (1, 3, 4))
+        finally:
+            nc.close()
+
+    def test_another_grid_gets_its_own_mask_and_layout(self):
+        coverage = _Coverage()
+        batch = Layering.Batch(coverage)
+        batch.layer(*self._pair(1, 3))
+        self.assertTrue(batch.layer(*self._pair(2, 0, shape=(2, 2))))
+        self.assertEqual(coverage.lookups, 2)
+        out = Layering.readFields(os.path.join(self._dir, 'out2.nc'),
+                                  ['T2D'])
+        np.testing.assert_array_equal(out['T2D'], [[2.0, 1.0], [2.0, 1.0]])
+
+    def test_missing_input(self):
+        hrrr, rap, out = self._pair(1)
+        os.remove(rap)
+        self.assertFalse(Layering.Batch().layer(hrrr, rap, out))
+        self.assertFalse(os.path.exists(out))
+
+
+if __name__ == '__main__':
+    unittest.main()
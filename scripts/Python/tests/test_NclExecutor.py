@@ -0,0 +1,148 @@
+"""Tests of NclExecutor: commands run without a shell, with their output
+captured, killed when they time out and retried when they fail, and are
+admitted by their learned memory estimates
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import NclExecutor
+
+
+def _python(code):
+    """Return the command running a Python snippet, standing in for NCL
+    """
+    return [sys.executable, '-c', code]
+
+
+class ExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._retryDelay = NclExecutor.RETRY_DELAY_SECONDS
+        NclExecutor.RETRY_DELAY_SECONDS = 0
+
+    def tearDown(self):
+        NclExecutor.RETRY_DELAY_SECONDS = self._retryDelay
+
+    def test_output_is_captured(self):
+        e = NclExecutor.Executor(retries=0)
+        result = e.run(_python("import sys; sys.stdout.write('out'); "
+                               "sys.stderr.write('err')"))
+        self.assertTrue(result.ok())
+        self.assertEqual(result._returnCode, 0)
+        self.assertEqual(result._stdout, 'out')
+        self.assertEqual(result._stderr, 'err')
+        self.assertEqual(result._attempts, 1)
+
+    def test_arguments_are_not_interpreted_by_a_shell(self):
+        e = NclExecutor.Executor(retries=0)
+        arg = 'inFile="/data/a b;$(touch x)*.nc"'
+        result = e.run(_python("import sys; sys.stdout.write(sys.argv[1])") +
+                       [arg])
+        self.assertTrue(result.ok())
+        self.assertEqual(result._stdout, arg)
+
+    def test_failure_is_retried(self):
+        e = NclExecutor.Executor(retries=2)
+        result = e.run(_python("import sys; sys.exit(3)"))
+        self.assertFalse(result.ok())
+        self.assertEqual(result._status, NclExecutor.FAILED)
+        self.assertEqual(result._returnCode, 3)
+        self.assertEqual(result._attempts, 3)
+
+    def test_timeout_kills_the_run(self):
+        e = NclExecutor.Executor(timeout=0.5, retries=0)
+        start = time.time()
+        result = e.run(_python("import time; time.sleep(30)"))
+        self.assertEqual(result._status, NclExecutor.TIMEOUT)
+        self.assertTrue(result._returnCode < 0)
+        self.assertTrue(time.time() - start < 10)
+
+    def test_missing_executable_is_not_retried(self):
+        e = NclExecutor.Executor(retries=2)
+        result = e.run(['/nonexistent/ncl', 'script.ncl'])
+        self.assertEqual(result._status, NclExecutor.NOT_STARTED)
+        self.assertEqual(result._attempts, 1)
+        self.assertTrue(result._returnCode is None)
+
+
+class MemoryAdmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._model = os.path.join(self._dir, 'ncl_memory.json')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_peak_memory_is_learned_and_saved(self):
+        e = NclExecutor.Executor(retries=0, defaultJobMb=123456,
+                                 modelFile=self._model)
+        result = e.run(_python("pass"))
+        self.assertTrue(result._peakMb > 0)
+        self.assertEqual(e.estimateMb(result.stage()), result._peakMb)
+        # read back by the next process
+        e = NclExecutor.Executor(modelFile=self._model)
+        self.assertEqual(e.estimateMb(result.stage()), result._peakMb)
+        self.assertEqual(e.estimateMb('other.ncl'),
+                         NclExecutor.DEFAULT_JOB_MB)
+
+    def test_estimate_decays_towards_lower_peaks(self):
+        e = NclExecutor.Executor()
+        e._release('a.ncl', e._acquire('a.ncl'), 1000.0)
+        e._release('a.ncl', e._acquire('a.ncl'), 500.0)
+        self.assertEqual(e.estimateMb('a.ncl'),
+                         NclExecutor.COST_DECAY*1000.0 +
+                         (1.0 - NclExecutor.COST_DECAY)*500.0)
+        e._release('a.ncl', e._acquire('a.ncl'), 2000.0)
+        self.assertEqual(e.estimateMb('a.ncl'), 2000.0)
+
+    def test_runs_wait_for_the_budget(self):
+        e = NclExecutor.Executor(budgetMb=100, defaultJobMb=60)
+        # one run is always admitted, even above the budget
+        big = NclExecutor.Executor(budgetMb=10, defaultJobMb=60)
+        big._release('a.ncl', big._acquire('a.ncl'), 0)
+        cost = e._acquire('a.ncl')
+        admitted = threading.Event()
+
+        def second():
+            e._release('b.ncl', e._acquire('b.ncl'), 0)
+            admitted.set()
+
+        t = threading.Thread(target=second)
+        t.daemon = True
+        t.start()
+        self.assertFalse(admitted.wait(0.3))
+        e._release('a.ncl', cost, 0)
+        self.assertTrue(admitted.wait(5))
+        t.join(5)
+        self.assertEqual(e._running, 0)
+        self.assertEqual(e._reservedMb, 0.0)
+
+
+class NclArgsTest(unittest.TestCase):
+
+    def test_parameters_are_single_arguments(self):
+        args = NclExecutor.nclArgs('/usr/bin/ncl', '/scripts/combine.ncl',
+                                   [('inFile', '/data/in file.nc'),
+                                    ('outFile', '/data/out.nc')])
+        self.assertEqual(args, ['/usr/bin/ncl', '-Q',
+                                'inFile="/data/in file.nc"',
+                                'outFile="/data/out.nc"',
+                                '/scripts/combine.ncl'])
+
+    def test_stage_is_the_script(self):
+        result = NclExecutor.Result(['/usr/bin/ncl', '-Q', 'a="b"',
+                                     '/scripts/combine.ncl'])
+        self.assertEqual(result.stage(), 'combine.ncl')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""Tests of QpeBlend: the bias-weighted blend of layer_anal_assim.ncl, its
+parameter files and the cache of decoded parameter grids.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import QpeBlend
+
+
+def _grids(value=1.0, shape=(1, 3)):
+    """Return every bias and weight grid as a constant grid
+    """
+    grids = {}
+    for product in QpeBlend.PARAMETER_PREFIXES:
+        for kind in ['bias', 'weight']:
+            grids[(product, kind)] = np.full(shape, value)
+    return grids
+
+
+class BlendTest(unittest.TestCase):
+
+    def test_weighted_sum_of_bias_corrected_products(self):
+        grids = _grids()
+        grids[('RAP', 'weight')][:] = 0.2
+        grids[('HRRR', 'weight')][:] = 0.3
+        grids[('MRMS', 'weight')][:] = 0.5
+        grids[('MRMS', 'bias')][:] = 2.0
+        rain = QpeBlend.blend(np.full((1, 3), 10.0), np.full((1, 3), 20.0),
+                              np.full((1, 3), 1.0), grids)
+        np.testing.assert_allclose(rain, 2.0 + 6.0 + 1.0)
+
+    def test_missing_bias_means_no_correction(self):
+        grids = _grids()
+        grids[('RAP', 'bias')] = np.array([[np.nan, 3.0, np.nan]])
+        zero = np.zeros((1, 3))
+        rain = QpeBlend.blend(np.full((1, 3), 2.0), zero, zero, grids)
+        np.testing.assert_allclose(rain, [[2.0, 6.0, 2.0]])
+
+    def test_missing_hrrr_and_mrms_are_dropped(self):
+        nan = np.nan
+        rain = QpeBlend.blend(np.array([[1.0, 1.0, 1.0]]),
+                              np.array([[2.0, nan, 2.0]]),
+                              np.array([[4.0, 4.0, nan]]), _grids())
+        np.testing.assert_allclose(rain, [[7.0, 5.0, 3.0]])
+
+    def test_missing_only_where_rap_is(self):
+        nan = np.nan
+        rain = QpeBlend.blend(np.array([[nan, 1.0, nan]]),
+                              np.array([[2.0, 2.0, nan]]),
+                              np.array([[4.0, nan, nan]]), _grids())
+        self.assertTrue(np.isnan(rain[0, 0]))
+        self.assertEqual(rain[0, 1], 3.0)
+        self.assertTrue(np.isnan(rain[0, 2]))
+
+
+class ParameterFilesTest(unittest.TestCase):
+
+    def test_files_of_a_month(self):
+        files = QpeBlend.parameterFiles('/parm', 3)
+        self.assertEqual(len(files), 6)
+        self.assertEqual(files[('HRRR', 'bias')],
+                         '/parm/HRRR_CMC-CPC_bias-corr_m03_v8_wrf1km.grb2')
+        self.assertEqual(files[('RAP', 'weight')],
+                         '/parm/RAPD_wgt_m03_v7_wrf1km.grb2')
+
+    def test_mrms_grids_are_read_as_the_ncl_script_does(self):
+        files = QpeBlend.parameterFiles('/parm', 12)
+        self.assertEqual(files[('MRMS', 'bias')],
+                         '/parm/MRMS_radonly_wgt_m12_v7_wrf1km.grb2')
+        self.assertEqual(files[('MRMS', 'weight')],
+                         '/parm/MRMS_radonly_CMC-CPC_bias-corr_m12_v8_wrf1km.grb2')
+
+
+class ParameterGridCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._grib = os.path.join(self._dir, 'HRRR_wgt_m01_v7_wrf1km.grb2')
+        with open(self._grib, 'w') as f:
+            f.write('grib')
+        self._cacheDir = os.path.join(self._dir, 'cache')
+        os.makedirs(self._cacheDir)
+        # a decoded copy, newer than the GRIB2 file
+        past = time.time() - 60
+        os.utime(self._grib, (past, past))
+        np.save(os.path.join(self._cacheDir,
+                             os.path.basename(self._grib) + ".npy"),
+                np.array([[0.5, np.nan]]))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_decoded_grid_is_mapped_once(self):
+        cache = QpeBlend.ParameterGridCache(self._cacheDir)
+        grid = cache.grid(self._grib)
+        self.assertTrue(isinstance(grid, np.memmap))
+        self.assertFalse(grid.flags.writeable)
+        self.assertEqual(grid[0, 0], 0.5)
+        self.assertTrue(np.isnan(grid[0, 1]))
+        self.assertTrue(cache.grid(self._grib) is grid)
+
+    def test_cache_is_shared_per_directory(self):
+        self.assertTrue(QpeBlend.cacheFor(self._cacheDir) is
+                        QpeBlend.cacheFor(self._cacheDir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+"""Tests of Scheduler: dependencies, failures, priorities, fallbacks,
+deadlines and staging
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import Scheduler
+
+# Longest a test waits for tasks to finish
+TIMEOUT_SECONDS = 10
+
+
+def _finish(scheduler, names):
+    """Wait until the tasks are done or failed
+    """
+    end = time.time() + TIMEOUT_SECONDS
+    while (time.time() < end):
+        if (all(scheduler.state(n) in (Scheduler.DONE, Scheduler.FAILED)
+                for n in names)):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def _value(x):
+    return x
+
+
+def _raise(why):
+    raise Scheduler.TaskError(why)
+
+
+def _exit():
+    sys.exit(2)
+
+
+def _interrupt():
+    raise KeyboardInterrupt()
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._schedulers = []
+        self._s = self._scheduler(2)
+
+    def tearDown(self):
+        for s in self._schedulers:
+            s.shutdown(TIMEOUT_SECONDS)
+
+    def _scheduler(self, numWorkers, stageAhead=0):
+        """Return a scheduler shut down by tearDown()
+        """
+        s = Scheduler.Scheduler(numWorkers, stageAhead=stageAhead)
+        self._schedulers.append(s)
+        return s
+
+    def test_dependencies_run_first(self):
+        s = self._s
+        ran = []
+        s.add('b', lambda: ran.append('b') or s.result('a') + 1, deps=['a'])
+        self.assertEqual(s.state('b'), Scheduler.WAITING)
+        s.add('a', lambda: ran.append('a') or 1)
+        self.assertTrue(_finish(s, ['a', 'b']))
+        self.assertEqual(ran, ['a', 'b'])
+        self.assertEqual(s.result('b'), 2)
+        self.assertFalse(s.add('a', _value, (3,)))
+
+    def test_failure_fails_dependents(self):
+        s = self._s
+        s.add('a', _raise, ('broken',))
+        s.add('b', _value, (1,), deps=['a'])
+        self.assertTrue(_finish(s, ['a', 'b']))
+        self.assertEqual(s.state('a'), Scheduler.FAILED)
+        self.assertEqual(s.state('b'), Scheduler.FAILED)
+        self.assertTrue(s.result('a') is None)
+        # added after the dependency failed
+        s.add('c', _value, (1,), deps=['a'])
+        self.assertEqual(s.state('c'), Scheduler.FAILED)
+
+    def test_exits_and_interrupts_fail_the_task_only(self):
+        s = self._scheduler(1)
+        s.add('exit', _exit)
+        s.add('interrupt', _interrupt)
+        s.add('after', _value, (1,))
+        self.assertTrue(_finish(s, ['exit', 'interrupt', 'after']))
+        self.assertEqual(s.state('exit'), Scheduler.FAILED)
+        self.assertEqual(s.state('interrupt'), Scheduler.FAILED)
+        self.assertEqual(s.result('after'), 1)
+        self.assertEqual(s.counts(), {Scheduler.FAILED: 2,
+                                      Scheduler.DONE: 1})
+
+    def test_shutdown_stops_the_workers(self):
+        s = self._scheduler(2)
+        s.add('a', _value, (1,))
+        self.assertTrue(_finish(s, ['a']))
+        s.shutdown(TIMEOUT_SECONDS)
+        self.assertFalse([t for t in s._workers if t.is_alive()])
+        # added after the shutdown, never run
+        s.add('b', _value, (1,))
+        time.sleep(0.1)
+        self.assertEqual(s.state('b'), Scheduler.READY)
+
+    def test_failed_optional_dependency_falls_back(self):
+        s = self._s
+        s.add('layer', _value, ('layered',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(_value, ('passthrough',)))
+        s.add('rap', _value, (1,))
+        s.add('hrrr', _raise, ('no HRRR',))
+        self.assertTrue(_finish(s, ['layer']))
+        self.assertEqual(s.result('layer'), 'passthrough')
+
+    def test_failed_required_dependency_does_not_fall_back(self):
+        s = self._s
+        s.add('layer', _value, ('layered',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(_value, ('passthrough',)))
+        s.add('hrrr', _value, (1,))
+        s.add('rap', _raise, ('no RAP',))
+        self.assertTrue(_finish(s, ['layer']))
+        self.assertEqual(s.state('layer'), Scheduler.FAILED)
+
+    def test_optional_dependency_done_in_time(self):
+        s = self._s
+        s.add('layer', _value, ('layered',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(_value, ('passthrough',)),
+              deadline=time.time() + 60)
+        s.add('rap', _value, (1,))
+        s.add('hrrr', _value, (1,))
+        self.assertTrue(_finish(s, ['layer']))
+        self.assertEqual(s.result('layer'), 'layered')
+
+    def test_deadline_falls_back(self):
+        s = self._s
+        start = time.time()
+        s.add('rap', _value, (1,))
+        s.add('layer', _value, ('layered',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(_value, ('passthrough',)),
+              deadline=start + 0.5)
+        self.assertTrue(_finish(s, ['layer']))
+        self.assertTrue(time.time() - start >= 0.5)
+        self.assertEqual(s.result('layer'), 'passthrough')
+        # the optional dependency arriving late changes nothing
+        s.add('hrrr', _value, (1,))
+        self.assertTrue(_finish(s, ['hrrr']))
+        self.assertEqual(s.result('layer'), 'passthrough')
+
+    def test_deadline_waits_for_required_dependencies(self):
+        s = self._s
+        s.add('layer', _value, ('layered',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(_value, ('passthrough',)),
+              deadline=time.time() + 0.1)
+        time.sleep(0.3)
+        self.assertEqual(s.state('layer'), Scheduler.WAITING)
+        s.add('rap', _value, (1,))
+        self.assertTrue(_finish(s, ['layer']))
+        self.assertEqual(s.result('layer'), 'passthrough')
+
+    def test_fail_missing(self):
+        s = self._s
+        s.add('layer', _value, ('layered',), deps=['hrrr', 'rap'],
+              optional=['hrrr'], fallback=(_value, ('passthrough',)))
+        s.add('rap', _value, (1,))
+        s.add('other', _value, (1,), deps=['gone'])
+        self.assertTrue(_finish(s, ['rap']))
+        self.assertEqual(s.failMissing("no input"), 2)
+        self.assertTrue(_finish(s, ['layer', 'other']))
+        self.assertEqual(s.result('layer'), 'passthrough')
+        self.assertEqual(s.state('other'), Scheduler.FAILED)
+
+    def test_priority_order(self):
+        s = self._scheduler(1)
+        gate = threading.Event()
+        ran = []
+        s.add('gate', gate.wait, (TIMEOUT_SECONDS,))
+        time.sleep(0.1)
+        s.add('long', ran.append, ('long',), priority=Scheduler.LONG_RANGE)
+        s.add('short2', ran.append, ('short2',), lead=2)
+        s.add('short1', ran.append, ('short1',), lead=1)
+        s.add('anal', ran.append, ('anal',), priority=Scheduler.ANALYSIS)
+        gate.set()
+        self.assertTrue(_finish(s, ['long', 'short2', 'short1', 'anal']))
+        self.assertEqual(ran, ['anal', 'short1', 'short2', 'long'])
+
+    def test_staged_in_run_order(self):
+        s = self._scheduler(1, stageAhead=2)
+        gate = threading.Event()
+        log = []
+
+        def add(name, **kwargs):
+            s.add(name, log.append, ('run ' + name,),
+                  stage=(log.append, ('stage ' + name,)),
+                  unstage=(log.append, ('unstage ' + name,)), **kwargs)
+
+        s.add('gate', gate.wait, (TIMEOUT_SECONDS,))
+        time.sleep(0.1)
+        add('f3', lead=3)
+        add('f2', lead=2)
+        # more urgent than both, pushes out the least urgent one
+        add('anal', priority=Scheduler.ANALYSIS)
+        add('f1', lead=1)
+        self.assertEqual(log, ['stage f3', 'stage f2', 'unstage f3',
+                               'stage anal', 'unstage f2', 'stage f1'])
+        del log[:]
+        gate.set()
+        self.assertTrue(_finish(s, ['anal', 'f1', 'f2', 'f3']))
+        # each start makes room for the next one
+        self.assertEqual(log, ['stage f2', 'run anal', 'stage f3', 'run f1',
+                               'run f2', 'run f3'])
+
+    def test_failed_staging_does_not_fail_the_task(self):
+        s = self._scheduler(1, stageAhead=1)
+        s.add('a', _value, (1,), stage=(_raise, ('no room',)))
+        self.assertTrue(_finish(s, ['a']))
+        self.assertEqual(s.result('a'), 1)
+
+    def test_no_staging_without_stage_ahead(self):
+        staged = []
+        self._s.add('a', _value, (1,), stage=(staged.append, ('a',)))
+        self.assertTrue(_finish(self._s, ['a']))
+        self.assertEqual(staged, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
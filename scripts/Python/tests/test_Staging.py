@@ -0,0 +1,145 @@
+"""Tests of Staging: copies are made ahead of use, read instead of the
+inputs, and removed when their consumers released them
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import Staging
+
+# Longest a test waits for a copy
+TIMEOUT_SECONDS = 10
+
+
+def _copied(stager, path):
+    """Wait until the copy of a file is made, or failed
+    """
+    end = time.time() + TIMEOUT_SECONDS
+    while (time.time() < end):
+        with stager._lock:
+            e = stager._entries.get(path)
+            if (e is None or e._state in (Staging.READY, Staging.FAILED)):
+                return
+        time.sleep(0.01)
+
+
+class StagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._data = os.path.join(self._dir, 'data', '20160301')
+        os.makedirs(self._data)
+        self._scratch = os.path.join(self._dir, 'scratch')
+        self._stagers = []
+
+    def tearDown(self):
+        for s in self._stagers:
+            s.close()
+        shutil.rmtree(self._dir)
+
+    def _stager(self, maxBytes=1000000, lookahead=16):
+        """Return a stager closed by tearDown()
+        """
+        s = Staging.Stager(self._scratch, maxBytes, 2, lookahead)
+        self._stagers.append(s)
+        return s
+
+    def _input(self, name, size=10):
+        path = os.path.join(self._data, name)
+        with open(path, 'w') as f:
+            f.write('x'*size)
+        return path
+
+    def test_staged_copy_is_read_and_removed_on_release(self):
+        s = self._stager()
+        path = self._input('a.grb2')
+        self.assertTrue(s.prefetch(path))
+        _copied(s, path)
+        local = s.local(path)
+        self.assertNotEqual(local, path)
+        self.assertTrue(local.startswith(self._scratch))
+        with open(local) as f:
+            self.assertEqual(f.read(), 'x'*10)
+        s.release(path)
+        self.assertFalse(os.path.exists(local))
+        self.assertEqual(s.local(path), path)
+
+    def test_copy_is_kept_until_every_consumer_released_it(self):
+        s = self._stager()
+        path = self._input('a.grb2')
+        s.prefetch(path, 2)
+        _copied(s, path)
+        local = s.local(path)
+        s.release(path)
+        self.assertTrue(os.path.exists(local))
+        s.release(path)
+        self.assertFalse(os.path.exists(local))
+
+    def test_lookahead_stages_the_next_file_on_release(self):
+        s = self._stager(lookahead=1)
+        a = self._input('a.grb2')
+        b = self._input('b.grb2')
+        s.prefetch(a)
+        s.prefetch(b)
+        self.assertEqual(list(s._entries.keys()), [a])
+        self.assertEqual(list(s._waiting.keys()), [b])
+        _copied(s, a)
+        s.release(a)
+        self.assertEqual(list(s._entries.keys()), [b])
+        self.assertEqual(len(s._waiting), 0)
+
+    def test_waiting_file_released_is_not_staged(self):
+        # as when the scheduler pushes a task out of the staging window
+        s = self._stager(lookahead=1)
+        a = self._input('a.grb2')
+        b = self._input('b.grb2')
+        s.prefetch(a)
+        s.prefetch(b)
+        s.release(b)
+        _copied(s, a)
+        s.release(a)
+        self.assertEqual(len(s._entries), 0)
+        self.assertEqual(len(s._waiting), 0)
+
+    def test_waiting_file_needed_is_read_in_place(self):
+        s = self._stager(lookahead=1)
+        a = self._input('a.grb2')
+        b = self._input('b.grb2')
+        s.prefetch(a)
+        s.prefetch(b)
+        self.assertEqual(s.local(b), b)
+        self.assertEqual(len(s._waiting), 0)
+
+    def test_file_that_does_not_fit_is_not_staged(self):
+        s = self._stager(maxBytes=50)
+        self.assertFalse(s.prefetch(self._input('big.grb2', 100)))
+        self.assertTrue(s.prefetch(self._input('small.grb2', 40)))
+        self.assertFalse(s.prefetch(os.path.join(self._data, 'none.grb2')))
+
+    def test_needed_copies_are_not_evicted(self):
+        s = self._stager(maxBytes=50)
+        a = self._input('a.grb2', 40)
+        b = self._input('b.grb2', 40)
+        s.prefetch(a)
+        self.assertFalse(s.prefetch(b))
+        _copied(s, a)
+        s.release(a)
+        self.assertTrue(s.prefetch(b))
+        self.assertEqual(list(s._entries.keys()), [b])
+
+    def test_stale_directories_are_removed(self):
+        stale = os.path.join(self._scratch, '999999999')
+        os.makedirs(stale)
+        s = self._stager()
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.isdir(s._dir))
+
+
+if __name__ == '__main__':
+    unittest.main()